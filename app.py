@@ -3,8 +3,30 @@ from aiogram.fsm.storage.memory import MemoryStorage
 import asyncio
 import logging
 import os
+import sys
 from dotenv import load_dotenv
 from bot_core.handlers import router  
+from bot_core.metrics import registry, start_metrics_server
+from bot_core.middlewares import register_middlewares
+from bot_core.outbound import OutboundMiddleware, outbound_queue
+from bot_core.scheduler import STATS_TOP_CHATS, chat_scheduler
+from bot_core.webhook import run_webhook
+from db_layer.answer_log import answer_log
+from db_layer.metric_buffer import metric_buffer
+from db_layer.metric_decay import metric_decay_job
+from db_layer.migrations import run_migrations
+from db_layer.async_repository import run_in_db_thread
+from db_layer.confusion_index import confusion_index
+from db_layer.instrumentation import query_stats
+from db_layer.relation_index import relation_index
+from db_layer.sentence_cache import sentence_cache
+from db_layer.word_index import reindex_words
+from db_layer.word_pool import word_pool
+from cache_system.session_backend import get_session_backend
+from learning_modules.repetition import review_scheduler
+from lessons.content import lesson_content
+from lessons.keyboards import lesson_keyboards
+from lessons.navigation import reload_lesson_graph
 
     
 # Загружаем переменные среды из .env
@@ -12,20 +34,95 @@ load_dotenv('.env')
 
 # Настройка логгирования
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-# Подключаемся к хранилищу состояний
-storage = MemoryStorage()
+# Подключаемся к хранилищу состояний: Redis нужен, если воркеров несколько
+if os.getenv('SESSION_BACKEND', 'memory') == 'redis':
+    from aiogram.fsm.storage.redis import RedisStorage
+    from cache_system.redis_config import REDIS_URL
+    storage = RedisStorage.from_url(REDIS_URL)
+else:
+    storage = MemoryStorage()
 
-# Создаем экземпляр бота и диспетчер
-bot = Bot(token=os.getenv('BOT_TOKEN'))
+# Создаем экземпляр бота и диспетчер; TELEGRAM_API_URL позволяет подменить Bot API локальной заглушкой
+if os.getenv('TELEGRAM_API_URL'):
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    api_session = AiohttpSession(api=TelegramAPIServer.from_base(os.getenv('TELEGRAM_API_URL')))
+    bot = Bot(token=os.getenv('BOT_TOKEN'), session=api_session)
+else:
+    bot = Bot(token=os.getenv('BOT_TOKEN'))
 dp = Dispatcher(storage=storage)
 
+# Все сообщения в чаты идут через исходящую очередь с ограничением скорости
+bot.session.middleware(OutboundMiddleware(outbound_queue))
+
+# Обновления одного чата обрабатываются по порядку, разных чатов — параллельно; по каждому собираются метрики
+register_middlewares(dp)
+
+# Состояние кэшей и очередей в метриках
+registry.register_collector('scheduler', chat_scheduler.stats)
+registry.register_collector('scheduler_chats', lambda: chat_scheduler.deepest_chat_stats(STATS_TOP_CHATS))
+registry.register_collector('outbound', outbound_queue.stats)
+registry.register_collector('metric_buffer', metric_buffer.stats)
+registry.register_collector('answer_log', answer_log.stats)
+registry.register_collector('metric_decay', metric_decay_job.stats)
+registry.register_collector('review_scheduler', review_scheduler.stats)
+registry.register_collector('word_pool', word_pool.stats)
+registry.register_collector('relation_index', relation_index.stats)
+registry.register_collector('confusion_index', confusion_index.stats)
+registry.register_collector('sentence_cache', sentence_cache.stats)
+registry.register_collector('lesson_keyboards', lesson_keyboards.stats)
+registry.register_collector('lesson_content', lesson_content.stats)
+registry.register_collector('sessions', lambda: get_session_backend().stats())
+registry.register_collector('sql', query_stats)
+
 # Регистрируем наши обработчики
 dp.include_router(router)
 
-# Основная функция для запуска бота с использованием стандартного поллинга
+# Режим получения обновлений: polling или webhook (BOT_MODE или первый аргумент командной строки)
+BOT_MODE = sys.argv[1] if len(sys.argv) > 1 else os.getenv('BOT_MODE', 'polling')
+
+# Основная функция для запуска бота
 async def main():
-    await dp.start_polling(bot)
+    run_migrations()
+    # Слова, добавленные парсерами после прошлого запуска, попадают в индекс форм
+    await run_in_db_thread(reindex_words)
+    # Граф уроков, меню, снимки страниц, индексы связей и путаницы загружаем заранее, чтобы первый пользователь не ждал запроса
+    await run_in_db_thread(reload_lesson_graph)
+    await run_in_db_thread(lesson_keyboards.refresh)
+    await run_in_db_thread(lesson_content.load)
+    await run_in_db_thread(relation_index.load)
+    await run_in_db_thread(confusion_index.load)
+    metric_buffer.start()
+    answer_log.start()
+    review_scheduler.start()
+    metric_decay_job.start()
+    chat_scheduler.start()
+    outbound_queue.start()
+    metrics_runner = await start_metrics_server()
+    try:
+        if BOT_MODE == 'webhook':
+            await run_webhook(dp, bot)
+        else:
+            # Вебхук и getUpdates несовместимы: снимаем вебхук перед поллингом
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await metric_decay_job.stop()
+        await chat_scheduler.stop()
+        # Обработчики завершены: досылаем их сообщения
+        await outbound_queue.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        # Дописываем накопленные метрики, карточки повторения и ответы перед остановкой;
+        # ошибка одного буфера не мешает записать остальные
+        for name, buffer in (('metric_buffer', metric_buffer), ('review_scheduler', review_scheduler),
+                             ('answer_log', answer_log)):
+            try:
+                await buffer.stop()
+            except Exception as e:
+                logger.error(f"Не удалось записать буфер {name} при остановке: {e}", exc_info=True)
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+Генерация синтетических баз данных для бенчмарков.
+
+Схема создаётся по моделям, данные вставляются пачками через executemany.
+Соотношения по умолчанию: 30 уроков по 10 страниц, связи — половина числа
+слов, предложения — десятая часть, метрики путаницы — два ряда на слово.
+Слова вставляются мимо ORM, поэтому индекс форм слов заполняется отдельно.
+"""
+import os
+import random
+import sqlite3
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine
+
+from db_layer.models import Base
+from db_layer.word_index import index_missing_words
+
+LESSONS = 30
+PAGES_PER_LESSON = 10
+BATCH = 50_000
+
+
+def _batched_insert(conn: sqlite3.Connection, sql: str, rows) -> None:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH:
+            conn.executemany(sql, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+
+
+def generate_dataset(path: str, words: int = 100_000, relations: Optional[int] = None,
+                     sentences: Optional[int] = None, metrics: Optional[int] = None,
+                     seed: int = 42) -> Dict[str, int]:
+    """
+    Создаёт базу SQLite по пути ``path`` и наполняет её синтетическими данными.
+
+    Возвращает количество строк в каждой таблице.
+    """
+    relations = words // 2 if relations is None else relations
+    sentences = max(words // 10, 1) if sentences is None else sentences
+    metrics = words * 2 if metrics is None else metrics
+    rnd = random.Random(seed)
+
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    _batched_insert(conn, "INSERT INTO pages (num_lesson, num_page, num_message, name_page) VALUES (?, ?, ?, ?)", (
+        (lesson, page, lesson * 100 + page, f"Урок {lesson}, страница {page + 1}")
+        for lesson in range(1, LESSONS + 1) for page in range(PAGES_PER_LESSON)
+    ))
+    _batched_insert(conn, "INSERT INTO words (id, english_word, russian_word, alter_russian_word, num_lesson) "
+                          "VALUES (?, ?, ?, ?, ?)", (
+        (i, f"word{i}", f"слово{i}", f'["вариант{i}"]', rnd.randint(1, LESSONS))
+        for i in range(1, words + 1)
+    ))
+    _batched_insert(conn, "INSERT INTO sentences (text_ru, translation_en, num_lesson) VALUES (?, ?, ?)", (
+        (f"Это предложение номер {i}", f"This is sentence number {i} for the test", rnd.randint(1, LESSONS))
+        for i in range(1, sentences + 1)
+    ))
+    _batched_insert(conn, "INSERT INTO relations (source_word_id, target_word_id, relation_type) VALUES (?, ?, ?)", (
+        (rnd.randint(1, words), rnd.randint(1, words), rnd.choice(("synonym", "antonym")))
+        for _ in range(relations)
+    ))
+    _batched_insert(conn, "INSERT OR IGNORE INTO metric_word_value (word1_id, word2_id, value) VALUES (?, ?, ?)", (
+        (rnd.randint(1, words), rnd.randint(1, words), round(rnd.uniform(0.01, 0.99), 2))
+        for _ in range(metrics)
+    ))
+    conn.commit()
+
+    conn.close()
+
+    # События маппера не срабатывают на вставку через sqlite3: формы слов заполняются явно
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as indexing:
+        index_missing_words(indexing)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    counts = {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("pages", "words", "sentences", "relations", "metric_word_value", "word_forms")
+    }
+    conn.close()
+    return counts
@@ -0,0 +1,148 @@
+"""
+План выполнения и время функций репозитория до и после миграции индексов.
+
+Скрипт создаёт синтетическую базу, удаляет индексы из миграции 2
+и уникальный индекс пар метрик из миграции 1 (как в исходной схеме),
+замеряет каждую функцию репозитория и печатает EXPLAIN QUERY PLAN её
+запросов, затем создаёт индексы заново и повторяет замеры. Upsert метрик
+без уникального индекса невозможен, поэтому замеряется только после.
+
+Запуск:
+    python -m benchmarks.explain_indexes --words 100000 --repeat 20
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--words", type=int, default=100_000, help="количество слов в синтетической базе")
+    parser.add_argument("--repeat", type=int, default=20, help="количество замеров каждой функции")
+    parser.add_argument("--db", help="путь к файлу базы (по умолчанию временный)")
+    return parser.parse_args()
+
+
+# Индекс исходной схемы нет: его удаляют вместе с индексами миграции 2
+UNIQUE_PAIR_INDEX = ("uq_metric_word_pair", "metric_word_value", "word1_id, word2_id")
+# Функции, которым нужен UNIQUE_PAIR_INDEX (ON CONFLICT)
+NEEDS_UNIQUE_INDEX = {"add_or_update_metric_value"}
+
+
+def build_cases(repository, relation_source_id: int):
+    """Функции репозитория с типичными аргументами: (имя, вызов)."""
+    return [
+        ("get_single_random_word", lambda: repository.get_single_random_word()),
+        ("get_single_random_word_from_lesson", lambda: repository.get_single_random_word_from_lesson(5)),
+        ("get_random_words", lambda: repository.get_random_words(123)),
+        ("get_random_words_by_lesson", lambda: repository.get_random_words_by_lesson([123], 5)),
+        ("build_word_question", lambda: repository.build_word_question(5)),
+        ("get_lessons_from_db", lambda: repository.get_lessons_from_db()),
+        ("get_pages_by_lesson", lambda: repository.get_pages_by_lesson(5)),
+        ("get_page_info", lambda: repository.get_page_info(42)),
+        ("get_random_word_with_relations",
+         lambda: repository.get_random_word_with_relations(relation_source_id, "synonym")),
+        ("get_random_sentence", lambda: repository.get_random_sentence()),
+        ("get_random_sentence_by_lesson", lambda: repository.get_random_sentence_by_lesson(5)),
+        ("get_sentences_by_lesson", lambda: repository.get_sentences_by_lesson(5)),
+        ("search_records_by_word", lambda: repository.search_records_by_word(123)),
+        ("find_word_by_text", lambda: repository.find_word_by_text("слово500")),
+        ("add_or_update_metric_value", lambda: repository.add_or_update_metric_value(123, 456)),
+    ]
+
+
+def measure(engine, cases, repeat: int):
+    """Возвращает {имя: (медиана в мс, [(запрос, план)])}."""
+    from sqlalchemy import event
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith("EXPLAIN"):
+            captured.append((statement, parameters))
+
+    results = {}
+    for name, call in cases:
+        call()  # прогрев: загрузка пула слов и кэшей
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            call()
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        statements, captured[:] = list(captured), []
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        plans = []
+        with engine.connect() as conn:
+            for statement, parameters in statements:
+                if not statement.lstrip().upper().startswith("SELECT"):
+                    plans.append((statement, ["(не SELECT)"]))
+                    continue
+                rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+                plans.append((statement, [row[-1] for row in rows]))
+        results[name] = (statistics.median(timings), plans)
+    return results
+
+
+def print_report(title, results):
+    print(f"\n===== {title} =====")
+    for name, (median_ms, plans) in results.items():
+        print(f"\n{name}: {median_ms:.3f} мс")
+        for statement, plan in plans:
+            print("  " + " ".join(statement.split())[:120])
+            for line in plan:
+                print(f"    -> {line}")
+
+
+def main():
+    args = parse_args()
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="verdict-bench-"), "bench.db")
+    # Движок SQLAlchemy создаётся при импорте моделей, поэтому адрес базы задаётся заранее
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+
+    from benchmarks.datasets import generate_dataset
+    from db_layer import repository
+    from db_layer.migrations import HOT_INDEXES, _migration_2
+    from db_layer.models import engine
+
+    counts = generate_dataset(path, words=args.words)
+    print(f"База {path}: {counts}")
+
+    with engine.begin() as conn:
+        relation_source_id = conn.exec_driver_sql("SELECT source_word_id FROM relations LIMIT 1").scalar() or 1
+        for name, _, _ in HOT_INDEXES + [UNIQUE_PAIR_INDEX]:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+        conn.exec_driver_sql("ANALYZE")
+    cases = build_cases(repository, relation_source_id)
+
+    before = measure(engine, [case for case in cases if case[0] not in NEEDS_UNIQUE_INDEX], args.repeat)
+    print_report("До миграции индексов", before)
+
+    with engine.begin() as conn:
+        name, table, columns = UNIQUE_PAIR_INDEX
+        conn.exec_driver_sql(f"CREATE UNIQUE INDEX {name} ON {table} ({columns})")
+        _migration_2(conn)
+    after = measure(engine, cases, args.repeat)
+    print_report("После миграции индексов", after)
+
+    print("\n===== Итог, медиана мс =====")
+    print(f"{'функция':40} {'до':>10} {'после':>10} {'ускорение':>10}")
+    for name in after:
+        new = after[name][0]
+        if name not in before:
+            print(f"{name:40} {'—':>10} {new:10.3f} {'—':>10}")
+            continue
+        old = before[name][0]
+        speedup = old / new if new else float("inf")
+        print(f"{name:40} {old:10.3f} {new:10.3f} {speedup:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
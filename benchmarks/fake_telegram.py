@@ -0,0 +1,149 @@
+"""
+Локальная замена Telegram для проверки режима вебхука.
+
+Скрипт поднимает заглушку Bot API (бот ходит в неё, если запущен с
+``TELEGRAM_API_URL=http://127.0.0.1:8081``) и отправляет на вебхук бота
+синтетические обновления: команды и нажатия кнопок от множества чатов.
+В конце печатает число принятых, отклонённых (429/503) и ошибочных
+доставок, а также скорость отправки.
+
+Пример::
+
+    BOT_TOKEN=123:fake TELEGRAM_API_URL=http://127.0.0.1:8081 python app.py webhook
+    python -m benchmarks.fake_telegram --updates 5000 --chats 200 --concurrency 64
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+from typing import Dict
+
+from aiohttp import ClientSession, web
+
+COMMANDS = ['/start', '/learn_words', '/grammar_game', '/play_synonyms', '/lessons']
+CALLBACKS = ['1wm:st', '1wa:0:default', '1gw:1', '1sa:2', '1ls:1', '1pg:1']
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(chat_id: int) -> Dict:
+    return {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}'}
+
+
+def _message(chat_id: int, text: str) -> Dict:
+    return {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': _user(chat_id),
+        'text': text,
+    }
+
+
+def make_update(chat_id: int) -> Dict:
+    """Случайное обновление от чата: команда или нажатие кнопки."""
+    update_id = next(_update_ids)
+    if random.random() < 0.3:
+        text = random.choice(COMMANDS)
+        message = _message(chat_id, text)
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return {'update_id': update_id, 'message': message}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': _user(chat_id),
+            'chat_instance': str(chat_id),
+            'message': _message(chat_id, 'вопрос'),
+            'data': random.choice(CALLBACKS),
+        },
+    }
+
+
+def create_bot_api_app() -> web.Application:
+    """Заглушка Bot API: принимает любой метод и возвращает правдоподобный ответ."""
+    calls: Counter = Counter()
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        calls[method] += 1
+        data = await request.post()
+        chat_id = int(data.get('chat_id', 0) or 0)
+        if method == 'copyMessage':
+            result = {'message_id': next(_message_ids)}
+        elif method == 'forwardMessage':
+            # Пересланный пост канала: по нему снимается содержимое страницы урока
+            text = f"Страница {data.get('message_id')}"
+            result = _message(chat_id, text)
+            result['entities'] = [{'type': 'bold', 'offset': 0, 'length': len(text)}]
+        elif method.startswith('send') or method.startswith('editMessage'):
+            result = _message(chat_id, str(data.get('text', '')))
+            result['from'] = {'id': 1, 'is_bot': True, 'first_name': 'bot'}
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'fake_bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    app = web.Application()
+    app['calls'] = calls
+    app.router.add_post('/bot{token}/{method}', handle)
+    return app
+
+
+async def send_updates(url: str, updates: int, chats: int, concurrency: int, secret: str = '') -> Counter:
+    """Отправляет обновления на вебхук и возвращает счётчик HTTP-статусов."""
+    statuses: Counter = Counter()
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    remaining = iter(range(updates))
+
+    async def sender(session: ClientSession) -> None:
+        for _ in remaining:
+            try:
+                async with session.post(url, json=make_update(random.randint(1, chats)), headers=headers) as resp:
+                    statuses[resp.status] += 1
+            except Exception:
+                statuses['error'] += 1
+
+    async with ClientSession() as session:
+        await asyncio.gather(*(sender(session) for _ in range(concurrency)))
+    return statuses
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook', help='адрес вебхука бота')
+    parser.add_argument('--secret', default='', help='значение WEBHOOK_SECRET бота')
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--api-port', type=int, default=8081, help='порт заглушки Bot API (0 — не запускать)')
+    args = parser.parse_args()
+
+    runner = None
+    if args.api_port:
+        api_app = create_bot_api_app()
+        runner = web.AppRunner(api_app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', args.api_port).start()
+
+    started = time.perf_counter()
+    statuses = await send_updates(args.url, args.updates, args.chats, args.concurrency, args.secret)
+    elapsed = time.perf_counter() - started
+
+    print(f"Отправлено {args.updates} обновлений за {elapsed:.2f} с ({args.updates / elapsed:.0f}/с)")
+    for status, count in sorted(statuses.items(), key=lambda item: str(item[0])):
+        print(f"  {status}: {count}")
+    if runner is not None:
+        # Даём боту дописать ответы на последние обновления
+        await asyncio.sleep(1)
+        print("Вызовы Bot API:", dict(api_app['calls']))
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,264 @@
+"""
+Нагрузочный тест роутера на синтетических обновлениях без Telegram.
+
+Каждый смоделированный пользователь проходит один из сценариев:
+/learn_words и ответы на вопросы, /grammar_game и выбор слов перевода,
+/lessons и листание страниц урока, /play_synonyms и ответы. Нажатия берутся
+из клавиатуры последнего ответа бота этому чату, как у живого пользователя.
+Обновления подаются в диспетчер с роутером из ``bot_core.handlers`` и теми же
+middleware, что и в боте; Bot API заменён сессией, которая записывает вызовы
+и возвращает правдоподобные ответы.
+
+Для каждого уровня одновременных пользователей печатаются обновления в
+секунду, перцентили задержки обработки и число вызовов Bot API на обновление.
+
+Запуск:
+    python -m benchmarks.load_test --users 1,100,10000 --steps 5
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+JOURNEYS = ("words", "grammar", "lessons", "synonyms")
+START = {
+    "words": ("/learn_words", "1wm:sd"),
+    "grammar": ("/grammar_game", "1gm:sd"),
+    "lessons": ("/lessons", None),
+    "synonyms": ("/play_synonyms", None),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", default="1,100,10000", help="уровни одновременных пользователей через запятую")
+    parser.add_argument("--steps", type=int, default=5, help="нажатий на пользователя после старта сценария")
+    parser.add_argument("--words", type=int, default=5_000, help="количество слов в синтетической базе")
+    parser.add_argument("--db", help="путь к файлу базы (по умолчанию временный)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--outbound", action="store_true",
+                        help="отправлять через исходящую очередь с ограничением скорости, как в боте")
+    return parser.parse_args()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def create_recording_session():
+    """Сессия Bot API, которая записывает вызовы и не ходит в сеть."""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message, MessageId, User
+
+    message_ids = itertools.count(1)
+    bot_user = User(id=1, is_bot=True, first_name="bot")
+
+    class RecordingSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls: Counter = Counter()
+            # Последняя клавиатура, отправленная в чат: из неё пользователь выбирает следующее нажатие
+            self.keyboards: Dict[int, List[str]] = {}
+
+        def _remember_keyboard(self, method) -> None:
+            chat_id = getattr(method, "chat_id", None)
+            markup = getattr(method, "reply_markup", None)
+            if chat_id is None or markup is None or not hasattr(markup, "inline_keyboard"):
+                return
+            self.keyboards[chat_id] = [
+                button.callback_data for row in markup.inline_keyboard for button in row if button.callback_data
+            ]
+
+        async def make_request(self, bot, method, timeout: Optional[int] = None):
+            self.calls[type(method).__name__] += 1
+            self._remember_keyboard(method)
+            returning = method.__returning__
+            if returning is bool:
+                return True
+            if returning is MessageId:
+                return MessageId(message_id=next(message_ids))
+            chat_id = getattr(method, "chat_id", None) or 0
+            return Message(
+                message_id=next(message_ids),
+                date=int(time.time()),
+                chat=Chat(id=int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, type="private"),
+                from_user=bot_user,
+                text=getattr(method, "text", None),
+            )
+
+        async def stream_content(self, url: str, headers=None, timeout: int = 30, chunk_size: int = 65536,
+                                 raise_for_status: bool = True):
+            # Сценарии нагрузки файлы не скачивают: вызов учитывается, содержимое пустое
+            self.calls["stream_content"] += 1
+            return
+            yield b""
+
+        async def close(self):
+            pass
+
+    return RecordingSession()
+
+
+class UpdateFactory:
+    """Строит обновления Telegram от имени пользователя-чата."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(10_000_000)
+
+    def _message(self, chat_id: int, text: str) -> Dict:
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return message
+
+    def _update(self, payload: Dict):
+        from aiogram.types import Update
+        # Контекст с ботом нужен, чтобы message.answer и call.answer работали как в бою
+        return Update.model_validate({"update_id": next(self.update_ids), **payload}, context={"bot": self.bot})
+
+    def command(self, chat_id: int, text: str):
+        return self._update({"message": self._message(chat_id, text)})
+
+    def callback(self, chat_id: int, data: str):
+        return self._update({"callback_query": {
+            "id": str(next(self.update_ids)),
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "chat_instance": str(chat_id),
+            "message": self._message(chat_id, "вопрос"),
+            "data": data,
+        }})
+
+
+class LoadRun:
+    """Результаты одного уровня нагрузки."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.updates = 0
+
+
+async def run_user(dp, bot, session, factory: UpdateFactory, chat_id: int, journey: str, steps: int,
+                   rnd: random.Random, run: LoadRun) -> None:
+    async def feed(update) -> None:
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception:
+            run.errors += 1
+        run.latencies.append(time.perf_counter() - started)
+        run.updates += 1
+
+    command, first_click = START[journey]
+    await feed(factory.command(chat_id, command))
+    if first_click:
+        await feed(factory.callback(chat_id, first_click))
+    for _ in range(steps):
+        buttons = session.keyboards.get(chat_id)
+        if not buttons:
+            # Бот ничего не предложил (нет данных или игра закончилась): начинаем сценарий заново
+            await feed(factory.command(chat_id, command))
+            continue
+        await feed(factory.callback(chat_id, rnd.choice(buttons)))
+
+
+async def run_level(dp, bot, session, users: int, steps: int, rnd: random.Random, chat_offset: int) -> Tuple[LoadRun, float, int]:
+    session.calls.clear()
+    factory = UpdateFactory(bot)
+    run = LoadRun()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_user(dp, bot, session, factory, chat_offset + idx, JOURNEYS[idx % len(JOURNEYS)], steps, rnd, run)
+        for idx in range(users)
+    ))
+    elapsed = time.perf_counter() - started
+    return run, elapsed, sum(session.calls.values())
+
+
+async def main_async(args) -> None:
+    from aiogram import Bot, Dispatcher
+
+    from bot_core.handlers import router
+    from bot_core.middlewares import register_middlewares
+    from bot_core.outbound import OutboundMiddleware, outbound_queue
+    from bot_core.scheduler import chat_scheduler
+    from db_layer.instrumentation import query_stats
+    from db_layer.metric_buffer import metric_buffer
+    from db_layer.relation_index import relation_index
+    from lessons.keyboards import lesson_keyboards
+    from lessons.navigation import reload_lesson_graph
+
+    session = create_recording_session()
+    bot = Bot(token="123456:load-test", session=session)
+    if args.outbound:
+        bot.session.middleware(OutboundMiddleware(outbound_queue))
+        outbound_queue.start()
+    dp = Dispatcher()
+    register_middlewares(dp)
+    dp.include_router(router)
+
+    reload_lesson_graph()
+    lesson_keyboards.refresh()
+    relation_index.load()
+    chat_scheduler.start()
+    metric_buffer.start()
+    rnd = random.Random(args.seed)
+
+    print(f"{'пользователи':>12} {'обновлений':>10} {'обн/с':>8} {'p50 мс':>8} {'p95 мс':>8} "
+          f"{'p99 мс':>8} {'API/обн':>8} {'ошибки':>7}")
+    try:
+        # Прогрев: первые обращения к моделям aiogram и кэшам не должны попадать в замеры
+        await run_level(dp, bot, session, len(JOURNEYS), args.steps, rnd, chat_offset=-len(JOURNEYS) - 1)
+        chat_offset = 1
+        for users in (int(value) for value in args.users.split(",")):
+            run, elapsed, api_calls = await run_level(dp, bot, session, users, args.steps, rnd, chat_offset)
+            chat_offset += users
+            latencies_ms = [value * 1000 for value in run.latencies]
+            print(f"{users:>12} {run.updates:>10} {run.updates / elapsed:>8.0f} "
+                  f"{percentile(latencies_ms, 50):>8.2f} {percentile(latencies_ms, 95):>8.2f} "
+                  f"{percentile(latencies_ms, 99):>8.2f} {api_calls / max(run.updates, 1):>8.2f} {run.errors:>7}")
+        print(f"\nПланировщик: {chat_scheduler.stats()}")
+        if args.outbound:
+            print(f"Исходящая очередь: {outbound_queue.stats()}")
+        print("Самые затратные источники SQL-запросов:")
+        for name, stats in sorted(query_stats().items(), key=lambda item: -item[1]["total_ms"])[:5]:
+            print(f"  {name:45} {stats['count']:>7} запросов, {stats['avg_ms']:.3f} мс в среднем")
+    finally:
+        await chat_scheduler.stop()
+        await outbound_queue.stop()
+        await metric_buffer.stop()
+
+
+def main():
+    args = parse_args()
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="verdict-load-"), "load.db")
+    # Движок SQLAlchemy создаётся при импорте моделей, поэтому адрес базы задаётся заранее
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    # Метрики собираются в процессе; HTTP-сервер для теста не нужен
+    os.environ.setdefault("METRICS_PORT", "0")
+
+    from benchmarks.datasets import generate_dataset
+    counts = generate_dataset(path, words=args.words)
+    print(f"База {path}: {counts}")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
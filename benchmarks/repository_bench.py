@@ -0,0 +1,291 @@
+"""
+Микробенчмарки всех публичных функций ``db_layer.repository``.
+
+Для каждого размера словаря (по умолчанию 1 тыс., 100 тыс. и 1 млн слов)
+создаётся синтетическая база со связями, предложениями и метриками
+путаницы (два ряда ``metric_word_value`` на слово) и в отдельном
+процессе замеряется каждая функция: медиана, p95, минимум и число
+SQL-запросов на вызов. Результаты сохраняются в JSON и сравниваются
+с сохранённым эталоном: замедление медианы больше порога считается
+регрессией, и скрипт завершается с кодом 1. Ошибка в любой функции
+тоже завершает скрипт с кодом 1, даже без эталона.
+
+Замеры идут на копии базы: функции записи (метрики, карточки, пользователи)
+меняют данные, а сгенерированная база в ``--data-dir`` должна оставаться
+одинаковой от запуска к запуску.
+
+Запуск:
+    python -m benchmarks.repository_bench --sizes 1000,100000 --output bench.json
+    python -m benchmarks.repository_bench --baseline bench.json --threshold 0.25
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="размеры словаря через запятую")
+    parser.add_argument("--repeat", type=int, default=20, help="максимум замеров каждой функции")
+    parser.add_argument("--budget", type=float, default=2.0, help="максимум секунд на замеры одной функции")
+    parser.add_argument("--data-dir", help="каталог для баз; готовые базы переиспользуются")
+    parser.add_argument("--output", help="куда сохранить результаты (JSON)")
+    parser.add_argument("--baseline", help="эталонные результаты для сравнения (JSON)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление медианы (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="разница медиан, которая считается шумом")
+    # Внутренний режим: замер одной базы в отдельном процессе
+    parser.add_argument("--run-db", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def build_cases(repository, ids: Dict[str, object]) -> List[Tuple[str, Callable[[], object]]]:
+    """Все публичные функции репозитория с типичными аргументами: (имя, вызов)."""
+    lesson = 5
+    return [
+        ("get_single_random_word_from_lesson", lambda: repository.get_single_random_word_from_lesson(lesson)),
+        ("build_word_question", lambda: repository.build_word_question(lesson)),
+        ("get_random_words_by_lesson", lambda: repository.get_random_words_by_lesson([ids["word_id"]], lesson)),
+        ("get_lessons_from_db", lambda: repository.get_lessons_from_db()),
+        ("get_lesson_counts", lambda: repository.get_lesson_counts()),
+        ("get_all_pages", lambda: repository.get_all_pages()),
+        ("get_pages_by_lesson", lambda: repository.get_pages_by_lesson(lesson)),
+        ("get_page_info", lambda: repository.get_page_info(ids["page_id"])),
+        ("get_page_contents", lambda: repository.get_page_contents()),
+        ("save_page_content", lambda: repository.save_page_content(
+            ids["page_id"], "@bench", 1, "text", "Текст страницы", None, None, "bench")),
+        ("get_all_words", lambda: repository.get_all_words()),
+        ("get_single_random_word", lambda: repository.get_single_random_word()),
+        ("get_random_words", lambda: repository.get_random_words(ids["word_id"])),
+        ("get_random_word_with_relations",
+         lambda: repository.get_random_word_with_relations(ids["relation_source_id"], "synonym")),
+        ("get_random_sentence", lambda: repository.get_random_sentence()),
+        ("get_random_words_for_options", lambda: repository.get_random_words_for_options(ids["sentence_id"])),
+        ("search_records_by_word", lambda: repository.search_records_by_word(ids["word_id"])),
+        ("upsert_metric_values",
+         lambda: repository.upsert_metric_values({(ids["word_id"], ids["other_word_id"]): 0.05})),
+        ("get_review_cards", lambda: repository.get_review_cards(1)),
+        ("upsert_review_cards",
+         lambda: repository.upsert_review_cards({(1, ids["word_id"]): (1.0, 2.5, 1, 0, time.time())})),
+        ("add_or_update_metric_value",
+         lambda: repository.add_or_update_metric_value(ids["word_id"], ids["other_word_id"])),
+        ("add_user", lambda: repository.add_user({"telegram_id": 1, "username": "bench"})),
+        ("get_user_by_telegram_id", lambda: repository.get_user_by_telegram_id(1)),
+        ("save_user_progress", lambda: repository.save_user_progress([
+            repository.AnswerRecord(1, "words", ids["word_id"], True, time.time())])),
+        ("remove_zero_values", lambda: repository.remove_zero_values()),
+        ("update_metric_value", lambda: repository.update_metric_value(ids["metric_id"], 0.0)),
+        ("find_word_by_text", lambda: repository.find_word_by_text(ids["word_text"])),
+        ("search_records_by_word_pair",
+         lambda: repository.search_records_by_word_pair(ids["word_id"], ids["other_word_id"])),
+        ("next_sentence", lambda: repository.next_sentence(SimpleNamespace(mode=f"lesson_{lesson}"))),
+        ("get_random_sentence_by_lesson", lambda: repository.get_random_sentence_by_lesson(lesson)),
+        ("get_sentences_by_lesson", lambda: repository.get_sentences_by_lesson(lesson)),
+        ("get_all_sentences", lambda: repository.get_all_sentences(None)),
+    ]
+
+
+def public_functions(repository) -> List[str]:
+    return [
+        name for name, obj in inspect.getmembers(repository, inspect.isfunction)
+        if not name.startswith("_") and obj.__module__ == repository.__name__
+    ]
+
+
+def sample_ids(path: str) -> Dict[str, object]:
+    """Идентификаторы из базы, на которых вызываются функции."""
+    conn = sqlite3.connect(path)
+    try:
+        one = lambda sql: conn.execute(sql).fetchone()
+        word_id, word_text = one("SELECT id, russian_word FROM words ORDER BY id LIMIT 1 OFFSET "
+                                 "(SELECT COUNT(*) / 2 FROM words)")
+        return {
+            "word_id": word_id,
+            "word_text": word_text,
+            "other_word_id": one("SELECT MAX(id) FROM words")[0],
+            "page_id": one("SELECT MIN(id) FROM pages")[0],
+            "sentence_id": one("SELECT MIN(id) FROM sentences")[0],
+            "relation_source_id": one("SELECT source_word_id FROM relations LIMIT 1")[0],
+            "metric_id": one("SELECT MIN(id) FROM metric_word_value")[0],
+        }
+    finally:
+        conn.close()
+
+
+def measure_case(call: Callable[[], object], repeat: int, budget: float, track_queries) -> Dict[str, object]:
+    try:
+        call()  # прогрев: пул слов, индексы и кэш страниц SQLite
+        with track_queries() as update:
+            call()
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    timings = []
+    deadline = time.perf_counter() + budget
+    while len(timings) < repeat and (not timings or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "min_ms": timings[0],
+        "runs": len(timings),
+        "queries": update.queries,
+    }
+
+
+def run_database(path: str, repeat: int, budget: float) -> Dict[str, Dict[str, object]]:
+    """Замеры на одной базе. Вызывается в отдельном процессе: движок привязан к DATABASE_URL."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    from db_layer import repository
+    from db_layer.instrumentation import track_queries
+
+    cases = build_cases(repository, sample_ids(path))
+    missing = set(public_functions(repository)) - {name for name, _ in cases}
+    if missing:
+        print(f"Нет замеров для функций: {', '.join(sorted(missing))}", file=sys.stderr)
+    return {name: measure_case(call, repeat, budget, track_queries) for name, call in cases}
+
+
+def prepare_database(data_dir: str, words: int) -> str:
+    from benchmarks.datasets import generate_dataset
+    path = os.path.join(data_dir, f"words_{words}.db")
+    if os.path.exists(path):
+        print(f"База {path} уже есть, используется повторно")
+        return path
+    started = time.perf_counter()
+    counts = generate_dataset(path, words=words)
+    print(f"База {path}: {counts} ({time.perf_counter() - started:.1f} с)")
+    return path
+
+
+def working_copy(path: str, data_dir: str) -> str:
+    """Копия базы для одного запуска замеров (через backup API, вместе с журналом WAL)."""
+    copy_path = os.path.join(data_dir, "run_" + os.path.basename(path))
+    if os.path.exists(copy_path):
+        os.remove(copy_path)
+    source, target = sqlite3.connect(path), sqlite3.connect(copy_path)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    return copy_path
+
+
+def errors(results: Dict) -> List[str]:
+    """Функции, вызов которых завершился исключением."""
+    return [
+        f"{size}/{name}: {row['error']}"
+        for size, functions in results["results"].items()
+        for name, row in functions.items()
+        if "error" in row
+    ]
+
+
+def compare(results: Dict, baseline: Dict, threshold: float, min_delta_ms: float) -> List[str]:
+    """Список регрессий относительно эталона (ошибки считаются отдельно, см. ``errors``)."""
+    regressions = []
+    for size, functions in results["results"].items():
+        for name, current in functions.items():
+            previous = baseline.get("results", {}).get(size, {}).get(name)
+            if "error" in current or not previous or "median_ms" not in previous:
+                continue
+            old, new = previous["median_ms"], current["median_ms"]
+            if new - old > min_delta_ms and new > old * (1 + threshold):
+                regressions.append(f"{size}/{name}: {old:.3f} → {new:.3f} мс (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def print_report(results: Dict, baseline: Optional[Dict]) -> None:
+    for size, functions in results["results"].items():
+        print(f"\n===== {int(size):,} слов =====".replace(",", " "))
+        print(f"{'функция':38} {'медиана':>10} {'p95':>10} {'запросов':>9} {'эталон':>10}")
+        for name, row in functions.items():
+            if "error" in row:
+                print(f"{name:38} {'ошибка':>10}  {row['error'][:60]}")
+                continue
+            previous = (baseline or {}).get("results", {}).get(size, {}).get(name, {})
+            ref = f"{previous['median_ms']:10.3f}" if "median_ms" in previous else f"{'—':>10}"
+            print(f"{name:38} {row['median_ms']:10.3f} {row['p95_ms']:10.3f} {row['queries']:9} {ref}")
+
+
+def main():
+    args = parse_args()
+    if args.run_db:
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(run_database(args.run_db, args.repeat, args.budget), f)
+        return
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="verdict-bench-")
+    os.makedirs(data_dir, exist_ok=True)
+    results = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+    for words in (int(value) for value in args.sizes.split(",")):
+        path = prepare_database(data_dir, words)
+        result_file = os.path.join(data_dir, f"result_{words}.json")
+        run_path = working_copy(path, data_dir)
+        try:
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.repository_bench", "--run-db", run_path,
+                 "--result-file", result_file, "--repeat", str(args.repeat), "--budget", str(args.budget)],
+                check=True, stdout=subprocess.DEVNULL,
+            )
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(run_path + suffix):
+                    os.remove(run_path + suffix)
+        with open(result_file, encoding="utf-8") as f:
+            results["results"][str(words)] = json.load(f)
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+    failed = errors(results)
+    if failed:
+        print("\nОшибки:")
+        for line in failed:
+            print("  " + line)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\nРегрессии (порог {args.threshold:.0%}):")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print(f"\nРегрессий относительно {args.baseline} нет")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
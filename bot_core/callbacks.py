@@ -0,0 +1,259 @@
+"""
+Кодирование callback_data и таблица обработчиков колбеков.
+
+Каждое действие (``CallbackAction``) имеет короткий префикс и набор
+типизированных полей. Данные кнопки упаковываются в строку вида
+``1wa:2:lesson:5``: номер версии формата, префикс и значения полей через
+двоеточие (целые — в base36, булевы — ``1``/``0``, None — пустая строка).
+Строка не длиннее 64 байт, как требует Telegram.
+
+Если поля не помещаются в 64 байта, они сохраняются на сервере в хранилище
+сессий (в памяти процесса или в Redis), а в кнопку попадает только короткий
+токен: ``1wa~Xk3_9aQb``. Такие данные упаковываются асинхронно через
+``CallbackAction.pack_stored``.
+
+Разбор занимает одно обращение к словарю по префиксу, поэтому его стоимость
+не зависит от числа зарегистрированных действий. Кнопки старого формата
+(``wl_st_5``, ``answer_wl_1_lesson_5``) на уже отправленных сообщениях
+разбираются функциями, зарегистрированными через ``register_legacy``:
+они выбираются по первой части строки до ``_``.
+"""
+import logging
+import secrets
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram.types import CallbackQuery
+
+from learning_modules.sessions import GameSessions
+
+logger = logging.getLogger(__name__)
+
+VERSION = '1'
+MAX_CALLBACK_BYTES = 64
+SEPARATOR = ':'
+STORED_MARK = '~'
+
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+class CallbackError(ValueError):
+    """Некорректные или устаревшие данные колбека."""
+
+
+def _int_to_base36(value: int) -> str:
+    if value < 0:
+        return '-' + _int_to_base36(-value)
+    if value < 36:
+        return _DIGITS[value]
+    digits = []
+    while value:
+        value, rem = divmod(value, 36)
+        digits.append(_DIGITS[rem])
+    return ''.join(reversed(digits))
+
+
+def _encode_value(value: Any, kind: type) -> str:
+    if value is None:
+        return ''
+    if kind is bool:
+        return '1' if value else '0'
+    if kind is int:
+        return _int_to_base36(int(value))
+    # Двоеточие разделяет поля, поэтому оно и знак процента экранируются
+    return str(value).replace('%', '%25').replace(SEPARATOR, '%3A')
+
+
+def _decode_value(raw: str, kind: type) -> Any:
+    if raw == '':
+        return None
+    if kind is bool:
+        return raw == '1'
+    if kind is int:
+        return int(raw, 36)
+    return raw.replace('%3A', SEPARATOR).replace('%25', '%')
+
+
+class CallbackPayload:
+    """Поля колбека, не поместившиеся в callback_data."""
+    __slots__ = ('prefix', 'values')
+
+    def __init__(self):
+        self.prefix: Optional[str] = None
+        self.values: List[Any] = []
+
+
+_payloads = GameSessions('callback_payload', CallbackPayload)
+
+# Все действия по префиксу: общий словарь для разбора callback_data
+_actions: Dict[str, 'CallbackAction'] = {}
+
+
+class CallbackAction:
+    """
+    Действие, вызываемое кнопкой.
+
+    Параметры:
+    ----------
+    name : str
+        Понятное имя действия (метка в метриках).
+    prefix : str
+        Короткий уникальный префикс в callback_data (буквы, без ``:`` и ``~``).
+    fields : tuple
+        Пары (имя поля, тип); поддерживаются int, str и bool.
+        Любое поле может быть None.
+    """
+
+    def __init__(self, name: str, prefix: str, fields: Tuple[Tuple[str, type], ...] = ()):
+        if not prefix.isalpha():
+            raise ValueError(f"Префикс колбека должен состоять из букв: {prefix!r}")
+        if prefix in _actions:
+            raise ValueError(f"Префикс колбека {prefix!r} уже занят действием {_actions[prefix].name}")
+        self.name = name
+        self.prefix = prefix
+        self.fields = fields
+        _actions[prefix] = self
+
+    def __repr__(self) -> str:
+        return f"CallbackAction({self.name!r}, {self.prefix!r})"
+
+    def _values(self, values: Dict[str, Any]) -> List[Any]:
+        unknown = set(values) - {name for name, _ in self.fields}
+        if unknown:
+            raise TypeError(f"{self.name}: неизвестные поля {', '.join(sorted(unknown))}")
+        return [values.get(name) for name, _ in self.fields]
+
+    def _encode(self, values: List[Any]) -> str:
+        parts = [VERSION + self.prefix]
+        parts.extend(_encode_value(value, kind) for value, (_, kind) in zip(values, self.fields))
+        # Хвостовые пустые поля (None) не записываются
+        while len(parts) > 1 and parts[-1] == '':
+            parts.pop()
+        return SEPARATOR.join(parts)
+
+    def pack(self, **values: Any) -> str:
+        """
+        Упаковывает поля в callback_data.
+        Если результат длиннее 64 байт, бросает ValueError: такие данные
+        нужно упаковывать через ``pack_stored``.
+        """
+        data = self._encode(self._values(values))
+        if len(data.encode('utf-8')) > MAX_CALLBACK_BYTES:
+            raise ValueError(f"callback_data действия {self.name} длиннее {MAX_CALLBACK_BYTES} байт: {data!r}")
+        return data
+
+    async def pack_stored(self, **values: Any) -> str:
+        """
+        Упаковывает поля в callback_data; не поместившиеся в 64 байта
+        поля сохраняются в хранилище сессий под коротким токеном.
+        """
+        field_values = self._values(values)
+        data = self._encode(field_values)
+        if len(data.encode('utf-8')) <= MAX_CALLBACK_BYTES:
+            return data
+        token = secrets.token_urlsafe(6)
+        async with _payloads.session(token) as payload:
+            payload.prefix = self.prefix
+            payload.values = field_values
+        return VERSION + self.prefix + STORED_MARK + token
+
+    def unpack(self, raw_values: List[str]) -> Dict[str, Any]:
+        """Поля из частей callback_data после префикса."""
+        if len(raw_values) > len(self.fields):
+            raise CallbackError(f"{self.name}: лишние поля в callback_data")
+        raw_values = raw_values + [''] * (len(self.fields) - len(raw_values))
+        try:
+            return {name: _decode_value(raw, kind) for raw, (name, kind) in zip(raw_values, self.fields)}
+        except ValueError as e:
+            raise CallbackError(f"{self.name}: {e}") from e
+
+
+LegacyParser = Callable[[List[str]], Optional[Tuple[CallbackAction, Dict[str, Any]]]]
+
+# Разбор кнопок старого формата по первой части строки до '_'
+_legacy: Dict[str, LegacyParser] = {}
+
+
+def register_legacy(head: str, parse: LegacyParser) -> None:
+    """
+    Регистрирует разбор старого формата для строк, начинающихся с ``head_``.
+    Функция получает части строки, разделённые ``_``, и возвращает
+    (действие, поля) или None, если строка не распознана.
+    """
+    _legacy[head] = parse
+
+
+def _split(data: str) -> Tuple[str, str, str]:
+    """(префикс, разделитель, остаток) для данных текущей версии."""
+    end = 1
+    while end < len(data) and data[end].isalpha():
+        end += 1
+    return data[1:end], data[end:end + 1], data[end + 1:]
+
+
+def route(data: Optional[str]) -> str:
+    """Имя действия по callback_data без полного разбора (для меток метрик)."""
+    data = data or ''
+    if data[:1] == VERSION:
+        action = _actions.get(_split(data)[0])
+        return action.name if action is not None else 'unknown'
+    head = data.split('_', 1)[0]
+    return 'legacy:' + head if head in _legacy else 'unknown'
+
+
+async def decode(data: Optional[str]) -> Tuple[CallbackAction, Dict[str, Any]]:
+    """Действие и поля колбека. Бросает CallbackError для неизвестных и устаревших данных."""
+    data = data or ''
+    if data[:1] != VERSION:
+        parts = data.split('_')
+        parse = _legacy.get(parts[0])
+        decoded = parse(parts) if parse is not None else None
+        if decoded is None:
+            raise CallbackError(f"Неизвестный формат callback_data: {data!r}")
+        return decoded
+
+    prefix, mark, rest = _split(data)
+    action = _actions.get(prefix)
+    if action is None:
+        raise CallbackError(f"Неизвестный префикс callback_data: {data!r}")
+    if mark == STORED_MARK:
+        async with _payloads.session(rest, create=False) as payload:
+            if payload is None or payload.prefix != prefix:
+                raise CallbackError(f"Данные колбека {data!r} устарели")
+            values = list(payload.values)
+        return action, dict(zip((name for name, _ in action.fields), values))
+    if mark not in ('', SEPARATOR):
+        raise CallbackError(f"Некорректная callback_data: {data!r}")
+    return action, action.unpack(rest.split(SEPARATOR) if mark else [])
+
+
+CallbackHandler = Callable[..., Awaitable[Any]]
+
+
+class CallbackRouter:
+    """
+    Таблица обработчиков колбеков: действие → функция.
+    Обработчик вызывается как ``handler(query, **поля)``.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, CallbackHandler] = {}
+
+    def register(self, action: CallbackAction, handler: CallbackHandler) -> None:
+        if action.prefix in self._handlers:
+            raise ValueError(f"Для действия {action.name} уже есть обработчик")
+        self._handlers[action.prefix] = handler
+
+    def handler(self, action: CallbackAction) -> Callable[[CallbackHandler], CallbackHandler]:
+        """Декоратор: регистрирует функцию обработчиком действия."""
+        def decorator(func: CallbackHandler) -> CallbackHandler:
+            self.register(action, func)
+            return func
+        return decorator
+
+    async def dispatch(self, query: CallbackQuery) -> Any:
+        """Разбирает callback_data и вызывает обработчик действия."""
+        action, values = await decode(query.data)
+        handler = self._handlers.get(action.prefix)
+        if handler is None:
+            raise CallbackError(f"Нет обработчика для действия {action.name}")
+        return await handler(query, **values)
@@ -1,19 +1,27 @@
 import logging
+from typing import Optional
 from aiogram import Router
+from aiogram.filters import ExceptionTypeFilter
 from aiogram.filters.command import Command
-from aiogram.types import Message, CallbackQuery
-from learning_modules.synonyms import SynonymAntonymGame
-from learning_modules.words import WordLearner
-from learning_modules.grammar import GrammarLearner
+from aiogram.types import Message, CallbackQuery, ErrorEvent
+from cache_system.session_backend import SessionConflict
+from learning_modules.synonyms import SYNONYM_ANSWER, SynonymAntonymGame
+from learning_modules.words import WORDS_ANSWER, WORDS_MODE, WordLearner
+from learning_modules.grammar import GRAMMAR_MODE, GRAMMAR_WORD, GrammarLearner
 from lessons.chooselessons import ChooseLessons, CallbackLessons
+from lessons.content import lesson_content
+from lessons.keyboards import GRAMMAR, LESSON, LESSON_MENU, LESSONS_LIST, PAGE, WORDS, lesson_keyboards
+from bot_core.callbacks import CallbackError, CallbackRouter, register_legacy
 from bot_core.system_commands import System_commands
+from db_layer.answer_log import answer_log
+from db_layer.async_repository import add_user, get_user_by_telegram_id
 from aiogram.types import ReplyKeyboardRemove
 from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup
 
-from db_layer.repository import get_lessons_from_db
-
 # Создаем роутер для обработки команд и сообщений
 router = Router()
+# Таблица обработчиков колбеков по префиксу callback_data
+callbacks = CallbackRouter()
 
 # Инициализация игровых модулей
 synonym_antonym_game = SynonymAntonymGame()
@@ -40,8 +48,31 @@ async def hide_buttons(message: Message):
 # Основной обработчик команды /start
 @router.message(Command("start"))
 async def start_command(message: Message):
+    # Пользователь — автор сообщения, а не чат: в группе у каждого участника своя статистика
+    user = message.from_user
+    if user is not None:
+        await add_user({
+            'telegram_id': user.id,
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+        })
     await System_commands.menu(message)
 
+# Статистика пользователя: итоги хранятся в строке пользователя, журнал ответов не читается
+@router.message(Command("stats"))
+async def stats_command(message: Message):
+    user = await get_user_by_telegram_id(message.from_user.id) if message.from_user else None
+    if user is None or not user.answers:
+        await message.answer("Вы ещё не отвечали на задания.")
+        return
+    accuracy = user.correct_answers / user.answers * 100
+    await message.answer(
+        f"Ответов: {user.answers}, правильных: {user.correct_answers} ({accuracy:.0f}%)\n"
+        f"Серия правильных ответов: {user.streak} (лучшая: {user.best_streak})\n"
+        f"Слов встречено: {user.words_seen}"
+    )
+
 # Основной обработчик команды /menu
 @router.message(Command("menu"))
 async def menu(message: Message):
@@ -55,20 +86,15 @@ async def learn_words_command(message: Message):
     Предоставляет пользователю выбор: обычный режим, изучение по уроку или экзамены.
     """
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Обычный режим", callback_data='wl_sd')],
-        [InlineKeyboardButton(text="По уроку", callback_data='wl_st')],
+        [InlineKeyboardButton(text="Обычный режим", callback_data=WORDS_MODE.pack(mode='sd'))],
+        [InlineKeyboardButton(text="По уроку", callback_data=WORDS_MODE.pack(mode='st'))],
+        [InlineKeyboardButton(text="Повторение", callback_data=WORDS_MODE.pack(mode='sr'))],
     ])
     await message.answer("Выберите режим обучения:", reply_markup=keyboard)
 
 # Обработчик колбеков для выбора режима обучения слов
-@router.callback_query(lambda call: call.data.startswith('wl_'))
-async def process_word_learning_modes(call: CallbackQuery):
-    data_parts = call.data.split('_')
-    mode = data_parts[1]
-    lesson = None
-    if len(data_parts) > 2:
-        lesson = data_parts[2]
-    
+@callbacks.handler(WORDS_MODE)
+async def process_word_learning_modes(call: CallbackQuery, mode: str, lesson: Optional[int]):
     match mode:
         case 'sd':  # Обычный режим
             await word_learner.start_default_mode(call.message)
@@ -76,37 +102,51 @@ async def process_word_learning_modes(call: CallbackQuery):
             if lesson is None:
                 await choose_lesson_wl(call.message)  # Пользователь выбирает урок
             else:
-                await word_learner.start_lesson_mode(call.message, int(lesson))
+                await word_learner.start_lesson_mode(call.message, lesson)
         case 'se':  # Экзаменационные задания
             await word_learner.start_exam_mode(call.message)
+        case 'sr':  # Интервальное повторение
+            await word_learner.start_review_mode(call.message, call.from_user.id)
         case _:
             await call.answer("Неверный выбор режима", show_alert=True)
 
 # Выбор урока
 async def choose_lesson_wl(message: Message):
-    lessons_list = await get_lessons_from_db()  # Получаем уникальный список уроков
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=f"Урок {lesson[0]}", callback_data=f"wl_st_{lesson[0]}")] for lesson in lessons_list
-    ])  # Каждую кнопку помещаем в отдельный список
+    keyboard = await lesson_keyboards.get(WORDS)  # Готовая клавиатура первой страницы списка уроков
+    if keyboard is None:
+        await message.answer("Уроков пока нет.")
+        return
     await message.answer("Выберите урок:", reply_markup=keyboard)
 
 # Обработчик колбеков для выбора ответа
-@router.callback_query(lambda call: call.data.startswith('answer_wl_'))
-async def process_user_answers(call: CallbackQuery):
-    option_idx = int(call.data.split('_')[2])
-    selected_answer = word_learner.options[option_idx]
-    is_correct = word_learner.check_answer(selected_answer)
-    mode = call.data.split('_')[3]
+@callbacks.handler(WORDS_ANSWER)
+async def process_user_answers(call: CallbackQuery, option: int, mode: Optional[str], lesson: Optional[int]):
+    option_idx = option
+    async with word_learner.sessions.session(call.message.chat.id, create=False) as state:
+        is_stale = state is None or state.word_id is None or option_idx >= len(state.options)
+        if not is_stale:
+            is_correct = await word_learner.check_answer(state, option_idx)
+            correct_answer = state.options[state.correct_index]
+            word_id = state.word_id
+            # Вопрос использован: повторное нажатие той же кнопки увидит устаревшее задание
+            word_learner.reset_game(state)
+    if is_stale:
+        await call.answer("Задание устарело. Начните тренировку заново.", show_alert=True)
+        return
     if is_correct:
         await call.answer("Правильно! Молодец!")
     else:
-        correct_answer = word_learner.current_word.english_word if word_learner.translation_direction == "ru->en" else word_learner.current_word.russian_word
         await call.answer(f"Неправильно. Правильный ответ: {correct_answer}")
+    answer_log.add(call.from_user.id, "words", word_id, is_correct)
+    if mode == "review":
+        await word_learner.record_review(call.from_user.id, word_id, is_correct)
     match mode:
         case "lesson":
-            await word_learner.start_lesson_mode(call.message, call.data.split('_')[4])
+            await word_learner.start_lesson_mode(call.message, lesson)
         case "default":
             await word_learner.start_default_mode(call.message)
+        case "review":
+            await word_learner.start_review_mode(call.message, call.from_user.id)
         case "exam":
             pass
         
@@ -114,22 +154,16 @@ async def process_user_answers(call: CallbackQuery):
 # === Новое: обработка грамматического режима ===
 # Обработчик для выбора урока
 async def choose_lesson_gl(message: Message):
-    lessons_list = await get_lessons_from_db()  # Получаем уникальный список уроков
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=f"Урок {lesson[0]}", callback_data=f"gl_st_{lesson[0]}")] for lesson in lessons_list
-    ])  # Каждую кнопку помещаем в отдельный список
+    keyboard = await lesson_keyboards.get(GRAMMAR)  # Готовая клавиатура первой страницы списка уроков
+    if keyboard is None:
+        await message.answer("Уроков пока нет.")
+        return
     await message.answer("Выберите урок:", reply_markup=keyboard)
 
 
 # Обработчик процесса выбора режима обучения
-@router.callback_query(lambda call: call.data.startswith('gl_'))
-async def process_grammar_learning_modes(call: CallbackQuery):
-    data_parts = call.data.split('_')
-    mode = data_parts[1]
-    lesson = None
-    if len(data_parts) > 2:
-        lesson = data_parts[2]
-    
+@callbacks.handler(GRAMMAR_MODE)
+async def process_grammar_learning_modes(call: CallbackQuery, mode: str, lesson: Optional[int]):
     match mode:
         case 'sd':  # Обычный режим
             await grammar_learner.start_default_mode(call.message)  # Без await, если метод синхронный
@@ -137,7 +171,7 @@ async def process_grammar_learning_modes(call: CallbackQuery):
             if lesson is None:
                 await choose_lesson_gl(call.message)  # Этот метод асинхронный
             else:
-                await grammar_learner.start_lesson_mode(call.message, int(lesson))  # Нужен await
+                await grammar_learner.start_lesson_mode(call.message, lesson)  # Нужен await
         case 'se':  # Экзаменационный режим
             await grammar_learner.start_exam_mode(call.message, 3)  # Так же нужен await
         case _:
@@ -151,19 +185,12 @@ async def grammar_command(message: Message):
     Предоставляет пользователю выбор: обычный режим, изучение по уроку или экзамены.
     """
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Обычный режим", callback_data='gl_sd')],
-        [InlineKeyboardButton(text="По уроку", callback_data='gl_st')],
+        [InlineKeyboardButton(text="Обычный режим", callback_data=GRAMMAR_MODE.pack(mode='sd'))],
+        [InlineKeyboardButton(text="По уроку", callback_data=GRAMMAR_MODE.pack(mode='st'))],
     ])
     await message.answer("Выберите режим обучения грамматики:", reply_markup=keyboard)
 
 
-# Обработчик колбека для выбора урока
-@router.callback_query(lambda call: call.data.startswith('wl_st'))
-async def process_chosen_lesson(call: CallbackQuery):
-    _, _, lesson_num = call.data.split('_')
-    lesson_num = int(lesson_num)
-    await word_learner.start_lesson_mode(call.message, lesson_num)
-
 # Обработчик команды /play_synonyms
 @router.message(Command("play_synonyms"))
 async def play_synonyms_command(message: Message):
@@ -179,31 +206,103 @@ async def grammar_game_handler(message: Message):
 async def start_lessons_list_command(message: Message):
     await lessons.show_lessons_list(message)
 
-# Обработка колбеков
+# Колбеки игр и уроков
+callbacks.register(SYNONYM_ANSWER, synonym_antonym_game.handle_callback)
+callbacks.register(GRAMMAR_WORD, grammar_learner.handle_callback)
+callbacks.register(LESSON, CallbackLessons.select_lesson_pages)
+callbacks.register(PAGE, CallbackLessons.send_page_content)
+
+
+@callbacks.handler(LESSONS_LIST)
+async def return_to_lessons_list(query: CallbackQuery):
+    await lessons.show_lessons_list(query.message)
+
+
+# Листание меню уроков: меняется только клавиатура сообщения
+@callbacks.handler(LESSON_MENU)
+async def turn_lesson_menu_page(query: CallbackQuery, kind: str, page: Optional[int], lesson: Optional[int]):
+    keyboard = await lesson_keyboards.get(kind, page or 0, lesson)
+    if keyboard is None:
+        await query.answer("Список пуст.", show_alert=True)
+        return
+    await query.message.edit_reply_markup(reply_markup=keyboard)
+
+
+# Кнопки старого формата на уже отправленных сообщениях
+def _legacy_int(value: str) -> Optional[int]:
+    return int(value) if value.isdigit() else None
+
+
+def _legacy_mode(action):
+    # wl_sd, wl_st, wl_st_5 (и то же для gl_)
+    def parse(parts):
+        if len(parts) < 2:
+            return None
+        return action, {'mode': parts[1], 'lesson': _legacy_int(parts[2]) if len(parts) > 2 else None}
+    return parse
+
+
+def _legacy_option(action):
+    # sa_1, gw_2
+    def parse(parts):
+        return (action, {'option': int(parts[1])}) if len(parts) == 2 and parts[1].isdigit() else None
+    return parse
+
+
+def _legacy_id(action, field):
+    # lesson_5, page_12
+    def parse(parts):
+        return (action, {field: int(parts[1])}) if len(parts) == 2 and parts[1].isdigit() else None
+    return parse
+
+
+def _legacy_answer(parts):
+    # answer_wl_{вариант}_{режим}_{урок}
+    if len(parts) != 5 or parts[1] != 'wl' or not parts[2].isdigit():
+        return None
+    return WORDS_ANSWER, {'option': int(parts[2]), 'mode': parts[3], 'lesson': _legacy_int(parts[4])}
+
+
+register_legacy('wl', _legacy_mode(WORDS_MODE))
+register_legacy('gl', _legacy_mode(GRAMMAR_MODE))
+register_legacy('sa', _legacy_option(SYNONYM_ANSWER))
+register_legacy('gw', _legacy_option(GRAMMAR_WORD))
+register_legacy('lesson', _legacy_id(LESSON, 'lesson'))
+register_legacy('page', _legacy_id(PAGE, 'page'))
+register_legacy('answer', _legacy_answer)
+register_legacy('return', lambda parts: (LESSONS_LIST, {}) if parts == ['return', 'to', 'lessons', 'list'] else None)
+
+
+# Новые и отредактированные посты канала уроков обновляют снимки страниц
+@router.channel_post()
+@router.edited_channel_post()
+async def lesson_channel_post(message: Message):
+    status = await lesson_content.update_from_post(message)
+    if status is not None:
+        logging.info(f"Пост канала {message.message_id}: снимок страницы {status}")
+
+
+# Обработка колбеков: один обработчик aiogram, дальше — таблица по префиксу
 @router.callback_query()
 async def handle_callback_queries(query: CallbackQuery):
     try:
-        parts = query.data.split('_')
-        if len(parts) >= 1:
-            prefix = parts[0]
-            if prefix == 'wl':  # Колбеки от WordLearner
-                await word_learner.handle_callback(query)
-            elif prefix == 'sa':  # Колбеки от SynonymAntonymGame
-                await synonym_antonym_game.handle_callback(query)
-            elif prefix == 'gw':  # Колбеки от GrammarLearner
-                await grammar_learner.handle_callback(query)
-            elif prefix == 'lesson':  # Колбеки от уроков
-                await CallbackLessons.select_lesson_pages(query)
-            elif prefix == 'page':  # Колбеки страниц
-                await CallbackLessons.send_page_content(query)
-            elif prefix == 'return_to_lessons_list':  # Возврат к списку уроков
-                await lessons.show_lessons_list(query)
-        else:
-            await query.answer("Неизвестный тип callback'а.", show_alert=True)
+        await callbacks.dispatch(query)
+    except CallbackError as e:
+        logging.info(f"Колбек не обработан: {e}")
+        await query.answer("Кнопка устарела. Откройте меню заново.", show_alert=True)
+    except SessionConflict:
+        # Двойное нажатие: тот же ответ уже обработал другой воркер
+        await query.answer("Ответ уже обработан.")
     except Exception as e:
         logging.error(f"Ошибка при обработке callback: {e}", exc_info=True)
         await query.answer("Что-то пошло не так. Повторите попытку позже.", show_alert=True)
 
+# Сессию чата одновременно изменил другой обработчик (двойное нажатие)
+@router.errors(ExceptionTypeFilter(SessionConflict))
+async def session_conflict_handler(event: ErrorEvent):
+    if event.update.callback_query:
+        await event.update.callback_query.answer("Ответ уже обработан.")
+
 # Обработчик неизвестных команд
 @router.message()
 async def unknown_command(message: Message):
@@ -0,0 +1,225 @@
+"""
+Метрики бота в текстовом формате Prometheus.
+
+Счётчики, показатели и гистограммы хранятся в памяти процесса. Кроме них
+при каждом запросе к ``/metrics`` опрашиваются сборщики — функции,
+возвращающие словарь ``stats()`` кэшей и очередей; их значения выводятся
+как показатели ``verdict_<имя>_<ключ>``. Вложенные словари (например,
+статистика сессий по играм) превращаются в метку ``group``.
+
+Сервер метрик слушает ``METRICS_HOST:METRICS_PORT`` (по умолчанию
+127.0.0.1:9100); ``METRICS_PORT=0`` отключает его.
+"""
+import bisect
+import logging
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'verdict_'
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _header(self) -> List[str]:
+        # Как в client_python: HELP и TYPE называют счётчик по имени его значений
+        return [f'# HELP {self.name}_total {self.documentation}', f'# TYPE {self.name}_total {self.kind}']
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}_total{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Текущее значение, которое может как расти, так и уменьшаться."""
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счётчики по корзинам (последняя — +Inf), сумма
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, *labels: str, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][idx] += 1
+            entry[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        bucket_names = self.labelnames + ('le',)
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{_format_labels(bucket_names, labels + (_format_value(bound),))} {cumulative}'
+                )
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_str} {_format_value(total[0])}')
+            lines.append(f'{self.name}_count{label_str} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик и сборщиков статистики процесса."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], Mapping]] = {}
+
+    def _add(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, name: str, collect: Callable[[], Mapping]) -> None:
+        """Регистрирует функцию, возвращающую словарь статистики (обычно метод ``stats``)."""
+        self._collectors[name] = collect
+
+    def _render_collector(self, name: str, stats: Mapping) -> List[str]:
+        lines = []
+        values: Dict[str, List[Tuple[str, float]]] = {}
+        for key, value in stats.items():
+            if isinstance(value, Mapping):
+                for sub_key, sub_value in value.items():
+                    if isinstance(sub_value, (int, float)):
+                        values.setdefault(sub_key, []).append((str(key), sub_value))
+            elif isinstance(value, (int, float)):
+                values.setdefault(key, []).append(('', value))
+        for key, samples in values.items():
+            metric_name = f'{PREFIX}{name}_{key}'
+            lines.append(f'# TYPE {metric_name} gauge')
+            for group, value in samples:
+                labels = _format_labels(('group', ), (group, )) if group else ''
+                lines.append(f'{metric_name}{labels} {_format_value(value)}')
+        return lines
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for name, collect in list(self._collectors.items()):
+            try:
+                lines.extend(self._render_collector(name, collect()))
+            except Exception as e:
+                logger.warning(f"Не удалось собрать статистику {name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """
+    Запускает HTTP-сервер с маршрутом ``/metrics``.
+    Возвращает runner для остановки или None, если сервер отключён.
+    """
+    if not port:
+        return None
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -1,11 +1,111 @@
-from aiogram.dispatcher.middlewares import BaseMiddleware
-from aiogram.types import Update
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Optional
 
-class LoggingMiddleware(BaseMiddleware):
-    async def on_process_update(self, update: Update, data):
-        if isinstance(update.message, dict):
-            text = update.message.get("text") or ""
-            print(f"Received message from {update.message.from_user.id}: {text}")
+from aiogram import BaseMiddleware, Dispatcher, Router
+from aiogram.filters.command import Command
+from aiogram.types import TelegramObject, Update
 
-def register_middlewares(dp):
-    dp.middleware.setup(LoggingMiddleware())
\ No newline at end of file
+from bot_core import callbacks
+from bot_core.metrics import QUERY_BUCKETS, registry
+from bot_core.scheduler import ChatSchedulerMiddleware, chat_scheduler
+from db_layer.instrumentation import UpdateContext, current_update
+
+logger = logging.getLogger(__name__)
+
+UPDATE_LATENCY = registry.histogram('update_latency_seconds', 'Время обработки обновления', ('route', ))
+UPDATE_ERRORS = registry.counter('update_errors', 'Обновления, завершившиеся исключением', ('route', 'error'))
+UPDATES_IN_FLIGHT = registry.gauge('updates_in_flight', 'Обновления в обработке', ('route', ))
+UPDATE_QUERIES = registry.histogram('update_db_queries', 'SQL-запросов на обновление', ('route', ), QUERY_BUCKETS)
+
+
+# Метка для команд, которых нет среди обработчиков: число меток не растёт от ввода пользователей
+OTHER_COMMAND = 'command:other'
+
+
+def registered_commands(router: Router) -> FrozenSet[str]:
+    """Команды (без ``/``), на которые есть обработчики в роутере и вложенных роутерах."""
+    commands = set()
+    for sub_router in router.chain_tail:
+        for handler in sub_router.message.handlers:
+            for filter_object in handler.filters or ():
+                if isinstance(filter_object.callback, Command):
+                    commands.update(
+                        command for command in filter_object.callback.commands if isinstance(command, str)
+                    )
+    return frozenset(commands)
+
+
+def update_route(update: Update, commands: Optional[FrozenSet[str]] = None) -> str:
+    """
+    Метка обновления для метрик: команда (``/learn_words``), действие
+    колбека (``cb:words_answer``), ``message`` для обычного текста или тип обновления.
+    Команды не из ``commands`` (если набор передан) получают метку ``command:other``.
+    """
+    if update.message is not None:
+        text = update.message.text or ''
+        if text.startswith('/'):
+            command = text.split(maxsplit=1)[0].split('@', 1)[0]
+            if commands is not None and command[1:] not in commands:
+                return OTHER_COMMAND
+            return command
+        return 'message'
+    if update.callback_query is not None:
+        return 'cb:' + callbacks.route(update.callback_query.data)
+    return update.event_type
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Внешний middleware обновлений: задержка, ошибки, число обрабатываемых
+    обновлений и число SQL-запросов на обновление по каждому маршруту.
+
+    Параметры:
+    ----------
+    router : Optional[Router]
+        Диспетчер, по обработчикам которого определяются известные команды.
+        Набор команд собирается при первом обновлении, когда роутеры уже подключены.
+    """
+
+    def __init__(self, router: Optional[Router] = None):
+        self.router = router
+        self._commands: Optional[FrozenSet[str]] = None
+
+    def commands(self) -> Optional[FrozenSet[str]]:
+        if self._commands is None and self.router is not None:
+            self._commands = registered_commands(self.router)
+        return self._commands
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        route = update_route(event, self.commands())
+        update = UpdateContext(event.update_id)
+        token = current_update.set(update)
+        UPDATES_IN_FLIGHT.inc(route)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            UPDATE_ERRORS.inc(route, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            UPDATES_IN_FLIGHT.dec(route)
+            UPDATE_LATENCY.observe(route, value=elapsed)
+            UPDATE_QUERIES.observe(route, value=update.queries)
+            current_update.reset(token)
+            logger.debug(f"Обновление {event.update_id} ({route}): {elapsed * 1000:.1f} мс, "
+                         f"{update.queries} SQL-запросов ({update.query_time * 1000:.1f} мс)")
+
+
+def register_middlewares(dp: Dispatcher) -> None:
+    """
+    Подключает middleware к диспетчеру. Метрики стоят после планировщика чатов,
+    поэтому задержка не включает ожидание в очереди чата (его считает планировщик).
+    """
+    dp.update.outer_middleware(ChatSchedulerMiddleware(chat_scheduler))
+    dp.update.outer_middleware(MetricsMiddleware(dp))
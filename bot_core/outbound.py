@@ -0,0 +1,351 @@
+"""
+Очередь исходящих запросов к Bot API.
+
+Все запросы бота, адресованные чату (отправка, копирование и
+редактирование сообщений), проходят через middleware сессии бота и встают
+в очередь своего чата. Отправку ограничивают два маркерных ведра: общее
+(``OUTBOUND_GLOBAL_RATE`` сообщений в секунду, у Telegram около 30) и ведро
+чата (``OUTBOUND_CHAT_RATE`` в секунду для личных чатов, у Telegram около 1
+с небольшими всплесками, и ``OUTBOUND_GROUP_RATE`` в минуту для групп,
+у Telegram 20). Запросы одного чата уходят строго по порядку.
+
+Если в очереди чата последним стоит ``edit_text`` того же сообщения,
+новое редактирование заменяет его: пользователь видит только последнее
+состояние, а оба вызова получают один и тот же ответ. Ответ 429 с
+``retry_after`` возвращает запрос в начало очереди чата; чат (и вся очередь,
+если пауза длиннее ``OUTBOUND_GLOBAL_PAUSE`` секунд) ждёт указанное время,
+после ``OUTBOUND_MAX_RETRIES`` попыток запрос отбрасывается. Запросы сверх
+``OUTBOUND_QUEUE_SIZE`` в очереди (или ``OUTBOUND_CHAT_QUEUE`` в очереди
+одного чата) отбрасываются сразу с исключением ``OutboundQueueFull``.
+
+Остальные методы (ответы на колбеки, getUpdates, setWebhook) и любые запросы
+до запуска очереди выполняются напрямую. Middleware подключается к сессии
+бота, поэтому через очередь идут все модули без изменения их кода.
+"""
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, List, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage, EditMessageCaption, EditMessageReplyMarkup, EditMessageText, ForwardMessage, SendAnimation,
+    SendAudio, SendDocument, SendMessage, SendPhoto, SendVideo, SendVoice,
+)
+
+from bot_core.metrics import registry
+from learning_modules.sessions import SessionRegistry
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', 3))
+GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', 20)) / 60
+QUEUE_SIZE = int(os.getenv('OUTBOUND_QUEUE_SIZE', 10_000))
+CHAT_QUEUE_SIZE = int(os.getenv('OUTBOUND_CHAT_QUEUE', 50))
+MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 5))
+GLOBAL_PAUSE = float(os.getenv('OUTBOUND_GLOBAL_PAUSE', 5))
+WORKERS = int(os.getenv('OUTBOUND_WORKERS', 8))
+
+# Методы, которые расходуют лимиты чата
+RATE_LIMITED_METHODS = (
+    SendMessage, SendPhoto, SendVideo, SendAnimation, SendDocument, SendAudio, SendVoice,
+    CopyMessage, ForwardMessage, EditMessageText, EditMessageCaption, EditMessageReplyMarkup,
+)
+
+OUTBOUND_SENT = registry.counter('outbound_sent', 'Отправленные запросы к Bot API', ('method', ))
+OUTBOUND_RETRIES = registry.counter('outbound_retries', 'Повторы после ответа 429', ('method', ))
+OUTBOUND_DROPPED = registry.counter('outbound_dropped', 'Отброшенные исходящие запросы', ('reason', ))
+OUTBOUND_COALESCED = registry.counter('outbound_coalesced', 'Редактирования, объединённые с предыдущим')
+OUTBOUND_WAIT = registry.histogram('outbound_wait_seconds', 'Время ожидания запроса в очереди', ('method', ))
+
+
+class OutboundQueueFull(Exception):
+    """Исходящая очередь (общая или чата) переполнена, запрос отброшен."""
+
+
+class TokenBucket:
+    """Маркерное ведро: rate маркеров в секунду, не больше capacity про запас."""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен маркер (0 — уже доступен)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Request:
+    """Запрос в очереди чата."""
+    __slots__ = ('make_request', 'bot', 'method', 'futures', 'enqueued_at', 'attempts')
+
+    def __init__(self, make_request, bot, method, future: asyncio.Future):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.futures: List[asyncio.Future] = [future]
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def resolve(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        for future in self.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def cancel(self) -> None:
+        for future in self.futures:
+            future.cancel()
+
+
+def _is_same_edit(queued: _Request, method) -> bool:
+    previous = queued.method
+    return (
+        isinstance(method, EditMessageText) and isinstance(previous, EditMessageText)
+        and method.inline_message_id is None and previous.inline_message_id is None
+        and previous.message_id == method.message_id
+    )
+
+
+class OutboundQueue:
+    """
+    Очереди исходящих запросов по чатам с общим и початовым ограничением скорости.
+
+    Параметры:
+    ----------
+    global_rate : float
+        Запросов в секунду на весь бот.
+    chat_rate, chat_burst : float, int
+        Запросов в секунду и размер всплеска для личного чата.
+    group_rate : float
+        Запросов в секунду для группы (id чата отрицательный).
+    workers : int
+        Сколько запросов может выполняться одновременно (разных чатов).
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST, group_rate: float = GROUP_RATE,
+                 queue_size: int = QUEUE_SIZE, chat_queue_size: int = CHAT_QUEUE_SIZE,
+                 max_retries: int = MAX_RETRIES, workers: int = WORKERS):
+        self.queue_size = queue_size
+        self.chat_queue_size = chat_queue_size
+        self.max_retries = max_retries
+        self.workers = workers
+        self._global = TokenBucket(global_rate, max(1.0, global_rate))
+        self._paused_until = 0.0
+        # Вёдра чатов живут, пока чат пишет; давно молчащие вытесняются
+        self._chat_buckets = SessionRegistry(functools.partial(TokenBucket, chat_rate, chat_burst),
+                                             max_sessions=100_000, idle_ttl=600.0)
+        self._group_buckets = SessionRegistry(functools.partial(TokenBucket, group_rate, 1),
+                                              max_sessions=10_000, idle_ttl=600.0)
+        self._queues: Dict[Hashable, Deque[_Request]] = {}
+        # Чаты с запросами, которые не выполняются сейчас: (время готовности, порядок, чат)
+        self._ready: List[Tuple[float, int, Hashable]] = []
+        self._in_flight: set = set()
+        self._order = itertools.count()
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        self.pending = 0
+        self.sent = 0
+        self.retries = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    @property
+    def started(self) -> bool:
+        return self._wakeup is not None
+
+    def _bucket(self, chat_id: Hashable) -> TokenBucket:
+        if isinstance(chat_id, int) and chat_id < 0:
+            return self._group_buckets.get(chat_id)
+        return self._chat_buckets.get(chat_id)
+
+    def _schedule(self, chat_id: Hashable, not_before: float = 0.0) -> None:
+        now = time.monotonic()
+        ready_at = max(not_before, now + self._bucket(chat_id).delay(now))
+        heapq.heappush(self._ready, (ready_at, next(self._order), chat_id))
+
+    def _drop(self, reason: str) -> None:
+        self.dropped += 1
+        OUTBOUND_DROPPED.inc(reason)
+
+    async def submit(self, make_request, bot, method) -> Any:
+        """Ставит запрос в очередь чата и ждёт ответа Bot API."""
+        chat_id = method.chat_id
+        future = asyncio.get_running_loop().create_future()
+        async with self._wakeup:
+            queue = self._queues.get(chat_id)
+            if queue and _is_same_edit(queue[-1], method):
+                # Предыдущее редактирование ещё не отправлено: отправится только последнее
+                queue[-1].method = method
+                queue[-1].futures.append(future)
+                self.coalesced += 1
+                OUTBOUND_COALESCED.inc()
+            elif self.pending >= self.queue_size:
+                self._drop('queue_full')
+                raise OutboundQueueFull(f"Исходящая очередь переполнена ({self.pending})")
+            elif queue is not None and len(queue) >= self.chat_queue_size:
+                self._drop('chat_queue_full')
+                raise OutboundQueueFull(f"Очередь чата {chat_id} переполнена ({len(queue)})")
+            else:
+                if queue is None:
+                    queue = self._queues[chat_id] = deque()
+                queue.append(_Request(make_request, bot, method, future))
+                self.pending += 1
+                if len(queue) == 1 and chat_id not in self._in_flight:
+                    self._schedule(chat_id)
+                    self._wakeup.notify()
+        return await future
+
+    async def _next(self) -> Tuple[Hashable, _Request]:
+        """Ждёт чат, у которого есть маркер, и забирает его первый запрос."""
+        async with self._wakeup:
+            while True:
+                now = time.monotonic()
+                timeout = None
+                if self._ready:
+                    wait = max(self._ready[0][0], self._paused_until) - now
+                    if wait <= 0:
+                        wait = self._global.delay(now)
+                    if wait <= 0:
+                        break
+                    timeout = wait
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            _, _, chat_id = heapq.heappop(self._ready)
+            request = self._queues[chat_id].popleft()
+            self._global.take(now)
+            self._bucket(chat_id).take(now)
+            self._in_flight.add(chat_id)
+            return chat_id, request
+
+    async def _finish(self, chat_id: Hashable, request: _Request, retry_after: Optional[float]) -> None:
+        async with self._wakeup:
+            self._in_flight.discard(chat_id)
+            queue = self._queues[chat_id]
+            not_before = 0.0
+            if retry_after is not None:
+                queue.appendleft(request)
+                not_before = time.monotonic() + retry_after
+                if retry_after >= GLOBAL_PAUSE:
+                    # Длинная пауза означает общий флуд-контроль: останавливаем всю очередь
+                    self._paused_until = max(self._paused_until, not_before)
+            else:
+                self.pending -= 1
+            if queue:
+                self._schedule(chat_id, not_before)
+                self._wakeup.notify()
+            else:
+                del self._queues[chat_id]
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id, request = await self._next()
+            method_name = type(request.method).__name__
+            retry_after = None
+            request.attempts += 1
+            if request.attempts == 1:
+                OUTBOUND_WAIT.observe(method_name, value=time.monotonic() - request.enqueued_at)
+            try:
+                result = await request.make_request(request.bot, request.method)
+            except asyncio.CancelledError:
+                request.cancel()
+                raise
+            except TelegramRetryAfter as e:
+                self.retries += 1
+                OUTBOUND_RETRIES.inc(method_name)
+                if request.attempts <= self.max_retries:
+                    retry_after = float(e.retry_after)
+                    logger.warning(f"Флуд-контроль в чате {chat_id}: повтор {method_name} через {e.retry_after} с")
+                else:
+                    self._drop('retries_exhausted')
+                    request.resolve(error=e)
+            except Exception as e:
+                request.resolve(error=e)
+            else:
+                self.sent += 1
+                OUTBOUND_SENT.inc(method_name)
+                request.resolve(result)
+            await self._finish(chat_id, request, retry_after)
+
+    def start(self) -> None:
+        """Запускает отправку в текущем цикле событий."""
+        if self.started:
+            return
+        self._wakeup = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дожидается отправки очереди (не дольше timeout) и останавливает отправку."""
+        if not self.started:
+            return
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.pending:
+            logger.warning(f"Остановка исходящей очереди: не отправлено {self.pending} запросов")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+        for queue in self._queues.values():
+            for request in queue:
+                request.cancel()
+        self._queues.clear()
+        self._ready.clear()
+        self._in_flight.clear()
+        self.pending = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Глубина очереди и счётчики для метрик."""
+        return {
+            'pending': self.pending,
+            'chats': len(self._queues),
+            'in_flight': len(self._in_flight),
+            'sent': self.sent,
+            'retries': self.retries,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'paused': max(0.0, self._paused_until - time.monotonic()),
+        }
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: запросы к чатам идут через исходящую очередь."""
+
+    def __init__(self, queue: OutboundQueue):
+        self.queue = queue
+
+    async def __call__(self, make_request, bot, method):
+        if not self.queue.started or not isinstance(method, RATE_LIMITED_METHODS) or method.chat_id is None:
+            return await make_request(bot, method)
+        return await self.queue.submit(make_request, bot, method)
+
+
+outbound_queue = OutboundQueue()
@@ -0,0 +1,236 @@
+"""
+Планировщик обработки обновлений по чатам.
+
+Обновления одного чата выполняются строго по очереди в порядке поступления,
+поэтому два быстрых нажатия не меняют состояние игры одновременно.
+Разные чаты обрабатываются параллельно ограниченным числом обработчиков
+(``SCHEDULER_WORKERS``). Готовые к обработке чаты стоят в общей очереди
+по кругу: за один заход из чата берётся одно обновление, и чат с длинной
+очередью не задерживает остальных.
+
+Планировщик подключается к диспетчеру как внешний middleware обновлений
+и одинаково работает при поллинге и при вебхуке.
+"""
+import asyncio
+import heapq
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from learning_modules.sessions import SessionRegistry
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class _ChatQueue:
+    """Очередь обновлений одного чата."""
+    __slots__ = ('jobs', )
+
+    def __init__(self):
+        self.jobs: Deque[Tuple[Job, asyncio.Future, float]] = deque()
+
+
+class ChatStats:
+    """Накопленная статистика ожидания для чата."""
+    __slots__ = ('processed', 'total_wait', 'max_wait', 'last_wait')
+
+    def __init__(self):
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+
+class ChatScheduler:
+    """
+    Очередь заданий с упорядочиванием внутри чата и параллелизмом между чатами.
+
+    Параметры:
+    ----------
+    workers : int
+        Максимальное число одновременно выполняемых заданий.
+    stats_chats : int
+        Для скольких последних чатов хранится статистика ожидания.
+    """
+
+    def __init__(self, workers: int = 32, stats_chats: int = 10_000):
+        self.workers = workers
+        self._queues: Dict[Hashable, _ChatQueue] = {}
+        self._ready: Optional["asyncio.Queue[Hashable]"] = None
+        self._tasks: List[asyncio.Task] = []
+        self._chat_stats = SessionRegistry(ChatStats, max_sessions=stats_chats, idle_ttl=3600.0)
+        self.pending = 0
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def started(self) -> bool:
+        return self._ready is not None
+
+    def submit(self, key: Hashable, job: Job) -> asyncio.Future:
+        """
+        Ставит задание в очередь чата и возвращает future с его результатом.
+        Задание начнётся после всех ранее поставленных заданий этого чата.
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _ChatQueue()
+            # Чат попадает в общую очередь, только когда у него появляется работа
+            self._ready.put_nowait(key)
+        queue.jobs.append((job, future, time.monotonic()))
+        self.pending += 1
+        return future
+
+    async def run(self, key: Optional[Hashable], job: Job) -> Any:
+        """
+        Выполняет задание в очереди чата и возвращает его результат.
+        Без ключа или до запуска планировщика задание выполняется сразу.
+        """
+        if key is None or not self.started:
+            return await job()
+        return await self.submit(key, job)
+
+    def _record_wait(self, key: Hashable, wait: float) -> None:
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        stats = self._chat_stats.get(key)
+        stats.processed += 1
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        stats.last_wait = wait
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._queues[key]
+            job, future, enqueued_at = queue.jobs.popleft()
+            self.pending -= 1
+            self._record_wait(key, time.monotonic() - enqueued_at)
+            self.running += 1
+            try:
+                if not future.cancelled():
+                    result = await job()
+                    if not future.done():
+                        future.set_result(result)
+                self.processed += 1
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.running -= 1
+                # Остаток очереди чата встаёт в конец общей очереди
+                if queue.jobs:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._queues[key]
+
+    def start(self) -> None:
+        """Запускает обработчики в текущем цикле событий."""
+        if self.started:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дожидается выполнения поставленных заданий (не дольше timeout) и останавливает обработчики."""
+        if not self.started:
+            return
+        deadline = time.monotonic() + timeout
+        while (self.pending or self.running) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.pending or self.running:
+            logger.warning(f"Остановка планировщика: не выполнено {self.pending + self.running} заданий")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._ready = None
+        for queue in self._queues.values():
+            for _, future, _ in queue.jobs:
+                future.cancel()
+        self._queues.clear()
+        self.pending = 0
+
+    def chat_stats(self, key: Hashable) -> Optional[Dict[str, float]]:
+        """Глубина очереди и время ожидания для чата или None, если чат давно не писал."""
+        stats = self._chat_stats.find(key)
+        if stats is None:
+            return None
+        queue = self._queues.get(key)
+        return {
+            'depth': len(queue.jobs) if queue else 0,
+            'processed': stats.processed,
+            'avg_wait': stats.total_wait / stats.processed if stats.processed else 0.0,
+            'max_wait': stats.max_wait,
+            'last_wait': stats.last_wait,
+        }
+
+    def deepest_chats(self, limit: int = 10) -> List[Tuple[Hashable, int]]:
+        """Чаты с самыми длинными очередями."""
+        return heapq.nlargest(limit, ((key, len(queue.jobs)) for key, queue in self._queues.items()),
+                              key=lambda item: item[1])
+
+    def deepest_chat_stats(self, limit: int = 10) -> Dict[str, Dict[str, float]]:
+        """
+        Статистика ``chat_stats`` для чатов с самыми длинными очередями, по id чата.
+        Число чатов ограничено ``limit``, поэтому набор меток в метриках не растёт.
+        """
+        result = {}
+        for key, depth in self.deepest_chats(limit):
+            # У чата, первое задание которого ещё ждёт, статистики ожидания пока нет
+            result[str(key)] = self.chat_stats(key) or {
+                'depth': depth, 'processed': 0, 'avg_wait': 0.0, 'max_wait': 0.0, 'last_wait': 0.0,
+            }
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        """Счётчики планировщика для метрик и отладки."""
+        return {
+            'workers': self.workers,
+            'pending': self.pending,
+            'running': self.running,
+            'active_chats': len(self._queues),
+            'processed': self.processed,
+            'failed': self.failed,
+            'avg_wait': self.total_wait / self.processed if self.processed else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+class ChatSchedulerMiddleware(BaseMiddleware):
+    """Внешний middleware обновлений: передаёт обработку обновления планировщику чатов."""
+
+    def __init__(self, scheduler: ChatScheduler):
+        self.scheduler = scheduler
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get('event_chat')
+        user = data.get('event_from_user')
+        key = chat.id if chat is not None else (user.id if user is not None else None)
+        return await self.scheduler.run(key, lambda: handler(event, data))
+
+
+# Сколько чатов с самыми длинными очередями показывать в метриках
+STATS_TOP_CHATS = int(os.getenv('SCHEDULER_STATS_TOP_CHATS', 10))
+
+chat_scheduler = ChatScheduler(workers=int(os.getenv('SCHEDULER_WORKERS', 32)))
@@ -11,6 +11,7 @@ class System_commands:
 - /learn_words — изучение новых слов.
 - /grammar_game — игра на проверку грамматики и перевода предложений.
 - /lessons — список всех уроков.
+- /stats — ваша статистика ответов.
 - /view_buttons — показ кнопок навигации.
 - /hide_buttons — скрытие кнопок навигации.
 
@@ -0,0 +1,164 @@
+"""
+Приём обновлений Telegram через вебхук.
+
+Обновления принимаются aiohttp-сервером и сразу передаются диспетчеру
+отдельными задачами; параллелизм и порядок внутри чата обеспечивает
+планировщик ``bot_core.scheduler``. Ответ Telegram отправляется сразу
+после приёма. Если необработанных обновлений больше ``WEBHOOK_QUEUE_SIZE``,
+сервер отвечает 429 с ``Retry-After``, а во время остановки — 503:
+Telegram повторит доставку позже, и бот не накапливает неограниченное
+число задач.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from bot_core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookIngress:
+    """
+    Приём обновлений с ограничением числа необработанных.
+
+    Параметры:
+    ----------
+    dispatcher : Dispatcher
+        Диспетчер, которому передаются обновления.
+    bot : Bot
+        Бот, от имени которого обрабатываются обновления.
+    queue_size : int
+        Сколько обновлений может ждать обработки; сверх этого сервер отвечает 429.
+    secret_token : Optional[str]
+        Секрет из заголовка ``X-Telegram-Bot-Api-Secret-Token``; без него проверка отключена.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, queue_size: int = 1000,
+                 secret_token: Optional[str] = None, retry_after: int = 1):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.queue_size = queue_size
+        self.secret_token = secret_token
+        self.retry_after = retry_after
+        self._tasks: Set[asyncio.Task] = set()
+        self._accepting = False
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Обработчик POST-запроса от Telegram."""
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            return web.Response(status=401)
+        if not self._accepting:
+            return web.Response(status=503, headers={'Retry-After': str(self.retry_after)})
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception as e:
+            logger.warning(f"Некорректное обновление в вебхуке: {e}")
+            return web.Response(status=400)
+        if len(self._tasks) >= self.queue_size:
+            self.rejected += 1
+            return web.Response(status=429, headers={'Retry-After': str(self.retry_after)})
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.accepted += 1
+        return web.Response(status=200)
+
+    async def health(self, request: web.Request) -> web.Response:
+        """Состояние очереди для балансировщика и отладки."""
+        return web.json_response(self.stats(), status=200 if self._accepting else 503)
+
+    async def _process(self, update: Update) -> None:
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}", exc_info=True)
+
+    async def start(self) -> None:
+        """Начинает приём обновлений."""
+        self._accepting = True
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Прекращает приём и дожидается обработки принятых обновлений (не дольше timeout)."""
+        self._accepting = False
+        if not self._tasks:
+            return
+        started = time.monotonic()
+        _, unfinished = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if unfinished:
+            logger.warning(f"Остановка вебхука: не обработано {len(unfinished)} обновлений "
+                           f"за {time.monotonic() - started:.1f} с")
+            for task in unfinished:
+                task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики очереди для метрик и отладки."""
+        return {
+            'pending': len(self._tasks),
+            'queue_size': self.queue_size,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'processed': self.processed,
+            'failed': self.failed,
+        }
+
+
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')                   # Публичный адрес, например https://bot.example.com
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+
+
+def create_webhook_app(ingress: WebhookIngress, path: str = WEBHOOK_PATH) -> web.Application:
+    """Создаёт aiohttp-приложение с маршрутом вебхука и проверкой состояния."""
+    app = web.Application()
+    app.router.add_post(path, ingress.handle)
+    app.router.add_get('/healthz', ingress.health)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot) -> None:
+    """
+    Запускает приём обновлений через вебхук и работает до отмены.
+    Если задан WEBHOOK_URL, адрес регистрируется в Telegram при старте;
+    без него сервер можно наполнять обновлениями локально.
+    """
+    ingress = WebhookIngress(
+        dispatcher, bot,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        secret_token=WEBHOOK_SECRET,
+    )
+    registry.register_collector('webhook', ingress.stats)
+    runner = web.AppRunner(create_webhook_app(ingress))
+    await runner.setup()
+    await ingress.start()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await ingress.stop()
+        await runner.cleanup()
@@ -1,11 +1,17 @@
 import asyncio
-import aioredis
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+REDIS_DB = int(os.getenv('REDIS_DB', 0))
+REDIS_URL = os.getenv('REDIS_URL', f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}')
+
 async def init_redis_cache():
+    # aioredis импортируется только здесь: модуль нужен ради настроек подключения
+    import aioredis
     global redis_pool
     redis_host = os.getenv('REDIS_HOST', 'localhost')
     redis_port = int(os.getenv('REDIS_PORT', 6379))
@@ -0,0 +1,183 @@
+"""
+Хранилища игровых сессий.
+
+``MemorySessionBackend`` держит состояние в памяти процесса (один воркер).
+``RedisSessionBackend`` хранит его в Redis, и любой воркер может обработать
+любой колбек. Состояние сериализуется компактно: JSON-массив значений
+слотов в порядке ``__slots__`` с номером версии впереди.
+
+Обновление занимает два обращения к Redis: GET при чтении и один скрипт
+compare-and-set при записи. Если между ними сессию успел сохранить другой
+воркер (двойное нажатие), запись отклоняется исключением ``SessionConflict``.
+Для тестов вместо Redis можно передать клиент ``fakeredis.aioredis.FakeRedis``
+(нужен пакет ``fakeredis[lua]``).
+"""
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Optional, Tuple
+
+from learning_modules.sessions import SESSION_MAX, SESSION_TTL, SessionRegistry
+
+
+class SessionConflict(Exception):
+    """Сессию одновременно изменил другой обработчик."""
+
+
+def dump_state(state: Any) -> str:
+    """Сериализует объект состояния в JSON-массив значений его слотов."""
+    return json.dumps([getattr(state, name) for name in type(state).__slots__],
+                      ensure_ascii=False, separators=(',', ':'))
+
+
+def load_state(factory: Callable[[], Any], data: str) -> Optional[Any]:
+    """
+    Восстанавливает состояние из ``dump_state``.
+    Возвращает None, если набор слотов изменился (данные от старой версии бота).
+    """
+    state = factory()
+    values = json.loads(data)
+    slots = type(state).__slots__
+    if len(values) != len(slots):
+        return None
+    for name, value in zip(slots, values):
+        setattr(state, name, value)
+    return state
+
+
+class MemorySessionBackend:
+    """Сессии в памяти процесса на основе SessionRegistry."""
+
+    def __init__(self, max_sessions: int = SESSION_MAX, idle_ttl: float = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._registries: Dict[str, SessionRegistry] = {}
+
+    def _registry(self, kind: str, factory: Callable[[], Any]) -> SessionRegistry:
+        registry = self._registries.get(kind)
+        if registry is None:
+            registry = SessionRegistry(factory, max_sessions=self.max_sessions, idle_ttl=self.idle_ttl)
+            self._registries[kind] = registry
+        return registry
+
+    @asynccontextmanager
+    async def session(self, kind: str, key: Hashable, factory: Callable[[], Any],
+                      create: bool = True) -> AsyncIterator[Optional[Any]]:
+        registry = self._registry(kind, factory)
+        yield registry.get(key) if create else registry.find(key)
+
+    async def drop(self, kind: str, key: Hashable) -> None:
+        registry = self._registries.get(kind)
+        if registry is not None:
+            registry.drop(key)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {kind: registry.stats() for kind, registry in self._registries.items()}
+
+
+# Записывает новое значение, только если версия в Redis не изменилась с момента чтения
+_CAS_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+local version = 0
+if current then
+    version = tonumber(string.match(current, '^(%d+)|'))
+end
+if version ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class RedisSessionBackend:
+    """
+    Сессии в Redis с оптимистичной блокировкой.
+
+    Параметры:
+    ----------
+    client : redis.asyncio.Redis
+        Асинхронный клиент Redis (или fakeredis) с decode_responses=True.
+    idle_ttl : float
+        Время жизни неактивной сессии в секундах.
+    prefix : str
+        Префикс ключей.
+    """
+
+    def __init__(self, client, idle_ttl: float = SESSION_TTL, prefix: str = 'verdict:session'):
+        self.client = client
+        self.idle_ttl = int(idle_ttl)
+        self.prefix = prefix
+        self._cas = client.register_script(_CAS_SCRIPT)
+        self.loads = 0
+        self.saves = 0
+        self.conflicts = 0
+
+    def _key(self, kind: str, key: Hashable) -> str:
+        return f"{self.prefix}:{kind}:{key}"
+
+    async def _load(self, redis_key: str, factory: Callable[[], Any]) -> Tuple[int, Optional[Any]]:
+        raw = await self.client.get(redis_key)
+        self.loads += 1
+        if raw is None:
+            return 0, None
+        version, _, data = raw.partition('|')
+        return int(version), load_state(factory, data)
+
+    @asynccontextmanager
+    async def session(self, kind: str, key: Hashable, factory: Callable[[], Any],
+                      create: bool = True) -> AsyncIterator[Optional[Any]]:
+        redis_key = self._key(kind, key)
+        version, state = await self._load(redis_key, factory)
+        if state is None:
+            if not create:
+                yield None
+                return
+            state = factory()
+        before = dump_state(state)
+
+        yield state
+
+        after = dump_state(state)
+        if after == before and version:
+            return
+        saved = await self._cas(keys=[redis_key], args=[version, f"{version + 1}|{after}", self.idle_ttl])
+        if not saved:
+            self.conflicts += 1
+            raise SessionConflict(redis_key)
+        self.saves += 1
+
+    async def drop(self, kind: str, key: Hashable) -> None:
+        await self.client.delete(self._key(kind, key))
+
+    def stats(self) -> Dict[str, int]:
+        return {'loads': self.loads, 'saves': self.saves, 'conflicts': self.conflicts}
+
+
+_backend = None
+
+
+def create_session_backend():
+    """Создаёт хранилище по переменной окружения SESSION_BACKEND (memory или redis)."""
+    kind = os.getenv('SESSION_BACKEND', 'memory')
+    if kind == 'redis':
+        from redis.asyncio import Redis
+        from cache_system.redis_config import REDIS_URL
+        return RedisSessionBackend(Redis.from_url(REDIS_URL, decode_responses=True))
+    if kind == 'memory':
+        return MemorySessionBackend()
+    raise ValueError(f"Неизвестное хранилище сессий: {kind}")
+
+
+def get_session_backend():
+    """Текущее хранилище сессий; создаётся при первом обращении."""
+    global _backend
+    if _backend is None:
+        _backend = create_session_backend()
+    return _backend
+
+
+def set_session_backend(backend) -> None:
+    """Подменяет хранилище сессий (например, на fakeredis в тестах)."""
+    global _backend
+    _backend = backend
@@ -0,0 +1,151 @@
+"""
+Буфер отложенной записи журнала ответов.
+
+Каждый ответ в играх добавляется в память и записывается в ``answer_events``
+пачкой вместе с итогами пользователей (``save_user_progress``): одна
+транзакция на пачку вместо нескольких запросов на ответ. Сброс выполняется
+по таймеру, при достижении размера буфера и при остановке бота,
+как у буфера метрик (``db_layer.metric_buffer``); пачка, которая не
+записалась несколько раз подряд, пишется по частям, а непишущиеся ответы
+отбрасываются (``db_layer.batch_write``).
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from db_layer.async_repository import run_in_db_thread
+from db_layer.batch_write import FLUSH_MAX_RETRIES, write_isolating
+from db_layer.repository import AnswerRecord, save_user_progress
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerLogWriter:
+    """
+    Накопитель ответов с периодическим пакетным сбросом.
+
+    Параметры:
+    ----------
+    max_pending : int
+        Количество ответов, после которого сброс запускается досрочно.
+    flush_interval : float
+        Максимальное время (в секундах) между сбросами.
+    max_retries : int
+        После скольких неудачных сбросов подряд пачка пишется по частям.
+    """
+
+    def __init__(self, max_pending: int = 500, flush_interval: float = 5.0, max_retries: int = 3):
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._failed_in_row = 0
+        self._pending: List[AnswerRecord] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+
+    def add(self, user_id: int, game: str, item_id: Optional[int], is_correct: bool) -> None:
+        """Добавляет ответ пользователя. Не обращается к базе данных."""
+        record = AnswerRecord(user_id, game, item_id, bool(is_correct), time.time())
+        with self._lock:
+            self._pending.append(record)
+            size = len(self._pending)
+        if size >= self.max_pending:
+            self._request_flush()
+
+    def _request_flush(self) -> None:
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        else:
+            # Фоновая задача не запущена (скрипты, отладка): пишем сразу
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Записывает накопленные ответы одной транзакцией.
+        При ошибке ответы возвращаются в начало буфера, порядок сохраняется;
+        после ``max_retries`` неудач подряд пачка пишется по частям,
+        а непишущиеся ответы отбрасываются.
+
+        Возвращает количество записанных ответов.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                written = save_user_progress(batch)
+            except Exception:
+                self.failed_flushes += 1
+                self._failed_in_row += 1
+                if self._failed_in_row < self.max_retries:
+                    with self._lock:
+                        self._pending[:0] = batch
+                    raise
+                parts, dropped = write_isolating(save_user_progress, batch)
+                self.dropped_rows += len(dropped)
+                written = sum(parts)
+            self._failed_in_row = 0
+            self.flushes += 1
+            self.flushed_rows += written
+        return written
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await run_in_db_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Ошибка при записи журнала ответов: {e}", exc_info=True)
+
+    def start(self) -> None:
+        """Запускает фоновый сброс в текущем цикле событий."""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и записывает остаток буфера."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
+        self._wakeup = None
+        await run_in_db_thread(self.flush)
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики буфера для метрик и отладки."""
+        return {
+            'pending': len(self._pending),
+            'flushed_rows': self.flushed_rows,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'dropped_rows': self.dropped_rows,
+        }
+
+
+answer_log = AnswerLogWriter(
+    max_pending=int(os.getenv('ANSWER_LOG_FLUSH_SIZE', 500)),
+    flush_interval=float(os.getenv('ANSWER_LOG_FLUSH_INTERVAL', 5.0)),
+    max_retries=FLUSH_MAX_RETRIES,
+)
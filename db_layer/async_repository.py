@@ -0,0 +1,76 @@
+"""
+Асинхронный вариант репозитория.
+
+Функции имеют те же имена и параметры, что и в ``db_layer.repository``,
+но выполняются в ограниченном пуле потоков, поэтому медленный запрос
+к SQLite не блокирует цикл событий и не задерживает обновления других чатов.
+Размер пула задаётся переменной окружения ``DB_THREADS``. Функции выполняются
+в копии контекста вызывающей корутины, поэтому контекстные переменные
+(например, текущее обновление для учёта запросов) доступны и в потоке.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from db_layer import repository
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('DB_THREADS', 4)),
+    thread_name_prefix='db',
+)
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с БД в пуле потоков репозитория."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+def _make_async(func):
+    """Оборачивает синхронную функцию репозитория в корутину."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db_thread(func, *args, **kwargs)
+    return wrapper
+
+
+def shutdown():
+    """Дожидается завершения запросов и останавливает пул потоков."""
+    _executor.shutdown(wait=True)
+
+
+get_single_random_word_from_lesson = _make_async(repository.get_single_random_word_from_lesson)
+get_random_words_by_lesson = _make_async(repository.get_random_words_by_lesson)
+build_word_question = _make_async(repository.build_word_question)
+get_lessons_from_db = _make_async(repository.get_lessons_from_db)
+get_lesson_counts = _make_async(repository.get_lesson_counts)
+get_all_pages = _make_async(repository.get_all_pages)
+get_pages_by_lesson = _make_async(repository.get_pages_by_lesson)
+get_page_info = _make_async(repository.get_page_info)
+get_page_contents = _make_async(repository.get_page_contents)
+save_page_content = _make_async(repository.save_page_content)
+get_all_words = _make_async(repository.get_all_words)
+get_single_random_word = _make_async(repository.get_single_random_word)
+get_random_words = _make_async(repository.get_random_words)
+get_random_word_with_relations = _make_async(repository.get_random_word_with_relations)
+get_random_sentence = _make_async(repository.get_random_sentence)
+get_random_words_for_options = _make_async(repository.get_random_words_for_options)
+search_records_by_word = _make_async(repository.search_records_by_word)
+upsert_metric_values = _make_async(repository.upsert_metric_values)
+get_review_cards = _make_async(repository.get_review_cards)
+upsert_review_cards = _make_async(repository.upsert_review_cards)
+add_or_update_metric_value = _make_async(repository.add_or_update_metric_value)
+remove_zero_values = _make_async(repository.remove_zero_values)
+update_metric_value = _make_async(repository.update_metric_value)
+find_word_by_text = _make_async(repository.find_word_by_text)
+search_records_by_word_pair = _make_async(repository.search_records_by_word_pair)
+next_sentence = _make_async(repository.next_sentence)
+get_random_sentence_by_lesson = _make_async(repository.get_random_sentence_by_lesson)
+get_sentences_by_lesson = _make_async(repository.get_sentences_by_lesson)
+get_all_sentences = _make_async(repository.get_all_sentences)
+add_user = _make_async(repository.add_user)
+get_user_by_telegram_id = _make_async(repository.get_user_by_telegram_id)
+save_user_progress = _make_async(repository.save_user_progress)
@@ -0,0 +1,46 @@
+"""
+Запись пачек буферов с изоляцией плохих строк.
+
+Буферы отложенной записи (метрики, карточки повторения, журнал ответов)
+при ошибке возвращают пачку в буфер и повторяют сброс. Если пачка не
+записалась ``FLUSH_MAX_RETRIES`` раз подряд, она пишется по частям:
+часть с ошибкой делится пополам, пока не останется одна строка, и строка,
+которая не пишется и поодиночке (например, нарушение внешнего ключа после
+удаления слова), отбрасывается. Так одна плохая строка не блокирует все
+следующие сбросы, а буфер не растёт без ограничения.
+"""
+import logging
+import os
+from typing import Any, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+FLUSH_MAX_RETRIES = int(os.getenv('FLUSH_MAX_RETRIES', 3))
+
+
+def write_isolating(write: Callable[[Any], Any], batch) -> Tuple[List[Any], List[Any]]:
+    """
+    Записывает пачку (словарь или список) функцией ``write``, деля её при ошибках.
+
+    Возвращает результаты ``write`` для записанных частей и отброшенные
+    элементы (пары ключ-значение для словаря).
+    """
+    make = dict if isinstance(batch, dict) else list
+    items = list(batch.items()) if isinstance(batch, dict) else list(batch)
+    results, dropped = [], []
+    # Части обрабатываются по порядку: первая половина раньше второй
+    stack = [items]
+    while stack:
+        part = stack.pop()
+        if not part:
+            continue
+        try:
+            results.append(write(make(part)))
+        except Exception as e:
+            if len(part) == 1:
+                logger.error(f"Строка отброшена: не записывается и поодиночке ({e}): {part[0]!r}")
+                dropped.append(part[0])
+                continue
+            middle = len(part) // 2
+            stack.extend((part[middle:], part[:middle]))
+    return results, dropped
@@ -0,0 +1,196 @@
+"""
+Индекс путаницы слов для трудных неправильных вариантов.
+
+Пара (word1_id, word2_id) в ``metric_word_value`` означает, что на вопрос
+о слове word1 пользователи выбирали word2, а value — насколько часто.
+Для каждого слова хранятся ``CONFUSION_TOP_K`` слов, с которыми его путают
+чаще всего, в формате CSR (indptr/ids/values) в порядке убывания value.
+Список выбирается в базе одним запросом с ``row_number() OVER (PARTITION
+BY word1_id ...)``, поэтому вся таблица в память не загружается.
+
+Индекс обновляется инкрементально: после записи буфера метрик
+(``db_layer.metric_buffer``) новые значения пар передаются в ``apply``,
+и списки затронутых слов пересчитываются за O(k). Значения из буфера только
+растут, поэтому пара попадает в список только после записи, которую
+``apply`` и учитывает. Прочие изменения таблицы (события маппера, затухание
+метрик) и ``CONFUSION_INDEX_MAX_AGE`` секунд приводят к полной перезагрузке.
+"""
+import bisect
+import os
+import random
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, select
+
+from db_layer.models import MetricWordsValue, SessionLocal
+
+TOP_K = int(os.getenv('CONFUSION_TOP_K', 8))
+# Сколько неправильных вариантов вопроса брать из списка путаницы
+HARD_DISTRACTORS = int(os.getenv('CONFUSION_HARD_DISTRACTORS', 1))
+
+_EMPTY: Tuple[int, ...] = ()
+
+
+class _Snapshot:
+    """Списки путаницы: CSR по словам и переопределения после инкрементальных обновлений."""
+    __slots__ = ('row_of', 'indptr', 'ids', 'values', 'updated')
+
+    def __init__(self, rows: Iterable[Tuple[int, int, float]]):
+        # Строки приходят упорядоченными по word1_id и убыванию value
+        self.row_of: Dict[int, int] = {}
+        self.indptr = array('l', [0])
+        self.ids = array('q')
+        self.values = array('d')
+        for word1_id, word2_id, value in rows:
+            if word1_id not in self.row_of:
+                if self.row_of:
+                    self.indptr.append(len(self.ids))
+                self.row_of[word1_id] = len(self.row_of)
+            self.ids.append(word2_id)
+            self.values.append(value)
+        if self.row_of:
+            self.indptr.append(len(self.ids))
+        # word1_id → [(value, word2_id), ...] по убыванию value для обновлённых слов
+        self.updated: Dict[int, List[Tuple[float, int]]] = {}
+
+    def entries(self, word_id: int) -> List[Tuple[float, int]]:
+        entries = self.updated.get(word_id)
+        if entries is not None:
+            return entries
+        row = self.row_of.get(word_id)
+        if row is None:
+            return []
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return [(self.values[idx], self.ids[idx]) for idx in range(start, end)]
+
+    def top(self, word_id: int) -> Tuple[int, ...]:
+        entries = self.updated.get(word_id)
+        if entries is not None:
+            return tuple(other_id for _, other_id in entries)
+        row = self.row_of.get(word_id)
+        if row is None:
+            return _EMPTY
+        return tuple(self.ids[self.indptr[row]:self.indptr[row + 1]])
+
+
+class ConfusionIndex:
+    """
+    Индекс путаницы в памяти процесса.
+
+    Параметры:
+    ----------
+    top_k : int
+        Длина списка путаницы для каждого слова.
+    max_age : Optional[float]
+        Через сколько секунд индекс перечитывается целиком.
+    """
+
+    def __init__(self, top_k: int = TOP_K, max_age: Optional[float] = None):
+        self.top_k = top_k
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._dirty = True
+        self._loaded_at = 0.0
+        self.loads = 0
+        self.applied = 0
+
+    def load(self) -> None:
+        """Перечитывает списки путаницы одним запросом и подменяет индекс."""
+        rank = func.row_number().over(
+            partition_by=MetricWordsValue.word1_id,
+            order_by=(MetricWordsValue.value.desc(), MetricWordsValue.word2_id),
+        ).label('rank')
+        ranked = (
+            select(MetricWordsValue.word1_id, MetricWordsValue.word2_id, MetricWordsValue.value, rank)
+            .where(MetricWordsValue.value > 0)
+            .subquery()
+        )
+        query = (
+            select(ranked.c.word1_id, ranked.c.word2_id, ranked.c.value)
+            .where(ranked.c.rank <= self.top_k)
+            .order_by(ranked.c.word1_id, ranked.c.rank)
+        )
+        with self._lock:
+            # Сбрасываем флаг до чтения: изменение во время загрузки вызовет ещё одну
+            self._dirty = False
+            with SessionLocal() as session:
+                self._snapshot = _Snapshot(session.execute(query))
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+
+    def invalidate(self) -> None:
+        """Помечает индекс устаревшим: он будет перечитан при следующем обращении."""
+        self._dirty = True
+
+    def is_stale(self) -> bool:
+        if self._dirty or self._snapshot is None:
+            return True
+        return self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age
+
+    def snapshot(self) -> _Snapshot:
+        if self.is_stale():
+            with self._lock:
+                if self.is_stale():
+                    self.load()
+        return self._snapshot
+
+    def apply(self, values: Dict[Tuple[int, int], float]) -> None:
+        """
+        Учитывает новые значения пар после записи приращений в базу.
+        Каждое затронутое слово пересчитывается за O(k).
+        """
+        with self._lock:
+            snap = self._snapshot
+            if snap is None or self._dirty:
+                # Индекс всё равно будет перечитан целиком
+                return
+            for (word1_id, word2_id), value in values.items():
+                entries = [entry for entry in snap.entries(word1_id) if entry[1] != word2_id]
+                if value > 0:
+                    # Список отсортирован по убыванию value: вставляем по ключу (-value, id)
+                    keys = [(-entry_value, entry_id) for entry_value, entry_id in entries]
+                    entries.insert(bisect.bisect_left(keys, (-value, word2_id)), (value, word2_id))
+                snap.updated[word1_id] = entries[:self.top_k]
+            self.applied += len(values)
+
+    def confusable(self, word_id: int) -> Tuple[int, ...]:
+        """Слова, с которыми путают слово, от самого частого к редкому."""
+        return self.snapshot().top(word_id)
+
+    def hard_distractors(self, word_id: int, count: int = HARD_DISTRACTORS,
+                         exclude: Iterable[int] = ()) -> List[int]:
+        """До ``count`` случайных слов из списка путаницы слова, кроме ``exclude``."""
+        if count <= 0:
+            return []
+        excluded = set(exclude)
+        candidates = [other_id for other_id in self.confusable(word_id) if other_id not in excluded]
+        return random.sample(candidates, min(count, len(candidates)))
+
+    def stats(self) -> Dict[str, int]:
+        """Размер индекса для метрик и отладки."""
+        snap = self._snapshot
+        if snap is None:
+            return {'words': 0, 'pairs': 0, 'updated_words': 0, 'loads': self.loads, 'applied': self.applied}
+        return {
+            'words': len(snap.row_of),
+            'pairs': len(snap.ids),
+            'updated_words': len(snap.updated),
+            'loads': self.loads,
+            'applied': self.applied,
+        }
+
+
+confusion_index = ConfusionIndex(max_age=float(os.getenv('CONFUSION_INDEX_MAX_AGE', 600)))
+
+
+def _invalidate_confusion_index(mapper, connection, target):
+    confusion_index.invalidate()
+
+
+# Изменения метрик через ORM (а не через буфер) сбрасывают индекс
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(MetricWordsValue, _event_name, _invalidate_confusion_index)
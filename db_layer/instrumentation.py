@@ -0,0 +1,181 @@
+"""
+Учёт и замер SQL-запросов.
+
+Обработчики событий движка замеряют каждый запрос и относят его к
+вызвавшей функции (первый кадр стека из модулей проекта, например
+``repository.get_page_info``) и к текущему обновлению. По функциям
+копятся число запросов, суммарное и максимальное время.
+
+Запросы дольше ``SQL_SLOW_MS`` миллисекунд пишутся в лог вместе
+с параметрами и планом выполнения. При ``SQL_DEBUG=1`` отслеживаются
+N+1: один и тот же запрос из одной функции, повторённый в рамках
+обновления ``SQL_N_PLUS_ONE`` раз и более (как двойной
+``session.query(Word).get`` в ``get_random_relation_pair``).
+
+Контекст обновления открывает middleware метрик; в скриптах и бенчмарках
+его можно открыть вручную через ``track_queries()``. Контекст передаётся
+в потоки репозитория через ``run_in_db_thread``.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from sqlalchemy import event
+
+from db_layer.models import engine
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_MS', 100))
+DEBUG = os.getenv('SQL_DEBUG', '0') == '1'
+N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE', 2))
+
+# Модули, кадры которых считаются источником запроса
+_TRACKED_MODULES = ('db_layer.', 'lessons.', 'learning_modules.', 'bot_core.', 'benchmarks.')
+_SKIPPED_MODULES = ('db_layer.instrumentation', 'db_layer.models')
+
+
+class UpdateContext:
+    """Сведения об обрабатываемом обновлении."""
+    __slots__ = ('update_id', 'queries', 'query_time', 'statements', 'flagged')
+
+    def __init__(self, update_id: Optional[int] = None):
+        self.update_id = update_id
+        self.queries = 0
+        self.query_time = 0.0
+        # Заполняются только в режиме отладки
+        self.statements: Counter = Counter()
+        self.flagged: Set[Tuple[str, str]] = set()
+
+
+current_update: ContextVar[Optional[UpdateContext]] = ContextVar('current_update', default=None)
+
+
+class FunctionStats:
+    """Статистика запросов одной функции."""
+    __slots__ = ('count', 'total', 'max', 'slow')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+
+
+_stats: Dict[str, FunctionStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _caller() -> str:
+    """Имя первой функции проекта в стеке вызовов: ``модуль.функция``."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith(_TRACKED_MODULES) and not module.startswith(_SKIPPED_MODULES):
+            return f"{module.rsplit('.', 1)[-1]}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return 'other'
+
+
+def _explain(conn, cursor, statement: str, parameters) -> str:
+    """План выполнения запроса на том же соединении."""
+    prefix = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}.get(conn.dialect.name)
+    if prefix is None:
+        return ''
+    try:
+        plan_cursor = cursor.connection.cursor()
+        try:
+            plan_cursor.execute(prefix + statement, parameters)
+            rows = plan_cursor.fetchall()
+        finally:
+            plan_cursor.close()
+    except Exception as e:
+        return f"(план недоступен: {e})"
+    return '\n'.join(' '.join(str(col) for col in row) for row in rows)
+
+
+@event.listens_for(engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    context._verdict_started = time.perf_counter()
+    context._verdict_caller = _caller()
+
+
+@event.listens_for(engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_verdict_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    caller = context._verdict_caller
+    update = current_update.get()
+    is_slow = elapsed * 1000 >= SLOW_QUERY_MS
+
+    with _stats_lock:
+        stats = _stats.get(caller)
+        if stats is None:
+            stats = _stats[caller] = FunctionStats()
+        stats.count += 1
+        stats.total += elapsed
+        stats.max = max(stats.max, elapsed)
+        if is_slow:
+            stats.slow += 1
+
+    update_id = update.update_id if update is not None else None
+    if update is not None:
+        update.queries += 1
+        update.query_time += elapsed
+
+    if is_slow:
+        plan = '' if executemany else _explain(conn, cursor, statement, parameters)
+        logger.warning(
+            f"Медленный запрос {elapsed * 1000:.1f} мс в {caller} (обновление {update_id}):\n"
+            f"{statement}\nПараметры: {parameters!r}" + (f"\nПлан:\n{plan}" if plan else "")
+        )
+
+    if DEBUG and update is not None:
+        key = (caller, statement)
+        update.statements[key] += 1
+        if update.statements[key] >= N_PLUS_ONE_THRESHOLD and key not in update.flagged:
+            update.flagged.add(key)
+            logger.warning(
+                f"Возможный N+1 в {caller} (обновление {update_id}): запрос повторён "
+                f"{update.statements[key]} раз:\n{statement}"
+            )
+
+
+@contextmanager
+def track_queries(update_id: Optional[int] = None) -> Iterator[UpdateContext]:
+    """Открывает контекст учёта запросов вне обработки обновления (скрипты, бенчмарки)."""
+    update = UpdateContext(update_id)
+    token = current_update.set(update)
+    try:
+        yield update
+    finally:
+        current_update.reset(token)
+
+
+def query_stats() -> Dict[str, Dict[str, float]]:
+    """Статистика запросов по функциям: число, суммарное, среднее и максимальное время (мс)."""
+    with _stats_lock:
+        return {
+            name: {
+                'count': stats.count,
+                'total_ms': stats.total * 1000,
+                'avg_ms': stats.total * 1000 / stats.count if stats.count else 0.0,
+                'max_ms': stats.max * 1000,
+                'slow': stats.slow,
+            }
+            for name, stats in _stats.items()
+        }
+
+
+def reset_query_stats() -> None:
+    """Сбрасывает накопленную статистику по функциям."""
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,154 @@
+"""
+Буфер отложенной записи метрик путаницы слов.
+
+Неправильный ответ больше не пишет в ``metric_word_value`` сразу: приращения
+по парам (word1_id, word2_id) накапливаются в памяти и сбрасываются в базу
+одной транзакцией с INSERT ... ON CONFLICT DO UPDATE. Сброс выполняется
+по таймеру, при достижении размера буфера и при остановке бота.
+Новые значения записанных пар сразу попадают в индекс путаницы
+(``db_layer.confusion_index``). Пачка, которая не записалась несколько раз
+подряд, пишется по частям, а непишущиеся пары отбрасываются
+(``db_layer.batch_write``).
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from db_layer.async_repository import run_in_db_thread
+from db_layer.batch_write import FLUSH_MAX_RETRIES, write_isolating
+from db_layer.confusion_index import confusion_index
+from db_layer.repository import upsert_metric_values
+
+logger = logging.getLogger(__name__)
+
+
+class MetricWriteBuffer:
+    """
+    Накопитель приращений метрик с периодическим пакетным сбросом.
+
+    Параметры:
+    ----------
+    max_pending : int
+        Количество различных пар, после которого сброс запускается досрочно.
+    flush_interval : float
+        Максимальное время (в секундах) между сбросами.
+    max_retries : int
+        После скольких неудачных сбросов подряд пачка пишется по частям.
+    """
+
+    def __init__(self, max_pending: int = 500, flush_interval: float = 5.0, max_retries: int = 3):
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._failed_in_row = 0
+        self._pending: Dict[Tuple[int, int], float] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+
+    def add(self, word1_id: int, word2_id: int, increment_value: float = 0.05) -> None:
+        """Добавляет приращение для пары слов. Не обращается к базе данных."""
+        key = (word1_id, word2_id)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0.0) + increment_value
+            size = len(self._pending)
+        if size >= self.max_pending:
+            self._request_flush()
+
+    def _request_flush(self) -> None:
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        else:
+            # Фоновая задача не запущена (скрипты, отладка): пишем сразу
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Записывает накопленные приращения одной транзакцией.
+        При ошибке приращения возвращаются в буфер; после ``max_retries``
+        неудач подряд пачка пишется по частям, а непишущиеся пары отбрасываются.
+
+        Возвращает количество записанных пар.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                values = upsert_metric_values(batch)
+            except Exception:
+                self.failed_flushes += 1
+                self._failed_in_row += 1
+                if self._failed_in_row < self.max_retries:
+                    with self._lock:
+                        for key, value in batch.items():
+                            self._pending[key] = self._pending.get(key, 0.0) + value
+                    raise
+                parts, dropped = write_isolating(upsert_metric_values, batch)
+                self.dropped_rows += len(dropped)
+                values = {key: value for part in parts for key, value in part.items()}
+            self._failed_in_row = 0
+            confusion_index.apply(values)
+            written = len(values)
+            self.flushes += 1
+            self.flushed_rows += written
+        return written
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await run_in_db_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Ошибка при сбросе метрик: {e}", exc_info=True)
+
+    def start(self) -> None:
+        """Запускает фоновый сброс в текущем цикле событий."""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и записывает остаток буфера."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
+        self._wakeup = None
+        await run_in_db_thread(self.flush)
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики буфера для метрик и отладки."""
+        return {
+            'pending': len(self._pending),
+            'flushed_rows': self.flushed_rows,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'dropped_rows': self.dropped_rows,
+        }
+
+
+metric_buffer = MetricWriteBuffer(
+    max_pending=int(os.getenv('METRIC_FLUSH_SIZE', 500)),
+    flush_interval=float(os.getenv('METRIC_FLUSH_INTERVAL', 5.0)),
+    max_retries=FLUSH_MAX_RETRIES,
+)
@@ -0,0 +1,263 @@
+"""
+Затухание и очистка метрик путаницы.
+
+Старые ошибки постепенно перестают влиять на трудные варианты: значения
+в ``metric_word_value`` и ``metric_sentence_value`` умножаются на
+``0.5 ** (прошло / период полураспада)``, приводятся к диапазону
+[``METRIC_VALUE_MIN``, ``METRIC_VALUE_MAX``], а записи, опустившиеся ниже
+``METRIC_PRUNE_BELOW``, удаляются.
+
+Таблица читается порциями по id (``METRIC_DECAY_CHUNK`` строк) в массивы
+NumPy, новые значения считаются одной векторной операцией, а изменения
+записываются пачками executemany в одной транзакции. В базу пишется
+разница ``value = value + delta``, а удаление проверяет прочитанное
+значение, поэтому приращения, записанные ботом во время расчёта,
+не теряются. Время последнего затухания каждой таблицы хранится
+в ``metric_decay_state``.
+
+Задача выполняется в отдельном процессе, чтобы расчёт не занимал
+цикл событий и GIL процесса бота. Бот запускает её раз в
+``METRIC_DECAY_INTERVAL`` секунд (0 — не запускать); вручную или из cron::
+
+    python -m db_layer.metric_decay --half-life 30
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select, text
+
+from db_layer.models import MetricDecayState, MetricSentencesValue, MetricWordsValue, engine
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+METRIC_TABLES = {
+    'word': MetricWordsValue.__table__,
+    'sentence': MetricSentencesValue.__table__,
+}
+
+DAY = 86400.0
+HALF_LIFE_DAYS = float(os.getenv('METRIC_HALF_LIFE_DAYS', 30))
+# Диапазон значений метрики, как в update_metric_value
+VALUE_MIN = float(os.getenv('METRIC_VALUE_MIN', 0.01))
+VALUE_MAX = float(os.getenv('METRIC_VALUE_MAX', 0.99))
+PRUNE_BELOW = float(os.getenv('METRIC_PRUNE_BELOW', VALUE_MIN))
+CHUNK_SIZE = int(os.getenv('METRIC_DECAY_CHUNK', 50_000))
+
+
+class DecayReport(NamedTuple):
+    table: str
+    rows: int           # Прочитано строк
+    updated: int        # Изменено значений
+    pruned: int         # Удалено строк
+    factor: float       # Множитель затухания
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+def _read_values(conn, table, chunk_size: int):
+    """Все (id, value) таблицы порциями по id; возвращает два массива NumPy."""
+    import numpy as np
+
+    id_chunks, value_chunks = [], []
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(table.c.id, table.c.value)
+            .where(table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        id_chunks.append(np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)))
+        value_chunks.append(np.fromiter((row[1] or 0.0 for row in rows), dtype=np.float64, count=len(rows)))
+        last_id = int(id_chunks[-1][-1])
+    if not id_chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    return np.concatenate(id_chunks), np.concatenate(value_chunks)
+
+
+def _executemany(conn, statement, columns: Dict[str, "np.ndarray"], chunk_size: int) -> None:
+    """Выполняет запрос для всех строк массивов пачками по chunk_size параметров."""
+    names = list(columns)
+    size = len(columns[names[0]])
+    for start in range(0, size, chunk_size):
+        # tolist() переводит значения NumPy в обычные int и float для драйвера
+        batch = zip(*(columns[name][start:start + chunk_size].tolist() for name in names))
+        conn.execute(statement, [dict(zip(names, row)) for row in batch])
+
+
+def decay_table(name: str, now: Optional[float] = None, half_life_days: float = HALF_LIFE_DAYS,
+                value_min: float = VALUE_MIN, value_max: float = VALUE_MAX,
+                prune_below: float = PRUNE_BELOW, chunk_size: int = CHUNK_SIZE) -> DecayReport:
+    """
+    Затухание, ограничение и очистка одной таблицы метрик ('word' или 'sentence').
+    Множитель считается по времени, прошедшему с прошлого затухания этой таблицы;
+    при первом запуске значения только ограничиваются и очищаются.
+    """
+    import numpy as np
+
+    table = METRIC_TABLES[name]
+    now = time.time() if now is None else now
+    started = time.perf_counter()
+
+    with engine.connect() as conn:
+        last = conn.execute(
+            select(MetricDecayState.decayed_at).where(MetricDecayState.table_name == table.name)
+        ).scalar()
+        ids, values = _read_values(conn, table, chunk_size)
+        conn.rollback()
+
+    elapsed = max(now - last, 0.0) if last is not None else 0.0
+    factor = 0.5 ** (elapsed / (half_life_days * DAY)) if half_life_days > 0 else 1.0
+
+    decayed = values * factor
+    prune = decayed < prune_below
+    new_values = np.clip(decayed, value_min, value_max)
+    changed = ~prune & (new_values != values)
+
+    with engine.begin() as conn:
+        if changed.any():
+            _executemany(
+                conn,
+                text(f"UPDATE {table.name} SET value = value + :delta WHERE id = :row_id"),
+                {'delta': (new_values - values)[changed], 'row_id': ids[changed]},
+                chunk_size,
+            )
+        if prune.any():
+            # Строку, которую бот успел увеличить после чтения, не удаляем
+            _executemany(
+                conn,
+                text(f"DELETE FROM {table.name} WHERE id = :row_id AND value = :old_value"),
+                {'row_id': ids[prune], 'old_value': values[prune]},
+                chunk_size,
+            )
+        updated = conn.execute(
+            MetricDecayState.__table__.update()
+            .where(MetricDecayState.table_name == table.name)
+            .values(decayed_at=now)
+        ).rowcount
+        if not updated:
+            conn.execute(MetricDecayState.__table__.insert().values(table_name=table.name, decayed_at=now))
+
+    return DecayReport(name, len(ids), int(changed.sum()), int(prune.sum()), factor,
+                       time.perf_counter() - started)
+
+
+def decay_metrics(tables: Tuple[str, ...] = tuple(METRIC_TABLES), **options) -> List[DecayReport]:
+    """Затухание всех таблиц метрик; параметры как у ``decay_table``."""
+    return [decay_table(name, **options) for name in tables]
+
+
+class MetricDecayJob:
+    """
+    Периодический запуск затухания в отдельном процессе.
+
+    Параметры:
+    ----------
+    interval : float
+        Период запуска в секундах; 0 — задача не запускается.
+    """
+
+    def __init__(self, interval: float = 0.0):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.failures = 0
+        self.last_rows = 0
+        self.last_seconds = 0.0
+        self.last_rows_per_sec = 0.0
+
+    async def run_once(self) -> List[dict]:
+        """Запускает ``python -m db_layer.metric_decay --json`` и возвращает отчёты по таблицам."""
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'db_layer.metric_decay', '--json',
+            stdout=asyncio.subprocess.PIPE,
+        )
+        stdout, _ = await process.communicate()
+        if process.returncode != 0:
+            self.failures += 1
+            raise RuntimeError(f"Затухание метрик завершилось с кодом {process.returncode}")
+        reports = json.loads(stdout.decode('utf-8').strip().splitlines()[-1])
+        self.runs += 1
+        self.last_rows = sum(report['rows'] for report in reports)
+        self.last_seconds = sum(report['seconds'] for report in reports)
+        self.last_rows_per_sec = self.last_rows / self.last_seconds if self.last_seconds > 0 else 0.0
+        # Значения метрик изменились: индекс путаницы перечитывается
+        from db_layer.confusion_index import confusion_index
+        confusion_index.invalidate()
+        return reports
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                for report in await self.run_once():
+                    logger.info(f"Затухание метрик {report['table']}: {report['rows']} строк, "
+                                f"изменено {report['updated']}, удалено {report['pruned']}, "
+                                f"{report['rows_per_sec']:.0f} строк/с")
+            except Exception as e:
+                logger.error(f"Ошибка при затухании метрик: {e}", exc_info=True)
+
+    def start(self) -> None:
+        """Запускает периодическую задачу в текущем цикле событий (если интервал задан)."""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_rows': self.last_rows,
+            'last_seconds': self.last_seconds,
+            'last_rows_per_sec': self.last_rows_per_sec,
+        }
+
+
+metric_decay_job = MetricDecayJob(interval=float(os.getenv('METRIC_DECAY_INTERVAL', 0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Затухание и очистка метрик путаницы")
+    parser.add_argument("--tables", default=",".join(METRIC_TABLES), help="таблицы через запятую: word,sentence")
+    parser.add_argument("--half-life", type=float, default=HALF_LIFE_DAYS, help="период полураспада в днях")
+    parser.add_argument("--prune-below", type=float, default=PRUNE_BELOW, help="удалять значения ниже порога")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="строк в порции чтения и записи")
+    parser.add_argument("--json", action="store_true", help="вывести отчёт одной строкой JSON")
+    args = parser.parse_args()
+
+    from db_layer.migrations import run_migrations
+    run_migrations()
+    reports = decay_metrics(tuple(args.tables.split(",")), half_life_days=args.half_life,
+                            prune_below=args.prune_below, chunk_size=args.chunk)
+    if args.json:
+        print(json.dumps([dict(report._asdict(), rows_per_sec=report.rows_per_sec) for report in reports]))
+        return
+    for report in reports:
+        print(f"{report.table}: {report.rows} строк, множитель {report.factor:.4f}, изменено {report.updated}, "
+              f"удалено {report.pruned}, {report.seconds:.2f} с ({report.rows_per_sec:.0f} строк/с)")
+
+
+if __name__ == '__main__':
+    main()
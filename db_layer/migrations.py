@@ -0,0 +1,190 @@
+"""
+Миграции схемы базы данных.
+
+Номер применённой миграции хранится в ``PRAGMA user_version`` для SQLite
+и в таблице ``schema_version`` для остальных СУБД. Новая пустая
+база создаётся сразу по моделям и помечается последней версией, а для
+существующей базы по порядку применяются недостающие миграции.
+Миграции написаны на SQL и не зависят от текущего состояния моделей
+(кроме заполнения форм слов, которое использует нормализатор на Python).
+"""
+import logging
+
+from sqlalchemy import inspect
+
+from db_layer.models import Base, engine
+
+logger = logging.getLogger(__name__)
+
+
+def _has_table(conn, name: str) -> bool:
+    return inspect(conn).has_table(name)
+
+
+def _id_column(conn) -> str:
+    """Автоинкрементный первичный ключ пересоздаваемой таблицы."""
+    if conn.dialect.name == "sqlite":
+        return "id INTEGER NOT NULL PRIMARY KEY"
+    return "id SERIAL PRIMARY KEY"
+
+
+def _reset_id_sequence(conn, table: str) -> None:
+    """После копирования строк с явными id сдвигает последовательность (PostgreSQL)."""
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table}"
+        )
+
+
+def _migration_1(conn):
+    """
+    metric_word_value и metric_sentence_value: дробное поле value,
+    уникальная пара (word1_id, word2_id). Дубликаты пар суммируются.
+    """
+    _rebuild_metric_word_value(conn)
+    _rebuild_metric_sentence_value(conn)
+
+
+def _rebuild_metric_word_value(conn):
+    if not _has_table(conn, "metric_word_value"):
+        return
+    conn.exec_driver_sql("ALTER TABLE metric_word_value RENAME TO metric_word_value_old")
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_metric_word_value_id")
+    conn.exec_driver_sql(
+        f"CREATE TABLE metric_word_value ({_id_column(conn)},"
+        " word1_id INTEGER NOT NULL REFERENCES words (id),"
+        " word2_id INTEGER NOT NULL REFERENCES words (id),"
+        " value FLOAT)"
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO metric_word_value (id, word1_id, word2_id, value) "
+        "SELECT MIN(id), word1_id, word2_id, SUM(value) FROM metric_word_value_old "
+        "GROUP BY word1_id, word2_id"
+    )
+    conn.exec_driver_sql("DROP TABLE metric_word_value_old")
+    _reset_id_sequence(conn, "metric_word_value")
+    conn.exec_driver_sql("CREATE INDEX ix_metric_word_value_id ON metric_word_value (id)")
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX uq_metric_word_pair ON metric_word_value (word1_id, word2_id)"
+    )
+
+
+def _rebuild_metric_sentence_value(conn):
+    if not _has_table(conn, "metric_sentence_value"):
+        return
+    conn.exec_driver_sql("ALTER TABLE metric_sentence_value RENAME TO metric_sentence_value_old")
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_metric_sentence_value_id")
+    conn.exec_driver_sql(
+        f"CREATE TABLE metric_sentence_value ({_id_column(conn)},"
+        " sentence1_id INTEGER NOT NULL REFERENCES sentences (id),"
+        " sentence2_id INTEGER NOT NULL REFERENCES sentences (id),"
+        " value FLOAT)"
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO metric_sentence_value (id, sentence1_id, sentence2_id, value) "
+        "SELECT id, sentence1_id, sentence2_id, value FROM metric_sentence_value_old"
+    )
+    conn.exec_driver_sql("DROP TABLE metric_sentence_value_old")
+    _reset_id_sequence(conn, "metric_sentence_value")
+    conn.exec_driver_sql("CREATE INDEX ix_metric_sentence_value_id ON metric_sentence_value (id)")
+
+
+# Индексы под фильтры репозитория: (имя, таблица, столбцы)
+HOT_INDEXES = [
+    ("ix_pages_lesson_page", "pages", "num_lesson, num_page"),
+    ("ix_words_num_lesson", "words", "num_lesson"),
+    ("ix_words_english_word", "words", "english_word"),
+    ("ix_words_russian_word", "words", "russian_word"),
+    ("ix_sentences_num_lesson", "sentences", "num_lesson"),
+    ("ix_relations_source_type", "relations", "source_word_id, relation_type"),
+    ("ix_metric_word_value_word2", "metric_word_value", "word2_id"),
+]
+
+
+def _migration_2(conn):
+    """
+    Индексы для всех частых выборок репозитория.
+    """
+    for name, table, columns in HOT_INDEXES:
+        if _has_table(conn, table):
+            conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _migration_3(conn):
+    """
+    Нормализованные формы слов: столбцы words.english_norm/russian_norm
+    и обратный индекс word_forms, включая альтернативные переводы.
+    """
+    if not _has_table(conn, "words"):
+        return
+    columns = {column["name"] for column in inspect(conn).get_columns("words")}
+    for column in ("english_norm", "russian_norm"):
+        if column not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE words ADD COLUMN {column} VARCHAR")
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS word_forms ("
+        " form VARCHAR NOT NULL,"
+        " lang VARCHAR NOT NULL,"
+        " word_id INTEGER NOT NULL REFERENCES words (id),"
+        " PRIMARY KEY (form, lang, word_id))"
+    )
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_word_forms_word ON word_forms (word_id)")
+    # Нормализация написана на Python, поэтому формы заполняются не SQL-запросом
+    from db_layer.word_index import index_missing_words
+    index_missing_words(conn)
+
+
+# (номер, функция) в порядке применения
+MIGRATIONS = [
+    (1, _migration_1),
+    (2, _migration_2),
+    (3, _migration_3),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _get_version(conn) -> int:
+    """Номер применённой миграции; 0 — миграции не применялись."""
+    if conn.dialect.name == "sqlite":
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+    conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    return conn.exec_driver_sql("SELECT MAX(version) FROM schema_version").scalar() or 0
+
+
+def _set_version(conn, version: int) -> None:
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+        return
+    conn.exec_driver_sql("DELETE FROM schema_version")
+    conn.exec_driver_sql(f"INSERT INTO schema_version (version) VALUES ({int(version)})")
+
+
+def run_migrations(bind=engine) -> int:
+    """
+    Приводит схему базы данных к последней версии.
+
+    Возвращает номер версии схемы после применения миграций.
+    """
+    with bind.begin() as conn:
+        # Таблица schema_version не считается: новая база — без таблиц моделей
+        is_new = not set(inspect(conn).get_table_names()) & set(Base.metadata.tables)
+        version = _get_version(conn)
+        if is_new:
+            Base.metadata.create_all(conn)
+            _set_version(conn, LATEST_VERSION)
+            logger.info(f"Создана новая база данных, версия схемы {LATEST_VERSION}")
+            return LATEST_VERSION
+
+        for number, migration in MIGRATIONS:
+            if number <= version:
+                continue
+            logger.info(f"Применяется миграция {number}: {migration.__doc__.strip().splitlines()[0]}")
+            migration(conn)
+            _set_version(conn, number)
+            version = number
+
+        # Таблицы, которых ещё нет в базе, создаются по моделям
+        Base.metadata.create_all(conn)
+    return version
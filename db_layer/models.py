@@ -1,12 +1,13 @@
+import os
 from typing import Text
-from sqlalchemy import Column, Integer, String, ForeignKey, ForeignKey, JSON
+from sqlalchemy import BigInteger, Boolean, Column, Integer, Float, String, ForeignKey, ForeignKey, JSON, Index
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 from sqlalchemy import create_engine
 
 # Создаем объект базы данных
-engine = create_engine('sqlite:///local_database.db', echo=False)
+engine = create_engine(os.getenv('DATABASE_URL', 'sqlite:///local_database.db'), echo=False)
 
 # Создаем декларационную базу данных
 Base = declarative_base()
@@ -22,7 +23,24 @@ class Pages(Base):
     num_page = Column(Integer, nullable=False)
     num_message = Column(Integer, nullable=False)
     name_page = Column(String)
-    
+
+    __table_args__ = (
+        Index('ix_pages_lesson_page', 'num_lesson', 'num_page'),
+    )
+
+# Снимок поста канала, из которого показывается страница урока
+class PageContent(Base):
+    __tablename__ = 'page_contents'
+    page_id = Column(Integer, ForeignKey('pages.id'), primary_key=True)
+    source_chat = Column(String, nullable=False)        # Канал, из которого снят пост
+    source_message_id = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)               # text, photo, video, animation, document, audio, voice
+    text = Column(String)                               # Текст поста или подпись к медиа
+    entities = Column(JSON)                             # Разметка текста (MessageEntity)
+    file_id = Column(String)                            # file_id медиа для повторной отправки
+    etag = Column(String, nullable=False)               # Хеш содержимого: по нему видно, что пост изменился
+    fetched_at = Column(Float, nullable=False)          # Время последней сверки с каналом
+
 class Sentence(Base):
     __tablename__ = 'sentences'
     id = Column(Integer, primary_key=True)
@@ -30,6 +48,10 @@ class Sentence(Base):
     translation_en = Column(String, nullable=False)
     num_lesson = Column(Integer)
 
+    __table_args__ = (
+        Index('ix_sentences_num_lesson', 'num_lesson'),
+    )
+
 
 class Trainer(Base):
     __tablename__ = 'trainers'
@@ -45,6 +67,27 @@ class Word(Base):
     russian_word = Column(String, nullable=False)
     alter_russian_word = Column(JSON)
     num_lesson = Column(Integer)
+    # Нормализованные english_word и russian_word (db_layer.normalizer); NULL — слово ещё не проиндексировано
+    english_norm = Column(String)
+    russian_norm = Column(String)
+
+    __table_args__ = (
+        Index('ix_words_num_lesson', 'num_lesson'),
+        Index('ix_words_english_word', 'english_word'),
+        Index('ix_words_russian_word', 'russian_word'),
+    )
+
+
+# Обратный индекс: нормализованная форма (слово, перевод или альтернативный перевод) → слово
+class WordForm(Base):
+    __tablename__ = 'word_forms'
+    form = Column(String, primary_key=True)
+    lang = Column(String, primary_key=True)             # en или ru
+    word_id = Column(Integer, ForeignKey('words.id'), primary_key=True)
+
+    __table_args__ = (
+        Index('ix_word_forms_word', 'word_id'),
+    )
     
     
 class Relation(Base):
@@ -55,6 +98,10 @@ class Relation(Base):
     target_word_id = Column(Integer, ForeignKey('words.id'))
     relation_type = Column(String, nullable=False)
 
+    __table_args__ = (
+        Index('ix_relations_source_type', 'source_word_id', 'relation_type'),
+    )
+
 class Metric(Base):
     __tablename__ = 'metrics'
     id = Column(Integer, primary_key=True, index=True)
@@ -66,11 +113,80 @@ class MetricWordsValue(Base):
     id = Column(Integer, primary_key=True, index=True)
     word1_id = Column(Integer, ForeignKey('words.id'), nullable=False)
     word2_id = Column(Integer, ForeignKey('words.id'), nullable=False)
-    value = Column(Integer, default=0.0)
+    value = Column(Float, default=0.0)
+
+    __table_args__ = (
+        # Одна запись на пару слов: нужна для INSERT ... ON CONFLICT DO UPDATE
+        Index('uq_metric_word_pair', 'word1_id', 'word2_id', unique=True),
+        # Вторая половина OR-запроса в search_records_by_word
+        Index('ix_metric_word_value_word2', 'word2_id'),
+    )
 
 class MetricSentencesValue(Base):
     __tablename__ = 'metric_sentence_value'
     id = Column(Integer, primary_key=True, index=True)
     sentence1_id = Column(Integer, ForeignKey('sentences.id'), nullable=False)
     sentence2_id = Column(Integer, ForeignKey('sentences.id'), nullable=False)
-    value = Column(Integer, default=0.0)
+    value = Column(Float, default=0.0)
+
+
+# Время последнего затухания таблицы метрик (db_layer.metric_decay)
+class MetricDecayState(Base):
+    __tablename__ = 'metric_decay_state'
+    table_name = Column(String, primary_key=True)
+    decayed_at = Column(Float, nullable=False)
+
+
+# Карточка интервального повторения: прогресс пользователя по одному слову
+class ReviewCard(Base):
+    __tablename__ = 'review_cards'
+    user_id = Column(BigInteger, primary_key=True)      # Telegram id пользователя
+    word_id = Column(Integer, ForeignKey('words.id'), primary_key=True)
+    interval = Column(Float, nullable=False)            # Текущий интервал повторения в днях
+    ease = Column(Float, nullable=False)                # Коэффициент лёгкости SM-2
+    repetitions = Column(Integer, nullable=False)       # Правильных ответов подряд
+    lapses = Column(Integer, nullable=False)            # Сколько раз слово было забыто
+    due = Column(Float, nullable=False)                 # Время следующего повторения (unix time)
+
+
+# Пользователь бота и его итоги, которые обновляются при записи ответов
+class User(Base):
+    __tablename__ = 'users'
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(BigInteger, nullable=False)
+    username = Column(String)
+    first_name = Column(String)
+    last_name = Column(String)
+    created_at = Column(Float, nullable=False)
+    answers = Column(Integer, nullable=False, default=0)            # Всего ответов
+    correct_answers = Column(Integer, nullable=False, default=0)
+    streak = Column(Integer, nullable=False, default=0)             # Правильных ответов подряд сейчас
+    best_streak = Column(Integer, nullable=False, default=0)
+    words_seen = Column(Integer, nullable=False, default=0)         # Различных слов в заданиях
+    last_answer_at = Column(Float)
+
+    __table_args__ = (
+        Index('uq_users_telegram_id', 'telegram_id', unique=True),
+    )
+
+
+# Журнал ответов: строки только добавляются
+class AnswerEvent(Base):
+    __tablename__ = 'answer_events'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)        # Telegram id пользователя
+    game = Column(String, nullable=False)               # words, synonyms, grammar
+    item_id = Column(Integer)                           # Слово или предложение задания
+    is_correct = Column(Boolean, nullable=False)
+    created_at = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index('ix_answer_events_user', 'user_id', 'id'),
+    )
+
+
+# Слова, которые пользователь уже встречал в заданиях (для счётчика words_seen)
+class UserWord(Base):
+    __tablename__ = 'user_words'
+    user_id = Column(BigInteger, primary_key=True)      # Telegram id пользователя
+    word_id = Column(Integer, primary_key=True)
@@ -0,0 +1,61 @@
+"""
+Нормализация текста ответов и слов.
+
+Одна функция для всех игр и для индекса форм слов: знаки препинания
+удаляются, буквы приводятся к нижнему регистру, ``ё`` заменяется на ``е``,
+любые пробельные символы схлопываются в один пробел. Преобразование
+выполняется одним ``str.translate`` по таблице: для латиницы и кириллицы
+она построена заранее, остальные символы классифицируются при первой
+встрече и запоминаются.
+"""
+from typing import Dict, Iterable, Optional, Set
+
+# Символы, которые заменяются особо (после приведения к нижнему регистру)
+_SPECIAL = {'ё': 'е'}
+
+
+def _translate(char: str) -> Optional[str]:
+    """Во что превращается символ: он сам в нижнем регистре, пробел или None (удаляется)."""
+    if char.isspace():
+        return ' '
+    if not char.isalnum():
+        return None
+    lower = char.lower()
+    return _SPECIAL.get(lower, lower)
+
+
+class _Table(dict):
+    """Таблица для str.translate, дополняемая при встрече нового символа."""
+
+    def __missing__(self, code: int) -> Optional[str]:
+        value = self[code] = _translate(chr(code))
+        return value
+
+
+# Латиница, кириллица и общая пунктуация — заранее
+_TABLE: Dict[int, Optional[str]] = _Table(
+    (code, _translate(chr(code))) for code in (*range(0x0000, 0x0530), *range(0x2000, 0x2070))
+)
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Нормализованная форма текста; для None — пустая строка."""
+    if not text:
+        return ''
+    return ' '.join(text.translate(_TABLE).split())
+
+
+def alternatives_of(value) -> Iterable[str]:
+    """Варианты перевода из JSON-поля alter_russian_word: строка или список строк."""
+    if isinstance(value, str):
+        return (value, )
+    if isinstance(value, (list, tuple)):
+        return tuple(item for item in value if isinstance(item, str))
+    return ()
+
+
+def word_forms(english_word: Optional[str], russian_word: Optional[str], alter_russian_word=None) -> Set[tuple]:
+    """Все нормализованные формы слова: пары (форма, язык 'en' или 'ru')."""
+    forms = {(normalize_text(english_word), 'en'), (normalize_text(russian_word), 'ru')}
+    forms.update((normalize_text(text), 'ru') for text in alternatives_of(alter_russian_word))
+    return {(form, lang) for form, lang in forms if form}
@@ -0,0 +1,214 @@
+"""
+Индекс связей между словами для игры в синонимы и антонимы.
+
+Таблица ``relations`` загружается целиком и превращается в массивы:
+плоский список валидных пар для выборки за O(1), смежность в формате CSR
+(indptr/indices) по каждому типу связи и общая неориентированная смежность,
+по которой из неправильных вариантов исключаются все связанные слова.
+Тексты слов, участвующих в связях, хранятся рядом, поэтому вопрос
+собирается без единого SQL-запроса. Индекс перечитывается при изменении
+слов или связей и по истечении ``RELATION_INDEX_MAX_AGE`` секунд.
+"""
+import os
+import random
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import event, select
+
+from db_layer.models import Relation, SessionLocal, Word
+from db_layer.normalizer import normalize_text
+
+
+class WordRef(NamedTuple):
+    """Лёгкая копия слова, не привязанная к сессии."""
+    id: int
+    english_word: str
+    russian_word: str
+
+
+def _build_csr(size: int, edges: Iterable[Tuple[int, int]]) -> Tuple[array, array]:
+    """Строит CSR (indptr, indices) по списку рёбер между номерами узлов."""
+    edges = sorted(set(edges))
+    indptr = array('l', [0]) * (size + 1)
+    for src, _ in edges:
+        indptr[src + 1] += 1
+    for idx in range(size):
+        indptr[idx + 1] += indptr[idx]
+    indices = array('l', (dst for _, dst in edges))
+    return indptr, indices
+
+
+class _Snapshot:
+    """Неизменяемое содержимое индекса; подменяется целиком при перезагрузке."""
+    __slots__ = ('words', 'node_ids', 'node_of', 'types', 'pair_src', 'pair_dst', 'pair_type',
+                 'adjacency', 'related')
+
+    def __init__(self, words: Dict[int, WordRef], relations: Sequence[Tuple[int, int, str]]):
+        self.words = words
+        self.node_ids = array('q', sorted(words))
+        self.node_of = {word_id: idx for idx, word_id in enumerate(self.node_ids)}
+        self.types: Tuple[str, ...] = tuple(sorted({rel_type for _, _, rel_type in relations}))
+        type_of = {rel_type: idx for idx, rel_type in enumerate(self.types)}
+
+        self.pair_src = array('q')
+        self.pair_dst = array('q')
+        self.pair_type = array('B')
+        typed_edges: Dict[str, List[Tuple[int, int]]] = {rel_type: [] for rel_type in self.types}
+        related_edges: List[Tuple[int, int]] = []
+        for source_id, target_id, rel_type in relations:
+            src, dst = self.node_of[source_id], self.node_of[target_id]
+            self.pair_src.append(source_id)
+            self.pair_dst.append(target_id)
+            self.pair_type.append(type_of[rel_type])
+            typed_edges[rel_type].append((src, dst))
+            related_edges.append((src, dst))
+            related_edges.append((dst, src))
+
+        size = len(self.node_ids)
+        self.adjacency = {rel_type: _build_csr(size, edges) for rel_type, edges in typed_edges.items()}
+        self.related = _build_csr(size, related_edges)
+
+
+def _neighbors(csr: Tuple[array, array], node: int) -> array:
+    indptr, indices = csr
+    return indices[indptr[node]:indptr[node + 1]]
+
+
+class RelationIndex:
+    """Индекс связей в памяти процесса."""
+
+    def __init__(self, max_age: Optional[float] = None):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._dirty = True
+        self._loaded_at = 0.0
+
+    def load(self) -> None:
+        """Перечитывает связи и слова двумя запросами и подменяет индекс."""
+        with SessionLocal() as session:
+            relations = session.execute(
+                select(Relation.source_word_id, Relation.target_word_id, Relation.relation_type)
+            ).all()
+            word_ids = {word_id for source_id, target_id, _ in relations for word_id in (source_id, target_id)}
+            words = {
+                row.id: WordRef(row.id, row.english_word, row.russian_word)
+                for row in session.execute(
+                    select(Word.id, Word.english_word, Word.russian_word).where(Word.id.in_(word_ids))
+                )
+            } if word_ids else {}
+
+        # Связи с удалёнными словами в индекс не попадают
+        valid = [
+            (source_id, target_id, rel_type) for source_id, target_id, rel_type in relations
+            if source_id in words and target_id in words
+        ]
+        self._snapshot = _Snapshot(words, valid)
+        self._loaded_at = time.monotonic()
+        self._dirty = False
+
+    def invalidate(self) -> None:
+        """Помечает индекс устаревшим: он будет перечитан при следующем обращении."""
+        self._dirty = True
+
+    def is_stale(self) -> bool:
+        if self._dirty or self._snapshot is None:
+            return True
+        return self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age
+
+    def snapshot(self) -> _Snapshot:
+        if self.is_stale():
+            with self._lock:
+                if self.is_stale():
+                    self.load()
+        return self._snapshot
+
+    def random_pair(self) -> Optional[Tuple[WordRef, str, WordRef]]:
+        """Случайная пара (исходное слово, тип связи, связанное слово) за O(1)."""
+        snap = self.snapshot()
+        if not snap.pair_src:
+            return None
+        idx = random.randrange(len(snap.pair_src))
+        return (
+            snap.words[snap.pair_src[idx]],
+            snap.types[snap.pair_type[idx]],
+            snap.words[snap.pair_dst[idx]],
+        )
+
+    def related_ids(self, word_id: int, relation_type: Optional[str] = None) -> List[int]:
+        """Id слов, связанных со словом: по типу связи или любыми связями в обе стороны."""
+        snap = self.snapshot()
+        node = snap.node_of.get(word_id)
+        if node is None:
+            return []
+        csr = snap.related if relation_type is None else snap.adjacency.get(relation_type)
+        if csr is None:
+            return []
+        return [snap.node_ids[idx] for idx in _neighbors(csr, node)]
+
+    def distractors(self, word_id: int, count: int, lang: str, exclude_texts: Iterable[str] = (),
+                    preferred: Iterable[int] = ()) -> List[WordRef]:
+        """
+        Случайные слова для неправильных вариантов.
+
+        Исключаются само слово, все связанные с ним слова и слова,
+        текст которых на языке ``lang`` совпадает с ``exclude_texts``
+        или с уже выбранными вариантами. Слова из ``preferred`` (трудные
+        варианты) берутся первыми, если они есть в индексе.
+        """
+        snap = self.snapshot()
+        size = len(snap.node_ids)
+        attr = lang + "_word"
+        excluded: Set[int] = {word_id}
+        node = snap.node_of.get(word_id)
+        if node is not None:
+            excluded.update(snap.node_ids[idx] for idx in _neighbors(snap.related, node))
+        used_texts = {normalize_text(text) for text in exclude_texts}
+
+        chosen: List[WordRef] = []
+
+        def take(candidate_id: int) -> None:
+            excluded.add(candidate_id)
+            word = snap.words[candidate_id]
+            text = getattr(word, attr)
+            key = normalize_text(text)
+            if key and key not in used_texts:
+                used_texts.add(key)
+                chosen.append(word)
+
+        for candidate_id in preferred:
+            if len(chosen) >= count:
+                break
+            if candidate_id not in excluded and candidate_id in snap.words:
+                take(candidate_id)
+
+        attempts = 4 * (count + len(excluded)) + 16
+        while len(chosen) < count and attempts > 0 and size:
+            attempts -= 1
+            candidate_id = snap.node_ids[random.randrange(size)]
+            if candidate_id not in excluded:
+                take(candidate_id)
+        return chosen
+
+    def stats(self) -> Dict[str, int]:
+        """Размер индекса для метрик и отладки."""
+        snap = self._snapshot
+        if snap is None:
+            return {'words': 0, 'pairs': 0, 'relation_types': 0}
+        return {'words': len(snap.node_ids), 'pairs': len(snap.pair_src), 'relation_types': len(snap.types)}
+
+
+relation_index = RelationIndex(max_age=float(os.getenv('RELATION_INDEX_MAX_AGE', 300)))
+
+
+def _invalidate_relation_index(mapper, connection, target):
+    relation_index.invalidate()
+
+
+# Изменение слов или связей в этом процессе сбрасывает индекс
+for _model in (Word, Relation):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _invalidate_relation_index)
@@ -1,8 +1,55 @@
 from asyncio.log import logger
 import logging
-from db_layer.models import MetricWordsValue, Pages, Sentence, SessionLocal, Word, Relation
-from sqlalchemy import select, func, update
-from typing import List, Optional
+from db_layer.models import (AnswerEvent, MetricWordsValue, PageContent, Pages, ReviewCard, Sentence, SessionLocal,
+                             User, UserWord, Word, WordForm, Relation, engine)
+from db_layer.confusion_index import HARD_DISTRACTORS, confusion_index
+from db_layer.normalizer import normalize_text
+from db_layer import word_index  # noqa: F401  (события маппера для индекса форм слов)
+from db_layer.word_pool import word_pool
+import random
+import time
+from collections import Counter
+from sqlalchemy import bindparam, select, func, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class WordQuestion(NamedTuple):
+    """Готовый вопрос для тренировки слов."""
+    word: Word                       # Загаданное слово
+    direction: str                   # "en->ru" или "ru->en"
+    options: List[Tuple[int, str]]   # Варианты ответа: (id слова, текст)
+    correct_index: int               # Позиция правильного варианта в options
+
+
+class AnswerRecord(NamedTuple):
+    """Ответ пользователя для журнала answer_events."""
+    user_id: int                     # Telegram id пользователя
+    game: str                        # words, synonyms, grammar
+    item_id: Optional[int]           # Слово или предложение задания
+    is_correct: bool
+    created_at: float
+
+
+# Игры, в которых item_id — id слова (учитываются в words_seen)
+WORD_GAMES = ('words', 'synonyms')
+
+
+def _get_words_by_ids(word_ids: List[int]) -> List[Word]:
+    """
+    Загружает слова по списку id одним запросом, сохраняя порядок списка.
+    Если часть слов не найдена, пул идентификаторов устарел и будет перечитан.
+    """
+    if not word_ids:
+        return []
+    with SessionLocal() as session:
+        words = session.execute(select(Word).where(Word.id.in_(word_ids))).scalars().all()
+    if len(words) < len(word_ids):
+        word_pool.invalidate()
+    words_by_id = {word.id: word for word in words}
+    return [words_by_id[word_id] for word_id in word_ids if word_id in words_by_id]
+
 
 def get_single_random_word_from_lesson(lesson_num: int) -> Optional[Word]:
     """
@@ -17,16 +64,70 @@ def get_single_random_word_from_lesson(lesson_num: int) -> Optional[Word]:
     ---------------------
     Optional[Word]: Случайное слово из указанного урока или None, если слов нет.
     """
-    with SessionLocal() as session:
-        # Формулируем запрос: выбираем случайное слово из указанного урока
-        query = (
-            select(Word)
-            .where(Word.num_lesson == lesson_num)
-            .order_by(func.random())  # Случайная сортировка
-            .limit(1)                 # Берём первое слово
-        )
-        result = session.execute(query).scalars().first()
-        return result
+    # Случайный id берём из пула в памяти, а не сортировкой всей таблицы
+    words = _get_words_by_ids(word_pool.sample(1, lesson_num=lesson_num))
+    return words[0] if words else None
+
+
+def build_word_question(lesson_num: Optional[int] = None, direction: Optional[str] = None,
+                        num_distractors: int = 3, word_id: Optional[int] = None) -> Optional[WordQuestion]:
+    """
+    Собирает вопрос целиком за один запрос к базе данных.
+
+    Id загаданного слова и кандидатов в неправильные варианты берутся из пула,
+    сами слова загружаются одним SELECT. Часть неправильных вариантов — слова,
+    с которыми загаданное слово чаще всего путают (индекс путаницы в памяти).
+    Неправильные варианты уникальны и не совпадают по тексту с правильным ответом.
+
+    Параметры:
+    ----------
+    lesson_num : Optional[int]
+        Номер урока, из которого берётся загаданное слово.
+    direction : Optional[str]
+        Направление перевода; по умолчанию выбирается случайно.
+    num_distractors : int
+        Количество неправильных вариантов.
+    word_id : Optional[int]
+        Загаданное слово; по умолчанию выбирается случайно (например, для
+        интервального повторения слово выбирает планировщик).
+
+    Возвращаемое значение:
+    ---------------------
+    Optional[WordQuestion]: Вопрос или None, если слов нет.
+    """
+    target_ids = [word_id] if word_id is not None else word_pool.sample(1, lesson_num=lesson_num)
+    if not target_ids:
+        return None
+    target_id = target_ids[0]
+    # Трудные варианты идут первыми; случайных кандидатов берём с запасом:
+    # часть может совпасть по тексту с ответом
+    hard_ids = confusion_index.hard_distractors(target_id, min(num_distractors, HARD_DISTRACTORS), exclude=target_ids)
+    candidate_ids = hard_ids + word_pool.sample(num_distractors * 2 + 2, exclude=target_ids + hard_ids)
+
+    words = _get_words_by_ids(target_ids + candidate_ids)
+    if not words or words[0].id != target_id:
+        return None
+    word, candidates = words[0], words[1:]
+
+    direction = direction or random.choice(["en->ru", "ru->en"])
+    attr = "english_word" if direction == "ru->en" else "russian_word"
+    correct_text = getattr(word, attr)
+
+    options = [(word.id, correct_text)]
+    used_texts = {normalize_text(correct_text)}
+    for candidate in candidates:
+        text = getattr(candidate, attr)
+        key = normalize_text(text)
+        if key in used_texts:
+            continue
+        used_texts.add(key)
+        options.append((candidate.id, text))
+        if len(options) > num_distractors:
+            break
+
+    random.shuffle(options)
+    correct_index = next(idx for idx, (word_id, _) in enumerate(options) if word_id == word.id)
+    return WordQuestion(word, direction, options, correct_index)
 
 
 def get_random_words_by_lesson(exclude_word_ids: list[int], lesson_num: int, count: int = 3) -> List[Word]:
@@ -34,40 +135,87 @@ def get_random_words_by_lesson(exclude_word_ids: list[int], lesson_num: int, cou
     Возвращает список случайных слов из конкретного урока,
     исключая указанные слова.
     """
-    with SessionLocal() as session:
-        query = (
-            select(Word)
-            .where(Word.num_lesson == lesson_num, ~Word.id.in_(tuple(exclude_word_ids)))
-            .order_by(func.random())
-        )
-        result = session.execute(query.limit(count)).scalars().all()
-        return result
+    return _get_words_by_ids(word_pool.sample(count, exclude=exclude_word_ids, lesson_num=lesson_num))
 
 
 
 
-async def get_lessons_from_db():
+def get_lessons_from_db():
     """Возвращает список всех уроков."""
     with SessionLocal() as session:
         lessons = session.query(Pages.num_lesson).distinct().group_by(Pages.num_lesson).all()
         return lessons
+
+
+def get_lesson_counts() -> Dict[int, Tuple[int, int]]:
+    """Количество слов и предложений по урокам: {номер урока: (слов, предложений)}."""
+    with SessionLocal() as session:
+        words = dict(session.execute(
+            select(Word.num_lesson, func.count()).where(Word.num_lesson.is_not(None)).group_by(Word.num_lesson)
+        ).all())
+        sentences = dict(session.execute(
+            select(Sentence.num_lesson, func.count()).where(Sentence.num_lesson.is_not(None))
+            .group_by(Sentence.num_lesson)
+        ).all())
+    return {lesson: (words.get(lesson, 0), sentences.get(lesson, 0)) for lesson in words.keys() | sentences.keys()}
     
 
     
-async def get_pages_by_lesson(lesson_num):
+def get_all_pages() -> List[Pages]:
+    """Возвращает все страницы уроков, отсортированные по уроку и номеру страницы."""
+    with SessionLocal() as session:
+        return session.query(Pages).order_by(Pages.num_lesson.asc(), Pages.num_page.asc()).all()
+
+
+def get_pages_by_lesson(lesson_num):
     """Возвращает страницы конкретного урока по номеру урока, отсортированные по порядку."""
     with SessionLocal() as session:
         pages = session.query(Pages).filter_by(num_lesson=lesson_num).order_by(Pages.num_page.asc()).all()
         return pages
     
 
-async def get_page_info(page_id):
+def get_page_info(page_id):
     """Возвращает информацию о странице по её идентификатору."""
     with SessionLocal() as session:
         page = session.query(Pages).filter_by(id=page_id).first() 
         return page
 
 
+def get_page_contents() -> List[PageContent]:
+    """Возвращает снимки содержимого всех страниц уроков."""
+    with SessionLocal() as session:
+        return session.execute(select(PageContent)).scalars().all()
+
+
+def save_page_content(page_id: int, source_chat: str, source_message_id: int, kind: str, text: Optional[str],
+                      entities: Optional[list], file_id: Optional[str], etag: str) -> str:
+    """
+    Сохраняет снимок содержимого страницы.
+    Возвращает 'created', 'updated' или 'unchanged' (etag совпал, обновлено только время сверки).
+    """
+    with SessionLocal() as session:
+        content = session.get(PageContent, page_id)
+        if content is None:
+            content = PageContent(page_id=page_id)
+            session.add(content)
+            status = 'created'
+        elif content.etag == etag and content.source_message_id == source_message_id:
+            status = 'unchanged'
+        else:
+            status = 'updated'
+        if status != 'unchanged':
+            content.source_chat = source_chat
+            content.source_message_id = source_message_id
+            content.kind = kind
+            content.text = text
+            content.entities = entities
+            content.file_id = file_id
+            content.etag = etag
+        content.fetched_at = time.time()
+        session.commit()
+        return status
+
+
 
 
 def get_all_words():
@@ -78,35 +226,13 @@ def get_all_words():
 
 def get_single_random_word() -> Optional[Word]:
     """Выбирает случайное слово из базы данных."""
-    with SessionLocal() as session:
-        result = session.execute(select(Word).order_by(func.random()).limit(1)).scalars().first()
-        return result
+    words = _get_words_by_ids(word_pool.sample(1))
+    return words[0] if words else None
 
-def get_random_words(exclude_word_id: int, count: int = 3) -> List[Word]:
+def get_random_words(exclude_word_id: Optional[int] = None, count: int = 3) -> List[Word]:
     """Возвращает список случайных слов, исключая указанное слово."""
-    with SessionLocal() as session:
-        query = select(Word).where(~Word.id.in_((exclude_word_id,))).order_by(func.random())
-        result = session.execute(query.limit(count)).scalars().all()
-        return result
-
-def get_random_relation_pair():
-    """Возвращает случайную пару слов с отношением между ними."""
-    with SessionLocal() as session:
-        # Сначала получаем случайное отношение
-        random_relation = session.query(Relation).order_by(func.random()).first()
-        
-        if random_relation is None:
-            return None
-            
-        # Получаем исходное и целевое слова
-        source_word = session.query(Word).get(random_relation.source_word_id)
-        target_word = session.query(Word).get(random_relation.target_word_id)
-        
-        if source_word is None or target_word is None:
-            return None
-            
-        # Возвращаем объекты слов и тип связи
-        return (source_word, random_relation.relation_type, target_word)
+    exclude = () if exclude_word_id is None else (exclude_word_id,)
+    return _get_words_by_ids(word_pool.sample(count, exclude=exclude))
 
 def get_random_word_with_relations(source_word_id: int, relation_type: str) -> Optional[Relation]:
     """
@@ -132,7 +258,8 @@ def get_random_words_for_options(exclude_sentence_id: int, num_options: int = 3)
     """
     with SessionLocal() as session:
         excluded_words_query = select(Sentence.text_ru, Sentence.translation_en).where(Sentence.id == exclude_sentence_id)
-        excluded_words = set(session.execute(excluded_words_query).scalarmany())
+        excluded_row = session.execute(excluded_words_query).first()
+        excluded_words = {word for word in excluded_row or () if word is not None}
         all_words_query = select(Word.russian_word).where(~Word.russian_word.in_(excluded_words))
         random_words = session.execute(all_words_query.order_by(func.random()).limit(num_options)).scalars().all()
         return random_words
@@ -160,6 +287,96 @@ def search_records_by_word(word_id: int) -> List[MetricWordsValue]:
         return results
 
 
+def upsert_metric_values(increments: Dict[Tuple[int, int], float]) -> Dict[Tuple[int, int], float]:
+    """
+    Прибавляет значения к записям MetricWordsValue одной транзакцией.
+    Отсутствующие пары создаются через INSERT ... ON CONFLICT DO UPDATE.
+
+    Параметры:
+    ----------
+    increments : Dict[Tuple[int, int], float]
+        Приращения по парам (word1_id, word2_id).
+
+    Возвращаемое значение:
+    ---------------------
+    Dict[Tuple[int, int], float]: Новые значения записанных пар (RETURNING).
+    """
+    if not increments:
+        return {}
+    table = MetricWordsValue.__table__
+    insert = postgresql_insert if engine.dialect.name == 'postgresql' else sqlite_insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.word1_id, table.c.word2_id],
+        set_={'value': table.c.value + stmt.excluded.value},
+    ).returning(table.c.word1_id, table.c.word2_id, table.c.value)
+    rows = [
+        {'word1_id': word1_id, 'word2_id': word2_id, 'value': value}
+        for (word1_id, word2_id), value in increments.items()
+    ]
+    with SessionLocal() as session:
+        values = {(word1_id, word2_id): value for word1_id, word2_id, value in session.execute(stmt, rows)}
+        session.commit()
+    return values
+
+
+def get_review_cards(user_id: int) -> List[Tuple[int, float, float, int, int, float]]:
+    """
+    Возвращает все карточки интервального повторения пользователя.
+
+    Параметры:
+    ----------
+    user_id : int
+        Telegram id пользователя.
+
+    Возвращаемое значение:
+    ---------------------
+    List[Tuple]: Кортежи (word_id, interval, ease, repetitions, lapses, due).
+    """
+    with SessionLocal() as session:
+        rows = session.execute(
+            select(ReviewCard.word_id, ReviewCard.interval, ReviewCard.ease,
+                   ReviewCard.repetitions, ReviewCard.lapses, ReviewCard.due)
+            .where(ReviewCard.user_id == user_id)
+        ).all()
+    return [tuple(row) for row in rows]
+
+
+def upsert_review_cards(cards: Dict[Tuple[int, int], Tuple[float, float, int, int, float]]) -> int:
+    """
+    Записывает карточки интервального повторения одной транзакцией
+    через INSERT ... ON CONFLICT DO UPDATE.
+
+    Параметры:
+    ----------
+    cards : Dict[Tuple[int, int], Tuple]
+        Состояние карточек по парам (user_id, word_id):
+        (interval, ease, repetitions, lapses, due).
+
+    Возвращаемое значение:
+    ---------------------
+    int: Количество записанных карточек.
+    """
+    if not cards:
+        return 0
+    table = ReviewCard.__table__
+    insert = postgresql_insert if engine.dialect.name == 'postgresql' else sqlite_insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.word_id],
+        set_={name: stmt.excluded[name] for name in ('interval', 'ease', 'repetitions', 'lapses', 'due')},
+    )
+    rows = [
+        {'user_id': user_id, 'word_id': word_id, 'interval': interval, 'ease': ease,
+         'repetitions': repetitions, 'lapses': lapses, 'due': due}
+        for (user_id, word_id), (interval, ease, repetitions, lapses, due) in cards.items()
+    ]
+    with SessionLocal() as session:
+        session.execute(stmt, rows)
+        session.commit()
+    return len(rows)
+
+
 def add_or_update_metric_value(word1_id: int, word2_id: int, increment_value: float = 0.05):
     """
     Добавляет новую запись в таблицу MetricWordsValue или обновляет существующую.
@@ -175,20 +392,7 @@ def add_or_update_metric_value(word1_id: int, word2_id: int, increment_value: fl
     increment_value : float, optional
         Значение увеличения веса, по умолчанию 0.05.
     """
-    with SessionLocal() as session:
-        record = session.query(MetricWordsValue).filter_by(word1_id=word1_id, word2_id=word2_id).first()
-        if record:
-            # Запись уже существует, обновляем её
-            record.value += increment_value
-        else:
-            # Нет записи, создаём новую
-            new_record = MetricWordsValue(
-                word1_id=word1_id,
-                word2_id=word2_id,
-                value=increment_value
-            )
-            session.add(new_record)
-        session.commit()
+    upsert_metric_values({(word1_id, word2_id): increment_value})
 
 
 def remove_zero_values():
@@ -212,23 +416,40 @@ def update_metric_value(record_id: int, delta: float):
             session.commit()
 
         
-def find_word_by_text(text: str) -> Optional['Word']:
+def find_word_by_text(text: str, lang: Optional[str] = None) -> Optional['Word']:
     """
-    Поиск слова по английскому или русскому варианту.
+    Поиск слова по английскому слову, переводу или альтернативному переводу.
+
+    Текст нормализуется так же, как ответы в играх (регистр, пунктуация,
+    ё/е, пробелы), и ищется в обратном индексе word_forms одной выборкой
+    по первичному ключу.
+
+    Параметры:
+    ----------
+    text : str
+        Текст ответа.
+    lang : Optional[str]
+        'en' или 'ru', чтобы искать только среди форм одного языка.
+
+    Возвращаемое значение:
+    ---------------------
+    Optional[Word]: Найденное слово или None.
     """
-    from db_layer.models import Word
+    form = normalize_text(text)
+    if not form:
+        return None
+    query = select(Word).join(WordForm, WordForm.word_id == Word.id).where(WordForm.form == form)
+    if lang is not None:
+        query = query.where(WordForm.lang == lang)
     with SessionLocal() as session:
-        word = session.query(Word).filter(
-            (Word.english_word == text) | (Word.russian_word == text)
-        ).first()
-        return word
+        return session.execute(query.order_by(WordForm.lang, WordForm.word_id).limit(1)).scalar_one_or_none()
 
 def search_records_by_word_pair(correct_word_id: int, incorrect_word_id: int) -> list:
     """Ищет существующие записи с заданной парой слов."""
     with SessionLocal() as session:
         records = (
             session.query(MetricWordsValue)
-            .filter((MetricWordsValue.correct_word_id == correct_word_id) & (MetricWordsValue.incorrect_word_id == incorrect_word_id))
+            .filter((MetricWordsValue.word1_id == correct_word_id) & (MetricWordsValue.word2_id == incorrect_word_id))
             .all()
         )
         return records
@@ -274,4 +495,126 @@ def get_all_sentences(self) -> List[Sentence]:
     """
     with SessionLocal() as session:
         results = session.query(Sentence).all()
-        return results
\ No newline at end of file
+        return results
+
+
+def _insert(table):
+    return (postgresql_insert if engine.dialect.name == 'postgresql' else sqlite_insert)(table)
+
+
+def add_user(user_data: dict) -> User:
+    """
+    Регистрирует пользователя или обновляет его имя, если он уже есть.
+
+    Параметры:
+    ----------
+    user_data : dict
+        telegram_id и, необязательно, username, first_name, last_name.
+
+    Возвращаемое значение:
+    ---------------------
+    User: Запись пользователя.
+    """
+    table = User.__table__
+    profile = {name: user_data.get(name) for name in ('username', 'first_name', 'last_name')}
+    stmt = _insert(table).values(telegram_id=user_data['telegram_id'], created_at=time.time(), **profile)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.telegram_id], set_=profile)
+    with SessionLocal() as session:
+        session.execute(stmt)
+        session.commit()
+    return get_user_by_telegram_id(user_data['telegram_id'])
+
+
+def get_user_by_telegram_id(telegram_id: int) -> Optional[User]:
+    """
+    Возвращает пользователя вместе с итогами (ответы, серия, слова) по Telegram id.
+    Поиск по уникальному индексу; журнал ответов не читается.
+    """
+    with SessionLocal() as session:
+        return session.execute(select(User).where(User.telegram_id == telegram_id)).scalar_one_or_none()
+
+
+def _streaks(streak: int, best: int, results: List[bool]) -> Tuple[int, int]:
+    """Текущая и лучшая серии после ответов results (по порядку)."""
+    for is_correct in results:
+        streak = streak + 1 if is_correct else 0
+        best = max(best, streak)
+    return streak, best
+
+
+def save_user_progress(events: List[AnswerRecord]) -> int:
+    """
+    Записывает пачку ответов одной транзакцией: добавляет строки в answer_events,
+    регистрирует новых пользователей и пересчитывает итоги пользователей
+    (ответы, правильные ответы, серии, число различных слов) по приращениям,
+    не читая журнал.
+
+    Параметры:
+    ----------
+    events : List[AnswerRecord]
+        Ответы в порядке поступления.
+
+    Возвращаемое значение:
+    ---------------------
+    int: Количество записанных ответов.
+    """
+    if not events:
+        return 0
+    by_user: Dict[int, List[AnswerRecord]] = {}
+    for record in events:
+        by_user.setdefault(record.user_id, []).append(record)
+    seen_pairs = {
+        (record.user_id, record.item_id) for record in events
+        if record.game in WORD_GAMES and record.item_id is not None
+    }
+    users = User.__table__
+    user_words = UserWord.__table__
+
+    with SessionLocal() as session:
+        session.execute(AnswerEvent.__table__.insert(), [record._asdict() for record in events])
+        session.execute(
+            _insert(users).on_conflict_do_nothing(index_elements=[users.c.telegram_id]),
+            [{'telegram_id': user_id, 'created_at': records[0].created_at, 'answers': 0, 'correct_answers': 0,
+              'streak': 0, 'best_streak': 0, 'words_seen': 0} for user_id, records in by_user.items()],
+        )
+        new_words: Counter = Counter()
+        if seen_pairs:
+            inserted = session.execute(
+                _insert(user_words).on_conflict_do_nothing().returning(user_words.c.user_id),
+                [{'user_id': user_id, 'word_id': word_id} for user_id, word_id in seen_pairs],
+            )
+            new_words.update(user_id for user_id, in inserted)
+        current = {
+            row.telegram_id: row for row in session.execute(
+                select(users.c.telegram_id, users.c.streak, users.c.best_streak)
+                .where(users.c.telegram_id.in_(by_user))
+            )
+        }
+        rows = []
+        for user_id, records in by_user.items():
+            streak, best = _streaks(current[user_id].streak, current[user_id].best_streak,
+                                    [record.is_correct for record in records])
+            rows.append({
+                'uid': user_id,
+                'add_answers': len(records),
+                'add_correct': sum(1 for record in records if record.is_correct),
+                'set_streak': streak,
+                'set_best': best,
+                'add_words': new_words[user_id],
+                'set_last': records[-1].created_at,
+            })
+        session.execute(
+            update(users)
+            .where(users.c.telegram_id == bindparam('uid'))
+            .values(
+                answers=users.c.answers + bindparam('add_answers'),
+                correct_answers=users.c.correct_answers + bindparam('add_correct'),
+                streak=bindparam('set_streak'),
+                best_streak=bindparam('set_best'),
+                words_seen=users.c.words_seen + bindparam('add_words'),
+                last_answer_at=bindparam('set_last'),
+            ),
+            rows,
+        )
+        session.commit()
+    return len(events)
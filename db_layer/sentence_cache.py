@@ -0,0 +1,188 @@
+"""
+Кэш скомпилированных предложений для грамматического тренажёра.
+
+Предложение разбирается один раз: перевод делится на токены, токены
+нормализуются, и для каждой позиции заранее подбираются неправильные
+варианты. Слова для вариантов всех позиций загружаются одним запросом,
+поэтому нажатие кнопки в тренажёре не обращается к базе данных.
+Кэш ограничен по размеру (LRU, ``SENTENCE_CACHE_SIZE``); предложения
+урока можно скомпилировать заранее одним проходом.
+"""
+import os
+import random
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event, select
+
+from db_layer import repository
+from db_layer.models import Sentence, SessionLocal
+from db_layer.normalizer import normalize_text
+
+# Неправильных вариантов на каждую позицию
+DISTRACTORS_PER_POSITION = 3
+
+
+class CompiledSentence(NamedTuple):
+    """Разобранное предложение с готовыми вариантами для каждой позиции."""
+    sentence_id: int
+    text_ru: str
+    translation_en: str
+    tokens: Tuple[str, ...]
+    normalized: Tuple[str, ...]
+    distractors: Tuple[Tuple[str, ...], ...]
+
+    def options(self, position: int) -> List[str]:
+        """Перемешанные варианты ответа для позиции: правильный и неправильные."""
+        options = [self.normalized[position], *self.distractors[position]]
+        random.shuffle(options)
+        return options
+
+
+def _candidate_texts(count: int, exclude: Set[str]) -> List[str]:
+    """Нормализованные уникальные английские слова для вариантов (один запрос)."""
+    texts: List[str] = []
+    seen = set(exclude)
+    for word in repository.get_random_words(count=count):
+        text = normalize_text(word.english_word)
+        if text and text not in seen:
+            seen.add(text)
+            texts.append(text)
+    return texts
+
+
+def _compile_many(sentences: Iterable[Sentence]) -> List[CompiledSentence]:
+    """Компилирует предложения, подбирая слова для всех их позиций одним запросом."""
+    parsed = []
+    for sentence in sentences:
+        tokens = tuple(sentence.translation_en.split())
+        parsed.append((sentence, tokens, tuple(normalize_text(token) for token in tokens)))
+    positions = sum(len(tokens) for _, tokens, _ in parsed)
+    if not positions:
+        return [
+            CompiledSentence(sentence.id, sentence.text_ru, sentence.translation_en, (), (), ())
+            for sentence, _, _ in parsed
+        ]
+
+    # С запасом: часть слов отсеется как совпадающая с токенами предложений
+    pool = _candidate_texts(positions * DISTRACTORS_PER_POSITION * 2 + 10, set())
+
+    compiled = []
+    for sentence, tokens, normalized in parsed:
+        # Слова самого предложения не годятся как неправильные варианты
+        own = set(normalized)
+        candidates = [text for text in pool if text not in own]
+        distractors = []
+        for _ in normalized:
+            distractors.append(tuple(random.sample(candidates, min(DISTRACTORS_PER_POSITION, len(candidates)))))
+        compiled.append(CompiledSentence(
+            sentence.id, sentence.text_ru, sentence.translation_en, tokens, normalized, tuple(distractors),
+        ))
+    return compiled
+
+
+class SentenceCache:
+    """
+    LRU-кэш скомпилированных предложений.
+
+    Параметры:
+    ----------
+    max_size : int
+        Максимальное число предложений в кэше.
+    """
+
+    def __init__(self, max_size: int = 5000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[int, CompiledSentence]" = OrderedDict()
+        self._warm_lessons: Set[int] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def peek(self, sentence_id: int) -> Optional[CompiledSentence]:
+        """Возвращает предложение из кэша без обращения к базе данных или None."""
+        with self._lock:
+            compiled = self._items.get(sentence_id)
+            if compiled is not None:
+                self._items.move_to_end(sentence_id)
+                self.hits += 1
+            return compiled
+
+    def get(self, sentence_id: int, sentence: Optional[Sentence] = None) -> Optional[CompiledSentence]:
+        """
+        Возвращает скомпилированное предложение, при промахе компилирует его.
+        Уже загруженный объект ``sentence`` избавляет от повторного запроса.
+        """
+        compiled = self.peek(sentence_id)
+        if compiled is not None:
+            return compiled
+        if sentence is None:
+            with SessionLocal() as session:
+                sentence = session.get(Sentence, sentence_id)
+            if sentence is None:
+                return None
+        compiled = _compile_many([sentence])[0]
+        with self._lock:
+            self.misses += 1
+            self._put(compiled)
+        return compiled
+
+    def warm_lesson(self, lesson_id: int) -> int:
+        """
+        Компилирует все предложения урока одним проходом.
+        Повторный вызов для уже прогретого урока ничего не делает.
+
+        Возвращает количество скомпилированных предложений.
+        """
+        if lesson_id in self._warm_lessons:
+            return 0
+        with SessionLocal() as session:
+            sentences = session.execute(
+                select(Sentence).where(Sentence.num_lesson == lesson_id)
+            ).scalars().all()
+        compiled = _compile_many(sentences)
+        with self._lock:
+            for item in compiled:
+                self._put(item)
+            self._warm_lessons.add(lesson_id)
+        return len(compiled)
+
+    def _put(self, compiled: CompiledSentence) -> None:
+        self._items[compiled.sentence_id] = compiled
+        self._items.move_to_end(compiled.sentence_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            # Урок мог потерять часть предложений: при следующем старте прогреем снова
+            self._warm_lessons.clear()
+
+    def invalidate(self, sentence_id: Optional[int] = None) -> None:
+        """Удаляет предложение из кэша; без аргумента очищает кэш целиком."""
+        with self._lock:
+            if sentence_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(sentence_id, None)
+            self._warm_lessons.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики кэша для метрик и отладки."""
+        return {
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'warm_lessons': len(self._warm_lessons),
+        }
+
+
+sentence_cache = SentenceCache(max_size=int(os.getenv('SENTENCE_CACHE_SIZE', 5000)))
+
+
+def _invalidate_sentence(mapper, connection, target):
+    sentence_cache.invalidate(target.id)
+
+
+# Изменённое или удалённое предложение будет скомпилировано заново
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Sentence, _event_name, _invalidate_sentence)
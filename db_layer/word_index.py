@@ -0,0 +1,103 @@
+"""
+Индекс нормализованных форм слов.
+
+Для каждого слова в ``word_forms`` хранятся нормализованные английское
+слово, перевод и все альтернативные переводы из ``alter_russian_word``,
+а в ``words.english_norm``/``russian_norm`` — нормализованные слово
+и перевод. Поиск слова по тексту ответа — одна выборка по первичному
+ключу ``word_forms``.
+
+Слова, изменённые через ORM в этом процессе, переиндексируются событиями
+маппера. Слова, добавленные сторонними процессами (парсерами), имеют
+пустой ``english_norm`` и индексируются ``reindex_words`` — при запуске
+бота или вручную::
+
+    python -m db_layer.word_index          # только новые слова
+    python -m db_layer.word_index --all    # все слова заново
+"""
+import argparse
+from typing import Iterable, Tuple
+
+from sqlalchemy import bindparam, delete, event, select, update
+
+from db_layer.models import Word, WordForm, engine
+from db_layer.normalizer import normalize_text, word_forms
+
+CHUNK_SIZE = 10_000
+
+# (id, english_word, russian_word, alter_russian_word)
+WordRow = Tuple[int, str, str, object]
+
+
+def index_words(conn, rows: Iterable[WordRow]) -> int:
+    """Переиндексирует слова в открытой транзакции; возвращает их количество."""
+    rows = list(rows)
+    if not rows:
+        return 0
+    words, forms = Word.__table__, WordForm.__table__
+    conn.execute(delete(forms).where(forms.c.word_id.in_([row[0] for row in rows])))
+    form_rows = [
+        {'form': form, 'lang': lang, 'word_id': word_id}
+        for word_id, english_word, russian_word, alternatives in rows
+        for form, lang in word_forms(english_word, russian_word, alternatives)
+    ]
+    if form_rows:
+        conn.execute(forms.insert(), form_rows)
+    conn.execute(
+        update(words).where(words.c.id == bindparam('row_id')).values(
+            english_norm=bindparam('english'), russian_norm=bindparam('russian')),
+        [{'row_id': word_id, 'english': normalize_text(english_word), 'russian': normalize_text(russian_word)}
+         for word_id, english_word, russian_word, _ in rows],
+    )
+    return len(rows)
+
+
+def index_missing_words(conn, reindex_all: bool = False, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Индексирует порциями по id слова без нормализованных форм (или все слова)
+    в переданной транзакции. Возвращает количество проиндексированных слов.
+    """
+    words = Word.__table__
+    query = select(words.c.id, words.c.english_word, words.c.russian_word, words.c.alter_russian_word)
+    if not reindex_all:
+        query = query.where(words.c.english_norm.is_(None))
+    total, last_id = 0, 0
+    while True:
+        rows = conn.execute(query.where(words.c.id > last_id).order_by(words.c.id).limit(chunk_size)).all()
+        if not rows:
+            return total
+        total += index_words(conn, rows)
+        last_id = rows[-1][0]
+
+
+def reindex_words(reindex_all: bool = False) -> int:
+    """Индексирует новые слова (или все) одной транзакцией; возвращает их количество."""
+    with engine.begin() as conn:
+        return index_missing_words(conn, reindex_all)
+
+
+def _index_word(mapper, connection, target):
+    index_words(connection, [(target.id, target.english_word, target.russian_word, target.alter_russian_word)])
+
+
+def _unindex_word(mapper, connection, target):
+    connection.execute(delete(WordForm.__table__).where(WordForm.__table__.c.word_id == target.id))
+
+
+# Слова, изменённые через ORM в этом процессе, индексируются сразу
+event.listen(Word, 'after_insert', _index_word)
+event.listen(Word, 'after_update', _index_word)
+event.listen(Word, 'before_delete', _unindex_word)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Индекс нормализованных форм слов")
+    parser.add_argument("--all", action="store_true", help="переиндексировать все слова, а не только новые")
+    args = parser.parse_args()
+    from db_layer.migrations import run_migrations
+    run_migrations()
+    print(f"Проиндексировано слов: {reindex_words(args.all)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Пул идентификаторов слов в памяти процесса.
+
+Вместо ``ORDER BY random() LIMIT n`` по всей таблице ``words`` случайные слова
+выбираются из заранее загруженных массивов id: общего и по каждому уроку.
+Пул загружается один раз и перечитывается, когда слова меняются
+(события SQLAlchemy) или когда истекает ``WORD_POOL_MAX_AGE`` секунд —
+на случай, если база наполняется сторонним процессом (парсерами).
+"""
+import os
+import random
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, select
+
+from db_layer.models import SessionLocal, Word
+
+_EMPTY = array('q')
+
+
+class WordPool:
+    """
+    Индекс словаря: массив id всех слов и массивы id слов каждого урока.
+    """
+
+    def __init__(self, max_age: Optional[float] = None):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._all_ids = _EMPTY
+        self._lesson_ids: Dict[int, array] = {}
+        self._dirty = True
+        self._loaded_at = 0.0
+
+    def load(self) -> None:
+        """Перечитывает id слов из базы данных и атомарно подменяет массивы."""
+        with SessionLocal() as session:
+            rows = session.execute(select(Word.id, Word.num_lesson)).all()
+
+        all_ids = array('q')
+        lesson_ids: Dict[int, array] = {}
+        for word_id, num_lesson in rows:
+            all_ids.append(word_id)
+            if num_lesson is not None:
+                lesson_ids.setdefault(num_lesson, array('q')).append(word_id)
+
+        self._all_ids, self._lesson_ids = all_ids, lesson_ids
+        self._loaded_at = time.monotonic()
+        self._dirty = False
+
+    def invalidate(self) -> None:
+        """Помечает пул устаревшим: он будет перечитан при следующей выборке."""
+        self._dirty = True
+
+    def _is_stale(self) -> bool:
+        if self._dirty:
+            return True
+        return self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age
+
+    def ids(self, lesson_num: Optional[int] = None) -> array:
+        """Возвращает массив id всех слов или слов указанного урока."""
+        if self._is_stale():
+            with self._lock:
+                # Пока мы ждали блокировку, пул мог перечитать другой поток
+                if self._is_stale():
+                    self.load()
+        if lesson_num is None:
+            return self._all_ids
+        return self._lesson_ids.get(lesson_num, _EMPTY)
+
+    def sample(self, count: int, exclude: Iterable[int] = (), lesson_num: Optional[int] = None) -> List[int]:
+        """
+        Возвращает до ``count`` различных случайных id, исключая ``exclude``.
+
+        Выборка с отбраковкой занимает O(count), пока исключённых слов
+        немного по сравнению с размером пула. Для маленьких пулов, где
+        отбраковка может зациклиться, используется полный перебор.
+        """
+        ids = self.ids(lesson_num)
+        excluded = set(exclude)
+        size = len(ids)
+        if count <= 0 or size == 0:
+            return []
+
+        if size <= 2 * (count + len(excluded)):
+            candidates = [word_id for word_id in ids if word_id not in excluded]
+            return random.sample(candidates, min(count, len(candidates)))
+
+        chosen: List[int] = []
+        seen = set(excluded)
+        attempts = 4 * (count + len(excluded)) + 16
+        while len(chosen) < count and attempts > 0:
+            attempts -= 1
+            word_id = ids[random.randrange(size)]
+            if word_id not in seen:
+                seen.add(word_id)
+                chosen.append(word_id)
+        return chosen
+
+    def stats(self) -> Dict[str, int]:
+        """Размер пула для метрик и отладки."""
+        return {
+            'words': len(self._all_ids),
+            'lessons': len(self._lesson_ids),
+        }
+
+
+word_pool = WordPool(max_age=float(os.getenv('WORD_POOL_MAX_AGE', 300)))
+
+
+def _invalidate_word_pool(mapper, connection, target):
+    word_pool.invalidate()
+
+
+# Любое изменение слов в этом процессе сбрасывает пул
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Word, _event_name, _invalidate_word_pool)
@@ -4,6 +4,7 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.types import CallbackQuery
 
 from db_layer.repository import save_user_progress
+from learning_modules.sessions import FlashcardState, create_registry
 
 
     
@@ -71,7 +72,8 @@ class Game_flashcards:
             "на": ["on"],
             "столе": ["table"]
         }
-        self.user_progress = {}
+        # Прогресс по пользователям с вытеснением неактивных сессий
+        self.user_progress = create_registry(FlashcardState)
 
     def generate_options(self, word: str) -> list:
         all_translations = set.union(*map(set, self.translations_map.values()))
@@ -99,17 +101,15 @@ class Game_flashcards:
     def start_game(self, user_id: int) -> GameResponse:
         if len(self.proposals) > 0:
             proposal = random.choice(self.proposals)
-            self.user_progress[user_id] = {
-                'proposal': proposal,
-                'current_word_idx': 0,
-                'selected_words': [],
-                'total_attempts': 0,
-                'correct_answers': 0,
-                'options': []  # Список вариантов ответов
-            }
+            progress = self.user_progress.get(user_id)
+            progress.proposal = proposal
+            progress.current_word_idx = 0
+            progress.selected_words = []
+            progress.total_attempts = 0
+            progress.correct_answers = 0
             first_word = proposal.split()[0]
             options = self.generate_options(first_word)
-            self.user_progress[user_id]['options'] = options
+            progress.options = options  # Список вариантов ответов
             keyboard = self.create_keyboard(options, first_word)
             return GameResponse(
                 text=f"Ваше предложение: '{proposal}'\nПереведите слово '{first_word}'.",
@@ -125,32 +125,32 @@ class Game_flashcards:
         
         _, current_word, selected_option = parts
         
-        progress = self.user_progress.get(user_id)
-        if not progress or current_word != progress['proposal'].split()[progress['current_word_idx']]:
+        progress = self.user_progress.find(user_id)
+        if not progress or not progress.proposal or current_word != progress.proposal.split()[progress.current_word_idx]:
             return GameResponse(text="Игра закончилась.", keyboard=None)
         
-        options = progress['options']
+        options = progress.options
         correct_answer = self.translations_map[current_word][0]
         chosen_answer = options[int(selected_option)]
         
         if chosen_answer == correct_answer:
             result_message = f"Правильно! Слово '{current_word}' переведено верно."
-            progress['correct_answers'] += 1
+            progress.correct_answers += 1
         else:
             result_message = f"Неправильно! Правильный перевод слова '{current_word}' — '{correct_answer}'."
         
-        next_word_idx = progress['current_word_idx'] + 1
-        words_in_proposal = progress.get('proposal', '').split()
+        next_word_idx = progress.current_word_idx + 1
+        words_in_proposal = progress.proposal.split()
         
         if next_word_idx >= len(words_in_proposal):
-            final_score = f"Игра закончена. Количество правильных ответов: {progress['correct_answers']} из {len(words_in_proposal)}"
-            del self.user_progress[user_id]
+            final_score = f"Игра закончена. Количество правильных ответов: {progress.correct_answers} из {len(words_in_proposal)}"
+            self.user_progress.drop(user_id)
             return GameResponse(text=final_score, keyboard=None)
         else:
             new_word = words_in_proposal[next_word_idx]
             new_options = self.generate_options(new_word)
-            progress['current_word_idx'] = next_word_idx
-            progress['options'] = new_options
+            progress.current_word_idx = next_word_idx
+            progress.options = new_options
             keyboard = self.create_keyboard(new_options, new_word)
             return GameResponse(
                 text=f"{result_message}\nСледующее слово: '{new_word}', выберите перевод.",
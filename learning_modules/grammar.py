@@ -1,50 +1,53 @@
 from typing import List, Tuple, Optional
-import random
 import re
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
 from aiogram.types import Message, CallbackQuery
-from db_layer.repository import next_sentence, get_random_words
+from bot_core.callbacks import CallbackAction
+from db_layer.answer_log import answer_log
+from db_layer.async_repository import next_sentence, run_in_db_thread
+from db_layer.normalizer import normalize_text
+from db_layer.sentence_cache import CompiledSentence, sentence_cache
+from learning_modules.sessions import GameSessions, GrammarState
+
+# Выбор режима: sd — обычный, st — по уроку (без номера урока — выбор урока), se — экзамен
+GRAMMAR_MODE = CallbackAction('grammar_mode', 'gm', (('mode', str), ('lesson', int)))
+# Выбор очередного слова перевода
+GRAMMAR_WORD = CallbackAction('grammar_word', 'gw', (('option', int), ))
+
+# Результат find_errors для перевода без ошибок
+NO_ERRORS = "Нет ошибок!"
 
 
 class GrammarLearner:
     def __init__(self):
-        self.current_sentence = None
-        self.user_translation = []  # Накопленное предложение пользователя
-        self.translation_direction = None
-        self.options = None
-        self.total_words_count = 0  # Всего слов в предложении
-        self.completed_words = 0  # Кол-во выбранных слов
-        self.mode = ""  # Режим игры (default, lesson:<id>, exam:<level>)
+        # Состояние тренажёра (предложение, накопленный перевод, режим) хранится по чатам
+        self.sessions = GameSessions("grammar", GrammarState)
 
     def normalize_answer(self, answer: str) -> str:
         """
         Приведение строки к единому виду: удаление знаков препинания и преобразование в нижний регистр.
         """
-        cleaned_answer = ''.join(char for char in answer if char.isalnum() or char.isspace()).strip().lower()
-        return cleaned_answer
+        return normalize_text(answer)
 
-    def generate_options(self) -> List[str]:
+    async def compiled_sentence(self, sentence_id: int) -> Optional[CompiledSentence]:
         """
-        Формирует четыре варианта ответов: один правильный и три неправильных.
+        Возвращает скомпилированное предложение из кэша.
+        База данных читается только при промахе кэша.
         """
-        # Выбор правильного ответа
-        correct_answer = self.current_sentence.translation_en.split()[self.completed_words]
-        normalized_correct_answer = self.normalize_answer(correct_answer)
-
-        # Получение случайных неправильных слов
-        wrong_words = get_random_words(count=10, exclude_word_id=self.current_sentence.id)
-        wrong_words_filtered = [
-            word for word in wrong_words
-            if word.english_word != correct_answer
-        ][:3]  # Используем максимум три уникальных неправильных слова
+        compiled = sentence_cache.peek(sentence_id)
+        if compiled is None:
+            compiled = await run_in_db_thread(sentence_cache.get, sentence_id)
+        return compiled
 
-        # Преобразуем неправильные ответы в общий формат
-        wrong_answers_normalized = [self.normalize_answer(word.english_word) for word in wrong_words_filtered]
-
-        # Объединяем правильный и неправильные варианты
-        options = [normalized_correct_answer] + wrong_answers_normalized
-        random.shuffle(options)  # Перемешиваем варианты
-        return options[:4]  # Возврат первых четырех элементов
+    async def generate_options(self, state: GrammarState) -> List[str]:
+        """
+        Формирует четыре варианта ответов: один правильный и три неправильных.
+        Варианты для каждой позиции подобраны заранее при компиляции предложения.
+        """
+        compiled = await self.compiled_sentence(state.sentence_id)
+        if compiled is None or state.completed_words >= len(compiled.tokens):
+            return []
+        return compiled.options(state.completed_words)
 
     def create_keyboard(self, options: List[str]) -> InlineKeyboardMarkup:
         """
@@ -55,7 +58,7 @@ class GrammarLearner:
         for i in range(0, len(options), row_size):
             row_buttons = []
             for j in range(i, min(i+row_size, len(options))):
-                button = InlineKeyboardButton(text=options[j], callback_data=f'gw_{j}')
+                button = InlineKeyboardButton(text=options[j], callback_data=GRAMMAR_WORD.pack(option=j))
                 row_buttons.append(button)
             buttons.append(row_buttons)
         keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -78,7 +81,7 @@ class GrammarLearner:
             if u_word != c_word:
                 errors.append(f"Слово №{idx+1}: {u_word} → {c_word}")
     
-        return '\n'.join(errors) if errors else "Нет ошибок!"
+        return '\n'.join(errors) if errors else NO_ERRORS
 
     def escape_md_v2(text: str) -> str:
         special_chars = r'_*\[]()~`>#+-={}|.!'
@@ -90,82 +93,98 @@ class GrammarLearner:
         """
         Загрузка следующего вопроса независимо от режима.
         """
-        # Получаем следующее предложение
-        self.current_sentence = next_sentence(self)
-        if self.current_sentence:
-            self.total_words_count = len(self.current_sentence.translation_en.split())
-            self.user_translation = []
-            self.completed_words = 0
-            self.options = self.generate_options()
-
+        async with self.sessions.session(message.chat.id) as state:
+            # Получаем следующее предложение
+            sentence = await next_sentence(state)
+            if sentence:
+                # Предложение разбирается один раз и дальше берётся из кэша
+                compiled = await run_in_db_thread(sentence_cache.get, sentence.id, sentence)
+                state.sentence_id = compiled.sentence_id
+                state.text_ru = compiled.text_ru
+                state.translation_en = compiled.translation_en
+                state.total_words_count = len(compiled.tokens)
+                state.user_translation = []
+                state.completed_words = 0
+                state.options = tuple(await self.generate_options(state))
+                keyboard = self.create_keyboard(state.options)
+                text = (
+                    f"Исходное предложение: `{state.text_ru}`\n\n"
+                    f"Текущий перевод: {' '.join(state.user_translation)}\n\n"
+                    f"Выбирайте следующую часть перевода:"
+                )
+
+        if sentence:
             # Показываем клавиатуру с вариантами переводов
-            keyboard = self.create_keyboard(self.options)
-            await message.answer(
-                f"Исходное предложение: `{self.current_sentence.text_ru}`\n\n"
-                f"Текущий перевод: {' '.join(self.user_translation)}\n\n"
-                f"Выбирайте следующую часть перевода:",
-                reply_markup=keyboard,
-                parse_mode="MarkdownV2"
-            )
+            await message.answer(text, reply_markup=keyboard, parse_mode="MarkdownV2")
         else:
             await message.answer("Нет предложений для перевода.")
             
         
-    async def handle_callback(self, query: CallbackQuery):
-        """
-        Обработчик нажатий на inline-кнопки.
-        """
-        data_parts = query.data.split('_')
-        if len(data_parts) != 2 or data_parts[0] != 'gw':
-            raise ValueError('Некорректный формат callback-data.')
-
-        option_idx = int(data_parts[1])
-
-        # Получаем выбранный вариант ответа
-        chosen_option = self.options[option_idx]
-        print(f"Selected Option: {chosen_option}, Current Translation: {' '.join(self.user_translation)}")  # Диагностика
-
-        # Добавляем выбранное слово в перевод
-        self.user_translation.append(chosen_option)
-        self.completed_words += 1
+    async def handle_callback(self, query: CallbackQuery, option: int):
+        """
+        Обработчик нажатий на inline-кнопки: option — номер выбранного варианта.
+        """
+        option_idx = option
+        async with self.sessions.session(query.message.chat.id, create=False) as state:
+            is_stale = state is None or state.sentence_id is None or option_idx >= len(state.options)
+            if not is_stale:
+                # Получаем выбранный вариант ответа
+                chosen_option = state.options[option_idx]
+                print(f"Selected Option: {chosen_option}, Current Translation: {' '.join(state.user_translation)}")  # Диагностика
+
+                # Добавляем выбранное слово в перевод
+                state.user_translation.append(chosen_option)
+                state.completed_words += 1
+
+                is_finished = state.completed_words >= state.total_words_count
+                if not is_finished:
+                    # Ещё не выбрали все слова
+                    state.options = tuple(await self.generate_options(state))  # Новые варианты для следующего слова
+                    keyboard = self.create_keyboard(state.options)
+                    safe_message = GrammarLearner.escape_md_v2(f"Исходное предложение: `{state.text_ru}`\n\n"
+                        f"Текущий перевод: {' '.join(state.user_translation)}\n\n"
+                        f"Продолжайте выбирать!")
+                else:
+                    # Все слова выбраны, проверяем перевод
+                    final_translation = ' '.join(state.user_translation).strip()
+                    errors = self.find_errors(final_translation, state.translation_en)
+
+                    result_message = GrammarLearner.escape_md_v2(
+                        f"Исходное предложение: `{state.text_ru}`\n\n"
+                        f"Ваш перевод: `{final_translation}`\n\n"
+                        f"Правильный перевод: `{state.translation_en}`\n\n"
+                        f"Результат: {errors}"
+                    )
+                    is_exam = state.mode.startswith("exam")
+                    answer_log.add(query.from_user.id, "grammar", state.sentence_id, errors == NO_ERRORS)
+                    # Предложение закончено: повторные нажатия увидят устаревшее задание
+                    state.sentence_id = None
+                    state.text_ru = None
+                    state.translation_en = None
+                    state.user_translation = []
+                    state.completed_words = 0
+                    state.options = ()
+
+        if is_stale:
+            await query.answer("Задание устарело. Начните тренировку заново.", show_alert=True)
+            return
 
         # Обновляем клавиатуру или показываем результат
-        if self.completed_words < self.total_words_count:
-            # Ещё не выбрали все слова
-            self.options = self.generate_options()  # Новые варианты для следующего слова
-            keyboard = self.create_keyboard(self.options)
-            safe_message = GrammarLearner.escape_md_v2(f"Исходное предложение: `{self.current_sentence.text_ru}`\n\n"
-                f"Текущий перевод: {' '.join(self.user_translation)}\n\n"
-                f"Продолжайте выбирать!")
+        if not is_finished:
             await query.message.edit_text(safe_message, reply_markup=keyboard, parse_mode="MarkdownV2")
         else:
-            # Все слова выбраны, проверяем перевод
-            final_translation = ' '.join(self.user_translation).strip()
-            errors = self.find_errors(final_translation, self.current_sentence.translation_en)
-
-            result_message = GrammarLearner.escape_md_v2(
-                f"Исходное предложение: `{self.current_sentence.text_ru}`\n\n"
-                f"Ваш перевод: `{final_translation}`\n\n"
-                f"Правильный перевод: `{self.current_sentence.translation_en}`\n\n"
-                f"Результат: {errors}"
-            )
             await query.message.answer(result_message, parse_mode="MarkdownV2")
 
             # Дальше грузим следующее задание или останавливаемся
-            if self.mode.startswith("exam"):
-                self.current_sentence = None
-                self.user_translation.clear()
-                self.completed_words = 0
-                self.options = None
-                
-            else:
+            if not is_exam:
                 await self.load_next_question(query.message)
     async def start_default_mode(self, message: Message):
         """
         Стандартный режим игры.
         """
         await message.answer("Начало стандартного режима.")
-        self.mode = "default"
+        async with self.sessions.session(message.chat.id) as state:
+            state.mode = "default"
         await self.load_next_question(message)
 
     async def start_lesson_mode(self, message: Message, lesson_id: int):
@@ -173,7 +192,10 @@ class GrammarLearner:
         Учебный режим с фокусом на конкретные уроки.
         """
         await message.answer(f"Начало учебного режима по уроку №{lesson_id}.")
-        self.mode = f"lesson_{lesson_id}"  # Добавляем номер урока в режим
+        # Предложения урока компилируются заранее одним проходом
+        await run_in_db_thread(sentence_cache.warm_lesson, lesson_id)
+        async with self.sessions.session(message.chat.id) as state:
+            state.mode = f"lesson_{lesson_id}"  # Добавляем номер урока в режим
         await self.load_next_question(message)
 
     async def start_exam_mode(self, message: Message, exam_level: int):
@@ -181,6 +203,7 @@ class GrammarLearner:
         Экзаменационный режим с повышенной нагрузкой.
         """
         await message.answer(f"Начало экзаменационного режима на уровне {exam_level}.")
-        self.mode = f"exam:{exam_level}"  # Добавляем уровень экзамена в режим
+        async with self.sessions.session(message.chat.id) as state:
+            state.mode = f"exam:{exam_level}"  # Добавляем уровень экзамена в режим
         await self.load_next_question(message)
 
@@ -0,0 +1,356 @@
+"""
+Интервальное повторение слов (SM-2).
+
+Для каждой пары (пользователь, слово) хранится карточка: интервал, лёгкость,
+число правильных ответов подряд и время следующего повторения. Правильный
+ответ увеличивает интервал (1 день, 6 дней, затем интервал × лёгкость),
+ошибка сбрасывает серию и возвращает слово через ``REVIEW_RELEARN_DELAY``
+секунд, как в нулевой коробке Лейтнера.
+
+Колода пользователя загружается из ``review_cards`` один раз и хранится
+в памяти вместе с кучей (due, word_id), поэтому выбор следующего слова
+стоит O(log n) и не зависит от размера истории. Изменённые карточки
+копятся в буфере и записываются в базу пачкой, как метрики путаницы
+(см. ``db_layer.metric_buffer``), в том числе с отбрасыванием карточек,
+которые не записываются несколько сбросов подряд.
+
+Колоды кэшируются в памяти процесса, поэтому при нескольких процессах
+бота обновления одного пользователя должны обрабатываться одним процессом.
+"""
+import asyncio
+import heapq
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from db_layer.async_repository import run_in_db_thread
+from db_layer.batch_write import FLUSH_MAX_RETRIES, write_isolating
+from db_layer.repository import get_review_cards, upsert_review_cards
+from db_layer.word_pool import word_pool
+from learning_modules.sessions import SessionRegistry
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400.0
+MIN_EASE = 1.3
+DEFAULT_EASE = 2.5
+RELEARN_DELAY = float(os.getenv('REVIEW_RELEARN_DELAY', 60))
+
+# Оценки SM-2 (0–5) для ответа с вариантами
+GRADE_CORRECT = 4
+GRADE_WRONG = 1
+
+
+class Card:
+    """Карточка слова в колоде пользователя."""
+    __slots__ = ('word_id', 'interval', 'ease', 'repetitions', 'lapses', 'due')
+
+    def __init__(self, word_id: int, interval: float = 0.0, ease: float = DEFAULT_EASE,
+                 repetitions: int = 0, lapses: int = 0, due: float = 0.0):
+        self.word_id = word_id
+        self.interval = interval
+        self.ease = ease
+        self.repetitions = repetitions
+        self.lapses = lapses
+        self.due = due
+
+    def values(self) -> Tuple[float, float, int, int, float]:
+        """Состояние карточки для записи в базу."""
+        return self.interval, self.ease, self.repetitions, self.lapses, self.due
+
+
+def review(card: Card, grade: int, now: float) -> None:
+    """
+    Обновляет карточку по оценке ответа (0–5) по алгоритму SM-2.
+    Оценка ниже 3 считается ошибкой.
+    """
+    card.ease = max(MIN_EASE, card.ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    if grade < 3:
+        card.repetitions = 0
+        card.lapses += 1
+        card.interval = 0.0
+        card.due = now + RELEARN_DELAY
+        return
+    card.repetitions += 1
+    if card.repetitions == 1:
+        card.interval = 1.0
+    elif card.repetitions == 2:
+        card.interval = 6.0
+    else:
+        card.interval = card.interval * card.ease
+    card.due = now + card.interval * DAY
+
+
+class ReviewDeck:
+    """
+    Колода пользователя: карточки по word_id и куча (due, word_id).
+
+    При обновлении карточки в кучу добавляется новая запись, а старая
+    становится неактуальной и пропускается при выборке (её due не совпадает
+    с due карточки). Когда таких записей накапливается больше, чем карточек,
+    куча перестраивается.
+    """
+    __slots__ = ('cards', '_heap')
+
+    def __init__(self, cards: List[Card] = ()):
+        self.cards: Dict[int, Card] = {card.word_id: card for card in cards}
+        self._heap: List[Tuple[float, int]] = [(card.due, card.word_id) for card in self.cards.values()]
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    def _top(self) -> Optional[Card]:
+        heap = self._heap
+        while heap:
+            due, word_id = heap[0]
+            card = self.cards.get(word_id)
+            if card is not None and card.due == due:
+                return card
+            heapq.heappop(heap)
+        return None
+
+    def next_due(self, now: float) -> Optional[int]:
+        """Слово с самым ранним сроком, если срок наступил, иначе None."""
+        card = self._top()
+        return card.word_id if card is not None and card.due <= now else None
+
+    def earliest(self) -> Optional[int]:
+        """Слово с самым ранним сроком повторения (даже если срок не наступил)."""
+        card = self._top()
+        return card.word_id if card is not None else None
+
+    def due_count(self, now: float) -> int:
+        """Количество слов, которые пора повторить (O(n), только для сообщений и метрик)."""
+        return sum(1 for card in self.cards.values() if card.due <= now)
+
+    def answer(self, word_id: int, grade: int, now: float) -> Card:
+        """Записывает ответ по слову; новое слово добавляется в колоду."""
+        card = self.cards.get(word_id)
+        if card is None:
+            card = self.cards[word_id] = Card(word_id)
+        review(card, grade, now)
+        heapq.heappush(self._heap, (card.due, word_id))
+        if len(self._heap) > 2 * len(self.cards) + 16:
+            self._heap = [(card.due, card.word_id) for card in self.cards.values()]
+            heapq.heapify(self._heap)
+        return card
+
+
+class ReviewScheduler:
+    """
+    Колоды пользователей в памяти и буфер отложенной записи карточек.
+
+    Параметры:
+    ----------
+    max_decks : int
+        Сколько колод держать в памяти; давно неактивные вытесняются (LRU).
+    deck_ttl : float
+        Время простоя (в секундах), после которого колода выгружается.
+    max_pending : int
+        Количество изменённых карточек, после которого сброс запускается досрочно.
+    flush_interval : float
+        Максимальное время (в секундах) между сбросами.
+    new_word_attempts : int
+        Сколько случайных слов из пула проверить в поисках ещё не изученного.
+    max_retries : int
+        После скольких неудачных сбросов подряд пачка пишется по частям.
+    """
+
+    def __init__(self, max_decks: int = 10_000, deck_ttl: float = 3600.0,
+                 max_pending: int = 500, flush_interval: float = 5.0, new_word_attempts: int = 8,
+                 max_retries: int = 3):
+        self._decks: SessionRegistry[ReviewDeck] = SessionRegistry(
+            ReviewDeck, max_sessions=max_decks, idle_ttl=deck_ttl)
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.new_word_attempts = new_word_attempts
+        self.max_retries = max_retries
+        self._failed_in_row = 0
+        # Изменённые карточки по пользователям: user_id → {word_id: состояние}
+        self._pending: Dict[int, Dict[int, Tuple[float, float, int, int, float]]] = {}
+        self._pending_count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.reviews = 0
+        self.new_words = 0
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+
+    def _load_deck(self, user_id: int) -> ReviewDeck:
+        """Читает колоду из базы и накладывает ещё не записанные изменения (поток БД)."""
+        # Блокировка сброса: карточки, уже взятые из буфера, но ещё не записанные, не потеряются
+        with self._flush_lock:
+            rows = get_review_cards(user_id)
+            with self._lock:
+                pending = dict(self._pending.get(user_id, ()))
+        cards = {row[0]: row[1:] for row in rows}
+        cards.update(pending)
+        return ReviewDeck([Card(word_id, *values) for word_id, values in cards.items()])
+
+    async def deck(self, user_id: int) -> ReviewDeck:
+        """Колода пользователя; при первом обращении загружается в потоке БД."""
+        deck = self._decks.find(user_id)
+        if deck is None:
+            deck = await run_in_db_thread(self._load_deck, user_id)
+            # Пока колода загружалась, её мог загрузить другой обработчик
+            loaded = self._decks.find(user_id)
+            if loaded is not None:
+                return loaded
+            self._decks.put(user_id, deck)
+            self.loads += 1
+        return deck
+
+    def _pick_new(self, deck: ReviewDeck) -> Optional[int]:
+        """Случайное слово, которого ещё нет в колоде (поток БД: пул может перечитываться)."""
+        for word_id in word_pool.sample(self.new_word_attempts):
+            if word_id not in deck.cards:
+                return word_id
+        return None
+
+    async def next_word_id(self, user_id: int, now: Optional[float] = None) -> Optional[int]:
+        """
+        Следующее слово для повторения: самое просроченное слово колоды,
+        иначе новое слово, иначе слово с ближайшим сроком.
+        """
+        deck = await self.deck(user_id)
+        now = time.time() if now is None else now
+        word_id = deck.next_due(now)
+        if word_id is not None:
+            return word_id
+        word_id = await run_in_db_thread(self._pick_new, deck)
+        if word_id is not None:
+            self.new_words += 1
+            return word_id
+        return deck.earliest()
+
+    async def record(self, user_id: int, word_id: int, is_correct: bool, now: Optional[float] = None) -> Card:
+        """Записывает ответ пользователя; карточка попадает в буфер записи."""
+        deck = await self.deck(user_id)
+        now = time.time() if now is None else now
+        card = deck.answer(word_id, GRADE_CORRECT if is_correct else GRADE_WRONG, now)
+        self.reviews += 1
+        with self._lock:
+            user_pending = self._pending.setdefault(user_id, {})
+            if word_id not in user_pending:
+                self._pending_count += 1
+            user_pending[word_id] = card.values()
+            size = self._pending_count
+        if size >= self.max_pending:
+            self._request_flush()
+        return card
+
+    async def due_count(self, user_id: int, now: Optional[float] = None) -> int:
+        deck = await self.deck(user_id)
+        return deck.due_count(time.time() if now is None else now)
+
+    def _request_flush(self) -> None:
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        else:
+            # Фоновая задача не запущена (скрипты, отладка): пишем сразу
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Записывает изменённые карточки одной транзакцией.
+        При ошибке карточки возвращаются в буфер (более новые изменения не затираются);
+        после ``max_retries`` неудач подряд пачка пишется по частям,
+        а непишущиеся карточки отбрасываются.
+
+        Возвращает количество записанных карточек.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending, self._pending_count = self._pending, {}, 0
+            batch = {
+                (user_id, word_id): values
+                for user_id, cards in pending.items()
+                for word_id, values in cards.items()
+            }
+            if not batch:
+                return 0
+            try:
+                written = upsert_review_cards(batch)
+            except Exception:
+                self.failed_flushes += 1
+                self._failed_in_row += 1
+                if self._failed_in_row < self.max_retries:
+                    with self._lock:
+                        for (user_id, word_id), values in batch.items():
+                            user_pending = self._pending.setdefault(user_id, {})
+                            if word_id not in user_pending:
+                                user_pending[word_id] = values
+                                self._pending_count += 1
+                    raise
+                parts, dropped = write_isolating(upsert_review_cards, batch)
+                self.dropped_rows += len(dropped)
+                written = sum(parts)
+            self._failed_in_row = 0
+            self.flushes += 1
+            self.flushed_rows += written
+        return written
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await run_in_db_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Ошибка при сбросе карточек повторения: {e}", exc_info=True)
+
+    def start(self) -> None:
+        """Запускает фоновый сброс в текущем цикле событий."""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и записывает остаток буфера."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
+        self._wakeup = None
+        await run_in_db_thread(self.flush)
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики колод и буфера для метрик и отладки."""
+        return {
+            'decks': len(self._decks),
+            'loads': self.loads,
+            'reviews': self.reviews,
+            'new_words': self.new_words,
+            'pending': self._pending_count,
+            'flushed_rows': self.flushed_rows,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'dropped_rows': self.dropped_rows,
+        }
+
+
+review_scheduler = ReviewScheduler(
+    max_decks=int(os.getenv('REVIEW_MAX_DECKS', 10_000)),
+    deck_ttl=float(os.getenv('REVIEW_DECK_TTL', 3600)),
+    max_pending=int(os.getenv('REVIEW_FLUSH_SIZE', 500)),
+    flush_interval=float(os.getenv('REVIEW_FLUSH_INTERVAL', 5.0)),
+    max_retries=FLUSH_MAX_RETRIES,
+)
@@ -0,0 +1,195 @@
+"""
+Игровые сессии пользователей.
+
+Состояние каждой игры хранится отдельно для каждого чата в маленьком
+объекте со ``__slots__``. Реестр сессий вытесняет давно неактивные
+сессии (idle TTL) и самые старые при превышении лимита (LRU),
+поэтому память процесса ограничена при любом числе пользователей.
+
+Игры работают с сессиями через ``GameSessions``, который обращается
+к выбранному хранилищу из ``cache_system.session_backend``.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+class WordState:
+    """Состояние тренировки слов в чате."""
+    __slots__ = ('word_id', 'word_text', 'direction', 'options', 'option_ids', 'correct_index', 'mode', 'number')
+
+    def __init__(self):
+        self.word_id: Optional[int] = None
+        self.word_text: Optional[str] = None   # Загаданное слово в показанном пользователю виде
+        self.direction: Optional[str] = None
+        self.options: Tuple[str, ...] = ()
+        self.option_ids: Tuple[int, ...] = ()
+        self.correct_index: Optional[int] = None
+        self.mode: Optional[str] = None
+        self.number: Optional[int] = None
+
+
+class GrammarState:
+    """Состояние грамматического тренажёра в чате."""
+    __slots__ = ('sentence_id', 'text_ru', 'translation_en', 'user_translation',
+                 'options', 'total_words_count', 'completed_words', 'mode')
+
+    def __init__(self):
+        self.sentence_id: Optional[int] = None
+        self.text_ru: Optional[str] = None
+        self.translation_en: Optional[str] = None
+        self.user_translation: List[str] = []
+        self.options: Tuple[str, ...] = ()
+        self.total_words_count = 0
+        self.completed_words = 0
+        self.mode = ""
+
+
+class SynonymState:
+    """Состояние игры в синонимы и антонимы в чате."""
+    __slots__ = ('word_id', 'relation_type', 'options', 'correct_option_index', 'display_language')
+
+    def __init__(self):
+        self.word_id: Optional[int] = None
+        self.relation_type: Optional[str] = None
+        self.options: Tuple[str, ...] = ()
+        self.correct_option_index: Optional[int] = None
+        self.display_language: Optional[str] = None
+
+
+class FlashcardState:
+    """Прогресс пользователя в игре с карточками."""
+    __slots__ = ('proposal', 'current_word_idx', 'selected_words', 'total_attempts', 'correct_answers', 'options')
+
+    def __init__(self):
+        self.proposal: Optional[str] = None
+        self.current_word_idx = 0
+        self.selected_words: List[str] = []
+        self.total_attempts = 0
+        self.correct_answers = 0
+        self.options: List[str] = []
+
+
+class SessionRegistry(Generic[T]):
+    """
+    Реестр сессий с вытеснением по LRU и по времени простоя.
+
+    Параметры:
+    ----------
+    factory : Callable[[], T]
+        Создаёт состояние новой сессии.
+    max_sessions : int
+        Максимальное число живых сессий; при превышении вытесняется самая старая.
+    idle_ttl : float
+        Время простоя (в секундах), после которого сессия удаляется.
+    """
+
+    def __init__(self, factory: Callable[[], T], max_sessions: int = 50_000, idle_ttl: float = 3600.0):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        # Порядок ключей — порядок последнего обращения, самые старые в начале
+        self._sessions: "OrderedDict[Hashable, Tuple[T, float]]" = OrderedDict()
+        self.created = 0
+        self.evicted_lru = 0
+        self.evicted_idle = 0
+
+    def get(self, key: Hashable) -> T:
+        """Возвращает сессию, создавая её при необходимости."""
+        state = self.find(key)
+        if state is None:
+            state = self.factory()
+            self.created += 1
+            self._sessions[key] = (state, time.monotonic())
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted_lru += 1
+        return state
+
+    def put(self, key: Hashable, state: T) -> None:
+        """Сохраняет готовое состояние под ключом (например, загруженное из базы)."""
+        self._sessions.pop(key, None)
+        self._sessions[key] = (state, time.monotonic())
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted_lru += 1
+
+    def find(self, key: Hashable) -> Optional[T]:
+        """Возвращает существующую сессию (продлевая её) или None."""
+        now = time.monotonic()
+        self.evict_idle(now)
+        entry = self._sessions.pop(key, None)
+        if entry is None:
+            return None
+        self._sessions[key] = (entry[0], now)
+        return entry[0]
+
+    def drop(self, key: Hashable) -> None:
+        """Завершает сессию."""
+        self._sessions.pop(key, None)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Удаляет сессии, простаивающие дольше idle_ttl. Возвращает их число."""
+        deadline = (time.monotonic() if now is None else now) - self.idle_ttl
+        evicted = 0
+        while self._sessions:
+            _, (_, last_seen) = next(iter(self._sessions.items()))
+            if last_seen >= deadline:
+                break
+            self._sessions.popitem(last=False)
+            evicted += 1
+        self.evicted_idle += evicted
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики реестра для метрик и отладки."""
+        return {
+            'live': len(self._sessions),
+            'max_sessions': self.max_sessions,
+            'created': self.created,
+            'evicted_lru': self.evicted_lru,
+            'evicted_idle': self.evicted_idle,
+        }
+
+
+class GameSessions:
+    """
+    Сессии одной игры в текущем хранилище (память процесса или Redis).
+
+    Использование::
+
+        async with word_sessions.session(chat_id) as state:
+            ...  # изменения state сохраняются при выходе из блока
+    """
+
+    def __init__(self, kind: str, factory: Callable[[], T]):
+        self.kind = kind
+        self.factory = factory
+
+    def session(self, key: Hashable, create: bool = True):
+        """
+        Открывает сессию чата. При create=False отсутствующая сессия
+        не создаётся, и в блок передаётся None.
+        """
+        from cache_system.session_backend import get_session_backend
+        return get_session_backend().session(self.kind, key, self.factory, create)
+
+    async def drop(self, key: Hashable) -> None:
+        """Завершает сессию чата."""
+        from cache_system.session_backend import get_session_backend
+        await get_session_backend().drop(self.kind, key)
+
+
+SESSION_MAX = int(os.getenv('SESSION_MAX', 50_000))
+SESSION_TTL = float(os.getenv('SESSION_TTL', 3600))
+
+
+def create_registry(factory: Callable[[], T]) -> SessionRegistry[T]:
+    """Реестр с лимитами из переменных окружения SESSION_MAX и SESSION_TTL."""
+    return SessionRegistry(factory, max_sessions=SESSION_MAX, idle_ttl=SESSION_TTL)
@@ -4,110 +4,131 @@ import logging
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.types import Message, CallbackQuery
 
-from db_layer.models import Word
-from db_layer.repository import get_random_relation_pair, get_random_words
+from bot_core.callbacks import CallbackAction
+from db_layer.answer_log import answer_log
+from db_layer.async_repository import run_in_db_thread
+from db_layer.confusion_index import HARD_DISTRACTORS, confusion_index
+from db_layer.normalizer import normalize_text
+from db_layer.relation_index import WordRef, relation_index
+from learning_modules.sessions import GameSessions, SynonymState
 
 logging.basicConfig(level=logging.DEBUG)
 
+# Выбор варианта ответа
+SYNONYM_ANSWER = CallbackAction('synonym_answer', 'sa', (('option', int), ))
+
 class GameResponse(NamedTuple):
     text: Optional[str]
     keyboard: Optional[InlineKeyboardMarkup]
     
 class SynonymAntonymGame:
     def __init__(self):
-        self.current_word = None
-        self.relation_type = None
-        self.options = []
-        self.display_language = None  # Основной язык отображаемого слова
-        self.related_word = None      # Связанное слово из таблицы relations
+        # Состояние игры (слово, тип связи, варианты) хранится отдельно для каждого чата
+        self.sessions = GameSessions("synonyms", SynonymState)
 
-    def reset_game(self):
+    def reset_game(self, state: SynonymState):
         """Сбрасываем состояние игры."""
-        self.current_word = None
-        self.relation_type = None
-        self.options.clear()
-        self.display_language = None
-        self.related_word = None
+        state.word_id = None
+        state.relation_type = None
+        state.options = ()
+        state.correct_option_index = None
+        state.display_language = None
 
-    def next_question(self) -> bool:
+    async def next_question(self) -> Optional[Tuple]:
         """
         Получение следующей случайной пары слов и типа связи.
-        Возвращает True, если найдена новая пара, иначе False.
+        Возвращает (исходное слово, тип связи, связанное слово) или None, если пар нет.
+        Пара берётся из индекса связей в памяти; база читается только
+        при перезагрузке устаревшего индекса.
         """
-        pair = get_random_relation_pair()
-        if pair is None:
-            return False
-        self.current_word, self.relation_type, self.related_word = pair
-        return True
+        if relation_index.is_stale():
+            await run_in_db_thread(relation_index.snapshot)
+        return relation_index.random_pair()
 
     def normalize_answer(self, answer: str) -> str:
         """
         Приводит ответ пользователя к нормализованной форме: удаляются символы пунктуации, лишние пробелы и производится переход в нижний регистр.
         """
-        cleaned_answer = ''.join(char for char in answer if char.isalpha() or char.isspace())
-        return cleaned_answer.lower().strip()
+        return normalize_text(answer)
 
-    def check_answer(self, user_answer: str) -> bool:
+    def check_answer(self, state: SynonymState, user_answer: str) -> bool:
         """
         Проверяет, соответствует ли введённый пользователем ответ правильному варианту.
         """
         normalized_answer = self.normalize_answer(user_answer)
-        expected_answer = self.normalize_answer(self.options[self.correct_option_index])
+        expected_answer = self.normalize_answer(state.options[state.correct_option_index])
         return normalized_answer == expected_answer
 
-    def generate_options(self) -> List[str]:
+    async def generate_options(self, state: SynonymState, related_word: WordRef) -> List[str]:
         """
         Формирует четыре варианта ответов: три неправильных и один правильный.
         Правильный ответ определяется на основе связи в таблице relations.
         """
-        if self.current_word is None or self.relation_type is None:
+        if state.word_id is None or state.relation_type is None:
             return []
 
         # Основной язык текущего слова
-        main_lang = "russian" if self.display_language == "russian" else "english"
+        main_lang = "russian" if state.display_language == "russian" else "english"
         opposite_lang = "english" if main_lang == "russian" else "russian"
 
         # Определение правильного ответа на основе связи
-        correct_answer = getattr(self.related_word, opposite_lang + "_word")
+        correct_answer = getattr(related_word, opposite_lang + "_word")
 
         # Неправильные варианты
-        wrong_words = self.get_incorrect_options(opposite_lang)
+        wrong_words = await self.get_incorrect_options(state.word_id, opposite_lang, exclude_texts=(correct_answer,),
+                                                       confusable_with=related_word.id)
         incorrect_options = [getattr(word, opposite_lang + "_word") for word in wrong_words[:3]]
 
         # Добавляем правильный ответ среди прочих
         all_options = incorrect_options + [correct_answer]
         random.shuffle(all_options)
         # Индексируем позицию правильного ответа
-        self.correct_option_index = all_options.index(correct_answer)
+        state.correct_option_index = all_options.index(correct_answer)
         return all_options
 
-    def get_incorrect_options(self, lang: str) -> List['Word']:
+    async def get_incorrect_options(self, exclude_word_id: int, lang: str,
+                                    exclude_texts: Tuple[str, ...] = (),
+                                    confusable_with: Optional[int] = None) -> List[WordRef]:
         """
-        Получает три случайных слова, отличающихся от текущего слова и находящихся на указанном языке.
+        Получает три случайных слова на указанном языке, не связанных с текущим словом
+        никакой связью и не совпадающих по тексту с правильным ответом.
+        Если задан ``confusable_with`` (правильный ответ), часть вариантов берётся
+        из слов, с которыми его чаще всего путают.
         """
-        wrong_words = get_random_words(exclude_word_id=self.current_word.id)
-        # Отфильтруем слова на указанный язык
-        filtered_words = [word for word in wrong_words if getattr(word, lang + "_word")]
-        return filtered_words[:3]
+        hard_ids = ()
+        if confusable_with is not None:
+            if confusion_index.is_stale():
+                await run_in_db_thread(confusion_index.snapshot)
+            hard_ids = confusion_index.hard_distractors(confusable_with, HARD_DISTRACTORS)
+        return relation_index.distractors(exclude_word_id, 3, lang, exclude_texts=exclude_texts, preferred=hard_ids)
 
-    def get_current_task(self) -> Optional[Tuple]:
+    async def get_current_task(self, state: SynonymState) -> Optional[Tuple]:
         """
-        Возвращает текущее задание (слово, тип связи и варианты ответов).
+        Подбирает новое задание и возвращает его (слово, тип связи и варианты ответов).
         """
-        if self.current_word is None:
-            found_new = self.next_question()
-            if not found_new:
+        for _ in range(3):
+            pair = await self.next_question()
+            if pair is None:
                 return None
+            current_word, relation_type, related_word = pair
+            # Пара и смежность берутся из индекса по отдельности: если он перечитался
+            # между обращениями, пара без такой связи пропускается
+            if related_word.id in relation_index.related_ids(current_word.id, relation_type):
+                break
+        else:
+            return None
+        state.relation_type = relation_type
+        state.word_id = current_word.id
         # Случайно определяем основной язык
         languages = ["russian", "english"]
-        self.display_language = random.choice(languages)
+        state.display_language = random.choice(languages)
         displayed_word = (
-            self.current_word.russian_word
-            if self.display_language == "russian"
-            else self.current_word.english_word
+            current_word.russian_word
+            if state.display_language == "russian"
+            else current_word.english_word
         )
-        self.options = self.generate_options()
-        return displayed_word, self.relation_type, self.options
+        state.options = tuple(await self.generate_options(state, related_word))
+        return displayed_word, state.relation_type, list(state.options)
 
     def create_keyboard(self, options: List[str]) -> InlineKeyboardMarkup:
         """
@@ -115,7 +136,7 @@ class SynonymAntonymGame:
         """
         buttons = []
         for i, option in enumerate(options):
-            btn = InlineKeyboardButton(text=option, callback_data=f'sa_{i}')
+            btn = InlineKeyboardButton(text=option, callback_data=SYNONYM_ANSWER.pack(option=i))
             buttons.append(btn)
         rows = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
         keyboard = InlineKeyboardMarkup(inline_keyboard=rows)
@@ -126,8 +147,9 @@ class SynonymAntonymGame:
         """
         Начинает игровую сессию.
         """
-        self.reset_game()
-        task = self.get_current_task()
+        async with self.sessions.session(message.chat.id) as state:
+            self.reset_game(state)
+            task = await self.get_current_task(state)
         if task is None:
             await message.answer("Нет слов для изучения.")
             return
@@ -136,25 +158,34 @@ class SynonymAntonymGame:
         prompt = f"<b>{displayed_word}</b>\nТип связи: {relation_type}\nВыберите правильное слово:"
         keyboard = self.create_keyboard(options)
         await message.answer(prompt, reply_markup=keyboard, parse_mode='HTML')
-    async def handle_callback(self, query: CallbackQuery):
-        """Обрабатывает выбор пользователя и проверяет его ответ."""
-        _, idx_str = query.data.split('_')
-        option_idx = int(idx_str)
-        user_answer = self.options[option_idx]
-        is_correct = self.check_answer(user_answer)
+    async def handle_callback(self, query: CallbackQuery, option: int):
+        """Обрабатывает выбор пользователя (option — номер варианта) и проверяет его ответ."""
+        option_idx = option
+        async with self.sessions.session(query.message.chat.id, create=False) as state:
+            is_stale = state is None or state.correct_option_index is None or option_idx >= len(state.options)
+            if not is_stale:
+                user_answer = state.options[option_idx]
+                is_correct = self.check_answer(state, user_answer)
+                correct_answer = state.options[state.correct_option_index]
+                answer_log.add(query.from_user.id, "synonyms", state.word_id, is_correct)
+
+                # Немедленно переходим к следующему заданию
+                self.reset_game(state)                 # Сброс состояния игры
+                next_task = await self.get_current_task(state)  # Получаем новое задание
+
+        if is_stale:
+            await query.answer("Задание устарело. Начните игру заново.", show_alert=True)
+            return
 
         if is_correct:
             await query.answer("Верно! Отличная работа!", show_alert=True)
         else:
-            await query.answer(f"Неверно. Правильный ответ: {self.options[self.correct_option_index]}.", show_alert=True)
+            await query.answer(f"Неверно. Правильный ответ: {correct_answer}.", show_alert=True)
 
-        # Немедленно переходим к следующему заданию
-        self.reset_game()                 # Сброс состояния игры
-        next_task = self.get_current_task()  # Получаем новое задание
         if next_task:
             displayed_word, relation_type, options = next_task
             prompt = f"<b>{displayed_word}</b>\\nТип связи: {relation_type}\\nВыберите правильное слово:"
             keyboard = self.create_keyboard(options)
             await query.message.edit_text(prompt, reply_markup=keyboard, parse_mode='HTML')
         else:
-            await query.message.answer("Игра закончена. Все слова изучены!")
+            await query.message.answer("Игра закончена. Все слова изучены!")
\ No newline at end of file
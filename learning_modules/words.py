@@ -4,136 +4,113 @@ import logging
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.types import Message, CallbackQuery
 
-from db_layer.repository import (
-    get_random_words, get_single_random_word, get_single_random_word_from_lesson,
-    add_or_update_metric_value, find_word_by_text
-)
+from bot_core.callbacks import CallbackAction
+from db_layer.async_repository import build_word_question
+from db_layer.metric_buffer import metric_buffer
+from db_layer.normalizer import normalize_text
+from learning_modules.repetition import review_scheduler
+from learning_modules.sessions import GameSessions, WordState
 
 logging.basicConfig(level=logging.DEBUG)
 
+# Выбор режима: sd — обычный, st — по уроку (без номера урока — выбор урока), se — экзамен,
+# sr — интервальное повторение
+WORDS_MODE = CallbackAction('words_mode', 'wm', (('mode', str), ('lesson', int)))
+# Ответ на вопрос: номер варианта, режим игры и урок, по которому задан вопрос
+WORDS_ANSWER = CallbackAction('words_answer', 'wa', (('option', int), ('mode', str), ('lesson', int)))
+
 class GameResponse(NamedTuple):
     text: Optional[str]
     keyboard: Optional[InlineKeyboardMarkup]
 
 class WordLearner:
     def __init__(self):
-        self.current_word = None
-        self.translation_direction = None
-        self.options = None
-        self.mode = None
-        self.number = None
+        # Состояние игры хранится отдельно для каждого чата
+        self.sessions = GameSessions("words", WordState)
 
-    def reset_game(self):
+    def reset_game(self, state: WordState):
         """Сбрасываем игру для начала заново."""
-        self.current_word = None
-        self.translation_direction = None
-        self.options = None
+        state.word_id = None
+        state.word_text = None
+        state.direction = None
+        state.options = ()
+        state.option_ids = ()
+        state.correct_index = None
 
-    def next_word(self, lesson_num: Optional[int] = None) -> bool:
+    async def next_word(self, state: WordState, lesson_num: Optional[int] = None,
+                        word_id: Optional[int] = None) -> bool:
         """
-        Получение следующего слова из базы данных.
+        Получение следующего слова вместе с вариантами ответа.
 
         Параметры:
+            state (WordState): Состояние игры в чате.
             lesson_num (Optional[int]): Номер урока для ограничения поиска.
+            word_id (Optional[int]): Загадать конкретное слово (режим повторения).
 
         Возвращает:
             bool: True, если найдено новое слово, иначе False.
         """
         try:
-            if lesson_num is None:
-                self.current_word = get_single_random_word()
-            else:
-                self.current_word = get_single_random_word_from_lesson(lesson_num)
-            return self.current_word is not None
+            question = await build_word_question(lesson_num, word_id=word_id)
         except Exception as e:
             logging.error(f"Ошибка при получении нового слова: {e}")
             return False
+        if question is None:
+            state.word_id = None
+            return False
+        word = question.word
+        state.word_id = word.id
+        state.word_text = word.english_word if question.direction == "en->ru" else word.russian_word
+        state.direction = question.direction
+        state.option_ids = tuple(word_id for word_id, _ in question.options)
+        state.options = tuple(text for _, text in question.options)
+        state.correct_index = question.correct_index
+        return True
 
     def normalize_answer(self, answer: str) -> str:
         """
         Нормализует ответ пользователя: удаляет лишние пробелы, знаки препинания и преобразует в нижний регистр.
         """
-        cleaned_answer = ''.join(char for char in answer if char.isalpha() or char.isspace())
-        return cleaned_answer.strip().lower()
+        return normalize_text(answer)
 
     
-    def check_answer(self, user_answer: str) -> bool:
+    async def check_answer(self, state: WordState, option_idx: int) -> bool:
         """
-        Проверяет правильность ответа пользователя и обновляет метрику согласно выбранной стратегии.
+        Проверяет выбранный вариант ответа и обновляет метрику путаницы слов.
+        Варианты хранятся вместе с id слов, поэтому повторный поиск по тексту не нужен.
         """
-        # Нормализуем ответ пользователя
-        normalized_answer = self.normalize_answer(user_answer)
-        # Подготавливаем ожидаемый ответ
-        expected_answer = self.normalize_answer(
-            self.current_word.english_word if self.translation_direction == "ru->en" else self.current_word.russian_word
-        )
-
-        # Сравниваем ответ пользователя с правильным ответом
-        is_correct = normalized_answer == expected_answer
-
-        # Находим правильные и неправильные слова
-        correct_word = find_word_by_text(expected_answer)
-        incorrect_word = find_word_by_text(normalized_answer)
-
-        # Начало обработки результатов
-        if not is_correct and correct_word and incorrect_word and correct_word.id != incorrect_word.id:
-            # Неправильный ответ: добавляем или обновляем связь между правильным и неправильным ответом
-            add_or_update_metric_value(correct_word.id, incorrect_word.id)
-
+        is_correct = option_idx == state.correct_index
+        if not is_correct:
+            # Неправильный ответ: связь между правильным и неправильным ответом
+            # копится в буфере и записывается в базу пачкой
+            metric_buffer.add(state.word_id, state.option_ids[option_idx])
         return is_correct
 
+    async def record_review(self, user_id: int, word_id: int, is_correct: bool) -> None:
+        """Записывает ответ в режиме повторения: переносит срок повторения слова."""
+        await review_scheduler.record(user_id, word_id, is_correct)
 
-
-
-
-    def generate_options(self) -> List[str]:
-        """
-        Формирует варианты ответов, включая правильный и три неправильных варианта.
-        Устанавливает случайное направление перевода.
-        """
-        self.translation_direction = random.choice(["en->ru", "ru->en"])
-        correct_answer = (
-            self.current_word.english_word if self.translation_direction == "ru->en" else self.current_word.russian_word
-        )
-        wrong_words = self.get_incorrect_options(self.current_word.id)
-        options = [correct_answer] + wrong_words[:3]
-        random.shuffle(options)
-        return options
-
-    def get_incorrect_options(self, exclude_word_id: int) -> List[str]:
-        """
-        Получает три случайных слова из базы данных, кроме указанного.
-        Исключает совпадения с правильным ответом.
-        """
-        random_words = get_random_words(exclude_word_id)
-        filtered_words = [
-            w.english_word if self.translation_direction == "ru->en" else w.russian_word
-            for w in random_words
-        ]
-        return filtered_words
-
-    def get_current_task(self, lesson_num: Optional[int] = None) -> Optional[Tuple]:
+    async def get_current_task(self, state: WordState, lesson_num: Optional[int] = None,
+                               word_id: Optional[int] = None) -> Optional[Tuple]:
         """
         Возвращает текущее задание или None, если слов больше нет.
-        Может ограничивать слова определенным уроком.
+        Может ограничивать слова определенным уроком или загадывать заданное слово.
         """
-        if self.current_word is None:
-            if not self.next_word(lesson_num):
+        if state.word_id is None:
+            if not await self.next_word(state, lesson_num, word_id):
                 return None
-        self.options = self.generate_options()
-        return self.current_word, self.options, self.translation_direction
+        return state.word_text, list(state.options), state.direction
 
-    def create_keyboard(self, options: list):
+    def create_keyboard(self, state: WordState, options: list):
         """
         Генерирует клавиатуру с вариантами ответов в виде матрицы 2x2.
-        Перемешиваем варианты, чтобы правильный ответ располагался случайно.
+        Варианты уже перемешаны при сборке вопроса.
         """
-        random.shuffle(options)
         buttons = []
         for i in range(0, len(options), 2):
             row_buttons = []
             for j in range(i, min(i+2, len(options))):
-                button = InlineKeyboardButton(text=options[j], callback_data=f"answer_wl_{j}_{self.mode}_{self.number}")
+                button = InlineKeyboardButton(text=options[j], callback_data=WORDS_ANSWER.pack(option=j, mode=state.mode, lesson=state.number))
                 row_buttons.append(button)
             buttons.append(row_buttons)
         keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -145,18 +122,19 @@ class WordLearner:
         """
         Старт стандартного режима игры со случайными словами.
         """
-        self.reset_game()
-        self.mode = "default"
-        task = self.get_current_task()
+        async with self.sessions.session(message.chat.id) as state:
+            self.reset_game(state)
+            state.mode = "default"
+            task = await self.get_current_task(state)
+            keyboard = self.create_keyboard(state, task[1]) if task else None
         if task is None:
             await message.answer("Нет слов для изучения.")
             return
-        word, options, direction = task
+        word_text, options, direction = task
         title = "<b>Слово:</b>" if direction == "en->ru" else "<b>Перевод:</b>"
         prompt = "Какой перевод?" if direction == "en->ru" else "Английское слово?"
-        keyboard = self.create_keyboard(options)
         await message.answer(
-            f"{title} {word.english_word if direction == 'en->ru' else word.russian_word}\n{prompt}",
+            f"{title} {word_text}\n{prompt}",
             reply_markup=keyboard,
             parse_mode="HTML",
         )
@@ -166,19 +144,20 @@ class WordLearner:
         """
         Запуск учебного режима по указанному уроку.
         """
-        self.reset_game()
-        self.mode = "lesson"
-        self.number = lesson_num
-        task = self.get_current_task(lesson_num)
+        async with self.sessions.session(message.chat.id) as state:
+            self.reset_game(state)
+            state.mode = "lesson"
+            state.number = lesson_num
+            task = await self.get_current_task(state, lesson_num)
+            keyboard = self.create_keyboard(state, task[1]) if task else None
         if task is None:
             await message.answer("Нет слов для изучаемого урока.")
             return
-        word, options, direction = task
+        word_text, options, direction = task
         title = "<b>Слово:</b>" if direction == "en->ru" else "<b>Перевод:</b>"
         prompt = "Какой перевод?" if direction == "en->ru" else "Английское слово?"
-        keyboard = self.create_keyboard(options)
         await message.answer(
-            f"{title} {word.english_word if direction == 'en->ru' else word.russian_word}\n{prompt}",
+            f"{title} {word_text}\n{prompt}",
             reply_markup=keyboard,
             parse_mode="HTML",
         )
@@ -187,19 +166,45 @@ class WordLearner:
         """
         Экзаменационный режим. Генерация единственного задания и возврат управления.
         """
-        self.reset_game()
-        task = self.get_current_task()
+        async with self.sessions.session(message.chat.id) as state:
+            self.reset_game(state)
+            state.mode = "exam"
+            task = await self.get_current_task(state)
+            keyboard = self.create_keyboard(state, task[1]) if task else None
         if task is None:
             await message.answer("Нет слов для экзамена.")
             return
-        word, options, direction = task
+        word_text, options, direction = task
         title = "<b>Слово:</b>" if direction == "en->ru" else "<b>Перевод:</b>"
         prompt = "Какой перевод?" if direction == "en->ru" else "Английское слово?"
-        keyboard = self.create_keyboard(options)
         await message.answer(
-            f"{title} {word.english_word if direction == 'en->ru' else word.russian_word}\n{prompt}",
+            f"{title} {word_text}\n{prompt}",
             reply_markup=keyboard,
             parse_mode="HTML",
         )
-        
 
+    async def start_review_mode(self, message: Message, user_id: int):
+        """
+        Режим интервального повторения: загадывается слово, срок повторения
+        которого наступил раньше всех, а если таких нет — новое слово.
+        Колода карточек — своя у каждого пользователя (``user_id`` — Telegram id
+        пользователя), сессия игры — общая для чата.
+        """
+        word_id = await review_scheduler.next_word_id(user_id)
+        async with self.sessions.session(message.chat.id) as state:
+            self.reset_game(state)
+            state.mode = "review"
+            state.number = None
+            task = await self.get_current_task(state, word_id=word_id) if word_id is not None else None
+            keyboard = self.create_keyboard(state, task[1]) if task else None
+        if task is None:
+            await message.answer("Нет слов для повторения.")
+            return
+        word_text, options, direction = task
+        title = "<b>Слово:</b>" if direction == "en->ru" else "<b>Перевод:</b>"
+        prompt = "Какой перевод?" if direction == "en->ru" else "Английское слово?"
+        await message.answer(
+            f"{title} {word_text}\n{prompt}",
+            reply_markup=keyboard,
+            parse_mode="HTML",
+        )
@@ -1,93 +1,56 @@
 from aiogram.types import Message
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from db_layer.models import Pages, SessionLocal
-from db_layer.repository import get_pages_by_lesson, get_page_info, get_lessons_from_db
+from lessons.navigation import LessonGraph, get_lesson_graph, is_lesson_graph_stale
 from aiogram.types import CallbackQuery
+from db_layer.async_repository import run_in_db_thread
+from learning_modules.grammar import GRAMMAR_MODE
+from learning_modules.words import WORDS_MODE
+from lessons.content import lesson_content
+from lessons.keyboards import LESSONS, PAGE, PAGES, lesson_keyboards
+
+async def _lesson_graph() -> LessonGraph:
+    """Граф навигации; устаревший граф перестраивается в потоке БД, а не в цикле событий."""
+    if is_lesson_graph_stale():
+        return await run_in_db_thread(get_lesson_graph)
+    return get_lesson_graph()
 
 class CallbackLessons:
-    async def select_lesson_pages(callback: CallbackQuery):
+    async def select_lesson_pages(callback: CallbackQuery, lesson: int):
         """Обрабатывает выбор урока"""
-        lesson_id = int(callback.data.split('_')[1])
-        pages = await get_pages_by_lesson(lesson_id)
-        page_buttons = []
-        for page in pages:
-            button_text = f"{page.name_page}"  # Номер страницы находится в классе Page
-            callback_data = f"page_{page.id}"
-            page_buttons.append([InlineKeyboardButton(text=button_text, callback_data=callback_data)])
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=page_buttons)
+        keyboard = await lesson_keyboards.get(PAGES, lesson=lesson)
+        if keyboard is None:
+            await callback.message.edit_text("В уроке пока нет страниц.")
+            return
         await callback.message.edit_text("Выберите страницу урока:", reply_markup=keyboard)
 
-    async def send_page_content(callback: CallbackQuery):
+    async def send_page_content(callback: CallbackQuery, page: int):
         """Отправка содержимого выбранной страницы"""
-        page_id = int(callback.data.split('_')[1])
+        page_id = page
         
-        # Получаем информацию о странице урока
-        page_info = await get_page_info(page_id)
+        # Соседние страницы уже посчитаны в графе навигации, запросы к БД не нужны
+        page = (await _lesson_graph()).page(page_id)
         
-        if not page_info:
+        if not page:
             await callback.message.edit_text("Страница не найдена!")
             return
-            
-        num_message = page_info.num_message  # Предполагается, что страница хранит номер сообщения
-        chat_id = "@SpravEnglish"  # Chat ID канала, откуда берётся сообщение
-        
-        # Получаем общую информацию о странице
-        lesson = await get_page_info(page_id)
-        if not lesson:
-            await callback.message.edit_text("Ошибка: страница не найдена.")
-            return
-        
-        # Получаем общий список страниц урока
-        all_pages = await get_pages_by_lesson(lesson.num_lesson)
-        all_lessons = await get_lessons_from_db()
-        total_pages = len(all_pages)
-        total_lesson = len(all_lessons)
-        
+
         # Формируем клавиатуру с кнопками навигации
         navigation_buttons = []
         
         # Кнопка << Назад
-        if lesson.num_page > 0:
-            prev_page = all_pages[lesson.num_page - 1]
-        else:
-            if lesson.num_lesson > 1:
-                previous_lesson_pages = await get_pages_by_lesson(lesson.num_lesson - 1)
-                if previous_lesson_pages:
-                    prev_page = previous_lesson_pages[-1]
-                else:
-                    prev_page = None
-            else:
-                prev_page = None
-        if prev_page is not None:
-            navigation_buttons.append([InlineKeyboardButton(text="<< Предыдущая страница", callback_data=f"page_{prev_page.id}")])
-        navigation_buttons.append([InlineKeyboardButton(text="Тренировка лексики", callback_data=f"wl_st_{lesson.num_lesson}")])
-        navigation_buttons.append([InlineKeyboardButton(text="Тренировка грамматики", callback_data=f"gl_st_{lesson.num_lesson}")])
+        if page.prev_id is not None:
+            navigation_buttons.append([InlineKeyboardButton(text="<< Предыдущая страница", callback_data=PAGE.pack(page=page.prev_id))])
+        navigation_buttons.append([InlineKeyboardButton(text="Тренировка лексики", callback_data=WORDS_MODE.pack(mode="st", lesson=page.num_lesson))])
+        navigation_buttons.append([InlineKeyboardButton(text="Тренировка грамматики", callback_data=GRAMMAR_MODE.pack(mode="st", lesson=page.num_lesson))])
         # Кнопка Следующая страница
-        if lesson.num_page < total_pages - 1:
-            next_page = all_pages[lesson.num_page + 1]
-        else:
-            if lesson.num_lesson < total_lesson - 1:
-                next_lesson_pages = await get_pages_by_lesson(lesson.num_lesson + 1)
-                if next_lesson_pages:
-                    next_page = next_lesson_pages[0]
-                else:
-                    next_page = None
-            else:
-                next_page = None
-        if next_page is not None:
-            navigation_buttons.append([InlineKeyboardButton(text="Следующая страница >>", callback_data=f"page_{next_page.id}")])
+        if page.next_id is not None:
+            navigation_buttons.append([InlineKeyboardButton(text="Следующая страница >>", callback_data=PAGE.pack(page=page.next_id))])
         
         # Создаем клавиатуру с кнопками
         navigation_markup = InlineKeyboardMarkup(inline_keyboard=navigation_buttons)
         
-        # Копируем сообщение с нужной клавиатурой
-        await callback.bot.copy_message(
-            chat_id=callback.message.chat.id,
-            from_chat_id=chat_id,
-            message_id=num_message,
-            reply_markup=navigation_markup
-        )
+        # Отправляем страницу из локального снимка поста с нужной клавиатурой
+        await lesson_content.send(callback.bot, callback.message.chat.id, page, navigation_markup)
 
 
 
@@ -96,19 +59,13 @@ class CallbackLessons:
         
 class ChooseLessons:
     def __init__(self):
-        self.session = SessionLocal()
         self.lessons = []
         self.current_lesson = None
         self.current_page = 1
 
     def fetch_lessons(self):
         """Загрузка списка уроков из базы данных"""
-        self.lessons = (
-            self.session.query(Pages.num_lesson.distinct())
-            .order_by(Pages.num_lesson)
-            .all()
-        )
-        self.lessons = [item[0] for item in self.lessons]
+        self.lessons = list(get_lesson_graph().lessons)
 
     def generate_lesson_list(self):
         """Создание разметки клавиш для выбора урока"""
@@ -122,18 +79,12 @@ class ChooseLessons:
         """Выбор урока и настройка первой страницы"""
         self.current_lesson = lesson_number
         self.current_page = 1
-        pages_exist = self.session.query(Pages).filter_by(num_lesson=lesson_number).first()
-        if not pages_exist:
+        graph = get_lesson_graph()
+        pages = graph.pages_of(lesson_number)
+        if not pages:
             raise ValueError(f"Нет страниц для урока {lesson_number}.")
-        last_page_query = (
-            self.session.query(Pages.num_page)
-            .filter_by(num_lesson=lesson_number)
-            .order_by(Pages.num_page.desc()).first()
-        )
-        if last_page_query is None:
-            raise ValueError(f"Ошибка: не найдена последняя страница урока {lesson_number}.")
-        last_page = last_page_query.num_page
-        next_lesson_available = any(l > lesson_number for l in self.lessons)
+        last_page = pages[-1].num_page
+        next_lesson_available = graph.has_next_lesson(lesson_number)
         return self.generate_page_buttons(last_page, next_lesson_available)
 
     def generate_page_buttons(self, last_page, next_lesson_available):
@@ -152,14 +103,10 @@ class ChooseLessons:
 
     def next_page(self):
         """Переход на следующую страницу урока"""
-        last_page_query = (
-            self.session.query(Pages.num_page)
-            .filter_by(num_lesson=self.current_lesson)
-            .order_by(Pages.num_page.desc()).first()
-        )
-        if last_page_query is None:
+        pages = get_lesson_graph().pages_of(self.current_lesson)
+        if not pages:
             raise ValueError(f"Ошибка: не найдена последняя страница урока {self.current_lesson}.")
-        last_page = last_page_query.num_page
+        last_page = pages[-1].num_page
         if self.current_page < last_page:
             self.current_page += 1
 
@@ -169,18 +116,11 @@ class ChooseLessons:
             self.current_page -= 1
     async def show_lessons_list(self, message: Message):
         """Показывает список уроков"""
-        lessons = await get_lessons_from_db()
-        unique_lessons = set(lesson.num_lesson for lesson in lessons)
-        
-        # Создание кнопок для каждого уникального урока
-        lesson_buttons = []
-        for num_lesson in sorted(unique_lessons):
-            button_text = f"Урок {num_lesson}"
-            callback_data = f"lesson_{num_lesson}"
-            lesson_buttons.append([InlineKeyboardButton(text=button_text, callback_data=callback_data)])
-        
-        # Формирование inline-клавиатуры
-        keyboard = InlineKeyboardMarkup(inline_keyboard=lesson_buttons)
+        # Клавиатура собрана заранее: запросов к БД нет
+        keyboard = await lesson_keyboards.get(LESSONS)
+        if keyboard is None:
+            await message.answer("Уроков пока нет.")
+            return
         await message.answer("Выберите урок:", reply_markup=keyboard)
         
     def create_navigation_markup(current_page, total_pages, next_lesson_available=False):
@@ -199,46 +139,15 @@ class ChooseLessons:
     
     async def send_current_page(bot, chat_id, lesson_number, page_number):
         """Отправка текущей страницы урока пользователю"""
-        with SessionLocal() as session:
-            lesson = session.query(Pages).filter_by(num_lesson=lesson_number, num_page=page_number).first()
-            if lesson:
-                message_id = lesson.num_message
-                original_channel_id = "@SpravEnglish"
-                
-                # Сначала получаем информацию о сообщении
-                channel_message = await bot.get_message(original_channel_id, message_id)
-                text = channel_message.text
-                entities = channel_message.entities
-                
-                # Затем создаем новую клавиатуру
-                last_page_query = (
-                    session.query(Pages.num_page)
-                    .filter_by(num_lesson=lesson_number)
-                    .order_by(Pages.num_page.desc()).first()
-                )
-                if last_page_query is None:
-                    await bot.send_message(chat_id, "Ошибка: не найдена последняя страница урока.")
-                    return
-                last_page = last_page_query.num_page
-                next_lesson_available = any(l > lesson_number for l in await get_lessons_from_db())
-                navigation_markup = ChooseLessons.create_navigation_markup(page_number, last_page, next_lesson_available)
-                
-                # Далее отправляем сообщение с клавиатурой
-                new_message = await bot.send_message(
-                    chat_id=chat_id,
-                    text=text,
-                    parse_mode='HTML',  # Или 'Markdown'
-                    entities=entities,
-                    reply_markup=navigation_markup
-                )
-                
-                # Дополнительно добавляем forward, если хочешь оставить оригинальный вид сообщения
-                await bot.forward_message(
-                    chat_id=chat_id,
-                    from_chat_id=original_channel_id,
-                    message_id=message_id
-                )
-            else:
-                await bot.send_message(chat_id, "Ничего не найдено.")
-
+        graph = await _lesson_graph()
+        lesson = graph.find_page(lesson_number, page_number)
+        if lesson:
+            # Создаем клавиатуру навигации
+            last_page = graph.pages_of(lesson_number)[-1].num_page
+            next_lesson_available = graph.has_next_lesson(lesson_number)
+            navigation_markup = ChooseLessons.create_navigation_markup(page_number, last_page, next_lesson_available)
 
+            # Содержимое страницы берётся из снимка поста канала
+            await lesson_content.send(bot, chat_id, lesson, navigation_markup)
+        else:
+            await bot.send_message(chat_id, "Ничего не найдено.")
@@ -0,0 +1,255 @@
+"""
+Содержимое страниц уроков.
+
+Страница урока — это пост канала ``CHANNEL_NAME``. Раньше каждый показ
+страницы копировал пост из канала (``copy_message``), то есть зависел от
+чужого чата на самом горячем пути чтения. Теперь содержимое поста (текст,
+разметка и file_id медиа) один раз снимается в таблицу ``page_contents``
+по ``Pages.id``, а страницы отправляются из снимка, хранящегося в памяти.
+
+Снимок делается пересылкой поста в служебный чат ``LESSONS_STORAGE_CHAT``:
+Bot API не умеет читать сообщения канала по номеру, а пересланное сообщение
+возвращается целиком. Копия сразу удаляется. У каждого снимка есть etag —
+хеш содержимого; при повторном снятии запись обновляется, только если пост
+изменился. Если бот — администратор канала, отредактированные посты
+(``edited_channel_post``) обновляют снимок сразу.
+
+Снятие всех страниц::
+
+    BOT_TOKEN=... LESSONS_STORAGE_CHAT=-100123 python -m lessons.content
+    BOT_TOKEN=123:fake TELEGRAM_API_URL=http://127.0.0.1:8081 LESSONS_STORAGE_CHAT=1 python -m lessons.content
+
+Страницы без снимка по-прежнему копируются из канала.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import InlineKeyboardMarkup, Message, MessageEntity
+from sqlalchemy import event
+
+from db_layer.async_repository import run_in_db_thread, save_page_content
+from db_layer.models import PageContent
+from db_layer.repository import get_page_contents
+from lessons.navigation import PageNode, get_lesson_graph
+
+logger = logging.getLogger(__name__)
+
+LESSONS_CHANNEL = os.getenv('CHANNEL_NAME', '@SpravEnglish')
+LESSONS_STORAGE_CHAT = os.getenv('LESSONS_STORAGE_CHAT')
+
+# Виды медиа в порядке проверки: у анимации заполнено и поле document
+MEDIA_KINDS = ('photo', 'video', 'animation', 'document', 'audio', 'voice')
+
+
+class PageSnapshot(NamedTuple):
+    kind: str
+    text: Optional[str]
+    entities: List[dict]
+    file_id: Optional[str]
+    etag: str
+
+
+def compute_etag(kind: str, text: Optional[str], entities: List[dict], file_id: Optional[str]) -> str:
+    """Хеш содержимого поста: совпадает, пока пост не изменился."""
+    payload = json.dumps([kind, text, entities, file_id], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def snapshot_message(message: Message) -> Optional[PageSnapshot]:
+    """Снимок сообщения или None, если такой вид сообщений не поддерживается (опрос, стикер)."""
+    kind, file_id = 'text', None
+    for media in MEDIA_KINDS:
+        value = getattr(message, media)
+        if value:
+            kind = media
+            file_id = value[-1].file_id if media == 'photo' else value.file_id
+            break
+    if kind == 'text':
+        if message.text is None:
+            return None
+        text, raw_entities = message.text, message.entities
+    else:
+        text, raw_entities = message.caption, message.caption_entities
+    entities = [entity.model_dump(mode='json', exclude_none=True) for entity in raw_entities or ()]
+    return PageSnapshot(kind, text, entities, file_id, compute_etag(kind, text, entities, file_id))
+
+
+def is_lessons_channel(message: Message, channel: Union[str, int] = LESSONS_CHANNEL) -> bool:
+    """Пришло ли сообщение из канала уроков (канал задан как @username или числовой id)."""
+    channel = str(channel)
+    if channel.startswith('@'):
+        return (message.chat.username or '').lower() == channel[1:].lower()
+    return str(message.chat.id) == channel
+
+
+class LessonContent:
+    """Снимки страниц уроков в памяти процесса: page_id → PageSnapshot."""
+
+    def __init__(self, channel: Union[str, int] = LESSONS_CHANNEL):
+        self.channel = channel
+        self._lock = threading.Lock()
+        self._snapshots: Dict[int, PageSnapshot] = {}
+        self._stale = True
+        self.served = 0
+        self.fallbacks = 0
+        self.refreshed = 0
+
+    def load(self) -> None:
+        """Перечитывает все снимки из базы данных."""
+        with self._lock:
+            self._stale = False
+            self._snapshots = {
+                row.page_id: PageSnapshot(row.kind, row.text, list(row.entities or ()), row.file_id, row.etag)
+                for row in get_page_contents()
+            }
+
+    def invalidate(self) -> None:
+        self._stale = True
+
+    def is_stale(self) -> bool:
+        return self._stale
+
+    def get(self, page_id: int) -> Optional[PageSnapshot]:
+        return self._snapshots.get(page_id)
+
+    async def send(self, bot: Bot, chat_id: int, page: PageNode,
+                   reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        """Отправляет страницу из снимка; без снимка копирует пост из канала."""
+        if self.is_stale():
+            await run_in_db_thread(self.load)
+        snapshot = self.get(page.id)
+        if snapshot is None:
+            self.fallbacks += 1
+            await bot.copy_message(chat_id=chat_id, from_chat_id=self.channel, message_id=page.num_message,
+                                   reply_markup=reply_markup)
+            return
+        self.served += 1
+        entities = [MessageEntity.model_validate(entity) for entity in snapshot.entities] or None
+        if snapshot.kind == 'text':
+            await bot.send_message(chat_id, snapshot.text, entities=entities, parse_mode=None,
+                                   reply_markup=reply_markup)
+            return
+        send_media = getattr(bot, f'send_{snapshot.kind}')
+        await send_media(chat_id, snapshot.file_id, caption=snapshot.text, caption_entities=entities,
+                         parse_mode=None, reply_markup=reply_markup)
+
+    async def _save(self, page: PageNode, snapshot: PageSnapshot) -> str:
+        status = await save_page_content(page.id, str(self.channel), page.num_message, snapshot.kind,
+                                         snapshot.text, snapshot.entities, snapshot.file_id, snapshot.etag)
+        self._snapshots[page.id] = snapshot
+        if status != 'unchanged':
+            self.refreshed += 1
+        return status
+
+    async def ingest_page(self, bot: Bot, page: PageNode, storage_chat: Union[str, int]) -> str:
+        """
+        Снимает пост страницы пересылкой в служебный чат.
+        Возвращает 'created', 'updated', 'unchanged' или 'unsupported'.
+        """
+        copy = await bot.forward_message(chat_id=storage_chat, from_chat_id=self.channel,
+                                         message_id=page.num_message, disable_notification=True)
+        try:
+            snapshot = snapshot_message(copy)
+        finally:
+            try:
+                await bot.delete_message(chat_id=storage_chat, message_id=copy.message_id)
+            except TelegramAPIError as e:
+                logger.warning(f"Не удалось удалить пересланную копию страницы {page.id}: {e}")
+        if snapshot is None:
+            return 'unsupported'
+        return await self._save(page, snapshot)
+
+    async def ingest_all(self, bot: Bot, storage_chat: Union[str, int], only_missing: bool = False) -> Counter:
+        """Снимает все страницы уроков; возвращает количество страниц по результату."""
+        if self.is_stale():
+            await run_in_db_thread(self.load)
+        graph = await run_in_db_thread(get_lesson_graph)
+        results: Counter = Counter()
+        for page in graph.pages.values():
+            if only_missing and self.get(page.id) is not None:
+                continue
+            try:
+                results[await self.ingest_page(bot, page, storage_chat)] += 1
+            except TelegramAPIError as e:
+                logger.warning(f"Страница {page.id} (пост {page.num_message}) не снята: {e}")
+                results['failed'] += 1
+        return results
+
+    async def update_from_post(self, message: Message) -> Optional[str]:
+        """
+        Обновляет снимки страниц по новому или отредактированному посту канала.
+        Возвращает результат сохранения или None, если пост не относится к урокам.
+        """
+        if not is_lessons_channel(message, self.channel):
+            return None
+        graph = await run_in_db_thread(get_lesson_graph)
+        pages = graph.pages_by_message(message.message_id)
+        snapshot = snapshot_message(message) if pages else None
+        if snapshot is None:
+            return None
+        status = 'unchanged'
+        for page in pages:
+            result = await self._save(page, snapshot)
+            if result != 'unchanged':
+                status = result
+        return status
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'pages': len(self._snapshots),
+            'served': self.served,
+            'fallbacks': self.fallbacks,
+            'refreshed': self.refreshed,
+        }
+
+
+lesson_content = LessonContent()
+
+
+def _invalidate_lesson_content(mapper, connection, target):
+    lesson_content.invalidate()
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(PageContent, _event_name, _invalidate_lesson_content)
+
+
+async def _ingest(args) -> None:
+    if os.getenv('TELEGRAM_API_URL'):
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        bot = Bot(token=os.getenv('BOT_TOKEN'),
+                  session=AiohttpSession(api=TelegramAPIServer.from_base(os.getenv('TELEGRAM_API_URL'))))
+    else:
+        bot = Bot(token=os.getenv('BOT_TOKEN'))
+    try:
+        results = await lesson_content.ingest_all(bot, args.storage_chat, only_missing=args.only_missing)
+    finally:
+        await bot.session.close()
+    print(', '.join(f"{status}: {count}" for status, count in sorted(results.items())) or "Страниц нет")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Снимок постов канала со страницами уроков")
+    parser.add_argument("--storage-chat", default=LESSONS_STORAGE_CHAT,
+                        help="служебный чат для пересылки (по умолчанию LESSONS_STORAGE_CHAT)")
+    parser.add_argument("--only-missing", action="store_true", help="снимать только страницы без снимка")
+    args = parser.parse_args()
+    if not args.storage_chat:
+        parser.error("нужен служебный чат: --storage-chat или LESSONS_STORAGE_CHAT")
+    from db_layer.migrations import run_migrations
+    run_migrations()
+    asyncio.run(_ingest(args))
+
+
+if __name__ == '__main__':
+    main()
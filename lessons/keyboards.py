@@ -0,0 +1,187 @@
+"""
+Готовые клавиатуры меню уроков.
+
+Списки уроков (для тренировки слов, грамматики и для чтения уроков) и списки
+страниц урока разбиты на страницы по ``LESSON_MENU_PAGE_SIZE`` кнопок.
+Каждая клавиатура строится один раз по графу навигации и количеству слов
+и предложений в уроках и хранится по ключу (вид меню, урок), поэтому
+открытие меню не обращается к базе данных.
+
+Кэш сбрасывается при изменении таблиц страниц, слов и предложений
+(события маппера); первое обращение после этого перечитывает граф
+и количество слов одним проходом в потоке репозитория.
+"""
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import event
+
+from bot_core.callbacks import CallbackAction
+from db_layer.async_repository import run_in_db_thread
+from db_layer.models import Pages, Sentence, Word
+from db_layer.repository import get_lesson_counts
+from learning_modules.grammar import GRAMMAR_MODE
+from learning_modules.words import WORDS_MODE
+from lessons.navigation import LessonGraph, get_lesson_graph
+
+PAGE_SIZE = int(os.getenv('LESSON_MENU_PAGE_SIZE', 10))
+
+# Виды меню
+WORDS = 'words'         # уроки для тренировки слов
+GRAMMAR = 'grammar'     # уроки для тренировки грамматики
+LESSONS = 'lessons'     # уроки для чтения
+PAGES = 'pages'         # страницы одного урока
+
+# Выбор урока в списке уроков
+LESSON = CallbackAction('lesson', 'ls', (('lesson', int), ))
+# Показ страницы урока по Pages.id
+PAGE = CallbackAction('page', 'pg', (('page', int), ))
+# Возврат к списку уроков
+LESSONS_LIST = CallbackAction('lessons_list', 'll')
+# Листание меню: вид меню, страница меню и урок (для списка страниц урока)
+LESSON_MENU = CallbackAction('lesson_menu', 'lm', (('kind', str), ('page', int), ('lesson', int)))
+
+
+class LessonCounts(NamedTuple):
+    pages: int
+    words: int
+    sentences: int
+
+
+class LessonKeyboards:
+    """
+    Кэш клавиатур меню уроков: для каждого вида меню (и урока для списка
+    страниц) хранятся клавиатуры всех страниц меню.
+
+    Параметры:
+    ----------
+    page_size : int
+        Количество кнопок уроков (страниц) на одной странице меню.
+    """
+
+    def __init__(self, page_size: int = PAGE_SIZE):
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._stale = True
+        self._graph: Optional[LessonGraph] = None
+        self._counts: Dict[int, LessonCounts] = {}
+        # (вид, урок) → клавиатуры всех страниц меню
+        self._keyboards: Dict[Tuple[str, Optional[int]], Tuple[InlineKeyboardMarkup, ...]] = {}
+        self.hits = 0
+        self.builds = 0
+        self.refreshes = 0
+
+    def invalidate(self) -> None:
+        """Помечает клавиатуры устаревшими; они будут перестроены при следующем обращении."""
+        self._stale = True
+
+    def is_stale(self) -> bool:
+        return self._stale or self._graph is None
+
+    def refresh(self) -> None:
+        """Перечитывает граф уроков и количество слов и предложений (выполняется в потоке БД)."""
+        with self._lock:
+            self._stale = False
+            graph = get_lesson_graph()
+            counts = get_lesson_counts()
+            self._counts = {
+                lesson: LessonCounts(len(graph.pages_of(lesson)), *counts.get(lesson, (0, 0)))
+                for lesson in graph.lessons
+            }
+            self._graph = graph
+            self._keyboards = {}
+            self.refreshes += 1
+
+    def counts(self, lesson: int) -> LessonCounts:
+        """Количество страниц, слов и предложений урока."""
+        return self._counts.get(lesson, LessonCounts(0, 0, 0))
+
+    def _items(self, kind: str, lesson: Optional[int]) -> List[InlineKeyboardButton]:
+        graph = self._graph
+        if kind == PAGES:
+            return [
+                InlineKeyboardButton(text=f"{page.name_page or page.num_page}", callback_data=PAGE.pack(page=page.id))
+                for page in graph.pages_of(lesson)
+            ]
+        buttons = []
+        for num in graph.lessons:
+            counts = self.counts(num)
+            if kind == WORDS:
+                text, data = f"Урок {num} · {counts.words} сл.", WORDS_MODE.pack(mode='st', lesson=num)
+            elif kind == GRAMMAR:
+                text, data = f"Урок {num} · {counts.sentences} предл.", GRAMMAR_MODE.pack(mode='st', lesson=num)
+            elif kind == LESSONS:
+                text = f"Урок {num} · {counts.pages} стр., {counts.words} сл., {counts.sentences} предл."
+                data = LESSON.pack(lesson=num)
+            else:
+                return []
+            buttons.append(InlineKeyboardButton(text=text, callback_data=data))
+        return buttons
+
+    def _build(self, kind: str, lesson: Optional[int]) -> Tuple[InlineKeyboardMarkup, ...]:
+        """Все страницы меню: кнопки уроков (страниц) и навигация « / »."""
+        items = self._items(kind, lesson)
+        pages = (len(items) + self.page_size - 1) // self.page_size
+        markups = []
+        for page in range(pages):
+            start = page * self.page_size
+            rows = [[button] for button in items[start:start + self.page_size]]
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton(
+                    text=f"« {page}", callback_data=LESSON_MENU.pack(kind=kind, page=page - 1, lesson=lesson)))
+            if page + 1 < pages:
+                navigation.append(InlineKeyboardButton(
+                    text=f"{page + 2} »", callback_data=LESSON_MENU.pack(kind=kind, page=page + 1, lesson=lesson)))
+            if navigation:
+                rows.append(navigation)
+            markups.append(InlineKeyboardMarkup(inline_keyboard=rows))
+        return tuple(markups)
+
+    def keyboard(self, kind: str, page: int = 0, lesson: Optional[int] = None) -> Optional[InlineKeyboardMarkup]:
+        """
+        Клавиатура страницы меню без обращения к базе данных (кэш должен быть
+        свежим, см. ``get``). Номер страницы приводится к допустимому диапазону.
+        Возвращает None, если в меню нет ни одной кнопки.
+        """
+        if self._graph is None:
+            return None
+        key = (kind, lesson if kind == PAGES else None)
+        markups = self._keyboards.get(key)
+        if markups is None:
+            markups = self._keyboards[key] = self._build(*key)
+            self.builds += 1
+        else:
+            self.hits += 1
+        if not markups:
+            return None
+        return markups[min(max(page, 0), len(markups) - 1)]
+
+    async def get(self, kind: str, page: int = 0, lesson: Optional[int] = None) -> Optional[InlineKeyboardMarkup]:
+        """Клавиатура страницы меню; после изменений в уроках кэш перечитывается в потоке БД."""
+        if self.is_stale():
+            await run_in_db_thread(self.refresh)
+        return self.keyboard(kind, page, lesson)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'lessons': len(self._counts),
+            'menus': len(self._keyboards),
+            'hits': self.hits,
+            'builds': self.builds,
+            'refreshes': self.refreshes,
+        }
+
+
+lesson_keyboards = LessonKeyboards()
+
+
+def _invalidate_lesson_keyboards(mapper, connection, target):
+    lesson_keyboards.invalidate()
+
+
+for _model in (Pages, Word, Sentence):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _invalidate_lesson_keyboards)
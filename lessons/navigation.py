@@ -0,0 +1,125 @@
+"""
+Граф навигации по урокам и страницам.
+
+Все страницы загружаются одним запросом и связываются в цепочку
+в порядке (num_lesson, num_page): у каждой страницы есть id предыдущей
+и следующей, включая переходы между уроками. Граф неизменяемый,
+при перезагрузке строится новый и подменяется одним присваиванием,
+поэтому обработчики никогда не видят его в промежуточном состоянии.
+"""
+import threading
+from types import MappingProxyType
+from typing import Iterable, Mapping, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event
+
+from db_layer.models import Pages
+from db_layer.repository import get_all_pages
+
+
+class PageNode(NamedTuple):
+    id: int
+    num_lesson: int
+    num_page: int
+    num_message: int
+    name_page: Optional[str]
+    prev_id: Optional[int]
+    next_id: Optional[int]
+
+
+class LessonGraph:
+    """
+    Неизменяемый граф страниц: page_id → PageNode и урок → страницы по порядку.
+    """
+    __slots__ = ('pages', 'lessons', '_lesson_pages', '_message_pages')
+
+    def __init__(self, pages: Mapping[int, PageNode], lesson_pages: Mapping[int, Tuple[PageNode, ...]]):
+        self.pages = MappingProxyType(dict(pages))
+        self._lesson_pages = MappingProxyType(dict(lesson_pages))
+        self.lessons: Tuple[int, ...] = tuple(sorted(lesson_pages))
+        message_pages = {}
+        for node in self.pages.values():
+            message_pages.setdefault(node.num_message, []).append(node)
+        self._message_pages = MappingProxyType({num: tuple(nodes) for num, nodes in message_pages.items()})
+
+    def page(self, page_id: int) -> Optional[PageNode]:
+        """Страница по её идентификатору."""
+        return self.pages.get(page_id)
+
+    def pages_of(self, lesson_num: int) -> Tuple[PageNode, ...]:
+        """Страницы урока, отсортированные по номеру."""
+        return self._lesson_pages.get(lesson_num, ())
+
+    def find_page(self, lesson_num: int, num_page: int) -> Optional[PageNode]:
+        """Страница урока по её номеру."""
+        for node in self.pages_of(lesson_num):
+            if node.num_page == num_page:
+                return node
+        return None
+
+    def pages_by_message(self, num_message: int) -> Tuple[PageNode, ...]:
+        """Страницы, которые показывают пост канала с этим номером."""
+        return self._message_pages.get(num_message, ())
+
+    def has_next_lesson(self, lesson_num: int) -> bool:
+        """Есть ли урок с большим номером."""
+        return bool(self.lessons) and self.lessons[-1] > lesson_num
+
+
+def build_lesson_graph(pages: Iterable[Pages]) -> LessonGraph:
+    """Строит граф из страниц, отсортированных по (num_lesson, num_page)."""
+    ordered = sorted(pages, key=lambda page: (page.num_lesson, page.num_page))
+    nodes = {}
+    lesson_pages = {}
+    for idx, page in enumerate(ordered):
+        node = PageNode(
+            id=page.id,
+            num_lesson=page.num_lesson,
+            num_page=page.num_page,
+            num_message=page.num_message,
+            name_page=page.name_page,
+            prev_id=ordered[idx - 1].id if idx > 0 else None,
+            next_id=ordered[idx + 1].id if idx + 1 < len(ordered) else None,
+        )
+        nodes[node.id] = node
+        lesson_pages.setdefault(node.num_lesson, []).append(node)
+    return LessonGraph(nodes, {lesson: tuple(items) for lesson, items in lesson_pages.items()})
+
+
+_graph: Optional[LessonGraph] = None
+_stale = True
+_lock = threading.Lock()
+
+
+def reload_lesson_graph() -> LessonGraph:
+    """Перечитывает страницы из базы данных и подменяет текущий граф."""
+    global _graph, _stale
+    with _lock:
+        _stale = False
+        _graph = build_lesson_graph(get_all_pages())
+        return _graph
+
+
+def is_lesson_graph_stale() -> bool:
+    """True, если граф ещё не построен или таблица страниц менялась."""
+    return _graph is None or _stale
+
+
+def get_lesson_graph() -> LessonGraph:
+    """
+    Возвращает текущий граф. Если таблица страниц менялась, граф
+    перестраивается (страниц немного, это один быстрый запрос).
+    """
+    graph = _graph
+    if is_lesson_graph_stale():
+        graph = reload_lesson_graph()
+    return graph
+
+
+def _invalidate_lesson_graph(mapper, connection, target):
+    global _stale
+    _stale = True
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Pages, _event_name, _invalidate_lesson_graph)
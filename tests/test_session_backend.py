@@ -0,0 +1,113 @@
+"""
+Тесты Redis-хранилища сессий на fakeredis (нужен пакет ``fakeredis[lua]``).
+"""
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from cache_system.session_backend import RedisSessionBackend, SessionConflict
+from learning_modules.sessions import WordState
+
+
+def make_backend() -> RedisSessionBackend:
+    return RedisSessionBackend(fakeredis.aioredis.FakeRedis(decode_responses=True), idle_ttl=60)
+
+
+def test_save_and_load_round_trip():
+    async def scenario():
+        backend = make_backend()
+        async with backend.session('words', 1, WordState) as state:
+            state.word_id = 42
+            state.options = ('кот', 'собака', 'дом')
+            state.correct_index = 1
+
+        async with backend.session('words', 1, WordState, create=False) as state:
+            assert state.word_id == 42
+            assert list(state.options) == ['кот', 'собака', 'дом']
+            assert state.correct_index == 1
+
+        raw = await backend.client.get(backend._key('words', 1))
+        assert raw.startswith('1|')
+        assert backend.stats() == {'loads': 2, 'saves': 1, 'conflicts': 0}
+
+    asyncio.run(scenario())
+
+
+def test_missing_session_without_create():
+    async def scenario():
+        backend = make_backend()
+        async with backend.session('words', 1, WordState, create=False) as state:
+            assert state is None
+        assert await backend.client.get(backend._key('words', 1)) is None
+
+    asyncio.run(scenario())
+
+
+def test_version_mismatch_is_rejected():
+    async def scenario():
+        backend = make_backend()
+        async with backend.session('words', 1, WordState) as state:
+            state.word_id = 1
+
+        redis_key = backend._key('words', 1)
+        with pytest.raises(SessionConflict):
+            async with backend.session('words', 1, WordState) as state:
+                # Другой воркер сохранил сессию после нашего чтения
+                await backend.client.set(redis_key, '5|[]')
+                state.word_id = 2
+
+        assert await backend.client.get(redis_key) == '5|[]'
+        assert backend.conflicts == 1
+
+    asyncio.run(scenario())
+
+
+def test_double_tap_conflict():
+    async def scenario():
+        backend = make_backend()
+        async with backend.session('words', 1, WordState) as state:
+            state.word_id = 1
+            state.number = 0
+
+        first_loaded, second_saved = asyncio.Event(), asyncio.Event()
+
+        async def tap(number: int, wait_for: asyncio.Event = None, signal: asyncio.Event = None):
+            async with backend.session('words', 1, WordState) as state:
+                if signal is not None:
+                    signal.set()
+                if wait_for is not None:
+                    await wait_for.wait()
+                state.number = number
+
+        async def second_tap():
+            await first_loaded.wait()
+            await tap(2)
+            second_saved.set()
+
+        results = await asyncio.gather(
+            tap(1, wait_for=second_saved, signal=first_loaded), second_tap(), return_exceptions=True,
+        )
+        assert isinstance(results[0], SessionConflict)
+        assert results[1] is None
+
+        async with backend.session('words', 1, WordState, create=False) as state:
+            assert state.number == 2
+        assert backend.stats()['conflicts'] == 1
+
+    asyncio.run(scenario())
+
+
+def test_unchanged_session_is_not_written():
+    async def scenario():
+        backend = make_backend()
+        async with backend.session('words', 1, WordState) as state:
+            state.word_id = 1
+        async with backend.session('words', 1, WordState):
+            pass
+        assert backend.saves == 1
+        assert (await backend.client.get(backend._key('words', 1))).startswith('1|')
+
+    asyncio.run(scenario())
@@ -1,7 +1,7 @@
-from db_layer.repository import add_user, get_user_by_telegram_id
+from db_layer.async_repository import add_user, get_user_by_telegram_id
 
 async def create_new_user(data):
-    return add_user(data)
+    return await add_user(data)
 
 async def fetch_user_by_tg_id(tg_id):
-    return get_user_by_telegram_id(tg_id)
\ No newline at end of file
+    return await get_user_by_telegram_id(tg_id)
\ No newline at end of file